@@ -0,0 +1,5 @@
+"""
+Benchmarks for the Customer service
+
+Like the tests these need a CouchDB server, see service/models.py
+"""
@@ -0,0 +1,53 @@
+"""
+Benchmark of the customer import on a synthetic CSV file
+
+Rows are read, validated and batched by the real import pipeline, while
+the _bulk_docs requests are simulated by waiting a fixed time per batch,
+so the benchmark shows how much the concurrent batches hide the latency of
+the database. No database is needed.
+
+Run it with:
+  python -m benchmarks.bulk_import [rows] [milliseconds per batch]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+from service.commands.importer import Importer, open_source, read_records
+
+HEADER = 'firstname,lastname,email,subscribed,address1,address2,city,province,country,zip\n'
+
+
+def main(rows=1000000, latency_ms=50):
+    """ Times imports of the same file with more and more batches in flight """
+    workdir = tempfile.mkdtemp(prefix='import-')
+    try:
+        path = os.path.join(workdir, 'customers.csv')
+        with open(path, 'w') as output:
+            output.write(HEADER)
+            for number in range(rows):
+                output.write('First{0},Last{0},c{0}@email.com,true,{0} Main St,,City{1},NY,USA,'
+                             '{1:05d}\n'.format(number, number % 99999))
+
+        def write(documents):
+            """ Pretends to be a _bulk_docs request """
+            time.sleep(latency_ms / 1000.0)
+            return [None] * len(documents)
+
+        for workers in (1, 4, 8):
+            source = open_source(path)
+            try:
+                stats = Importer(write, workers=workers).run(read_records(source, 'csv'))
+            finally:
+                source.close()
+            print('{} workers: {} rows in {:.1f}s ({:.0f}/sec), {} rejected'.format(
+                workers, stats['rows'], stats['seconds'], stats['rows_per_second'],
+                stats['rejected']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,328 @@
+"""
+In-memory stand-in for CouchDB used by the benchmarks
+
+Answers the CouchDB endpoints the service uses (sessions, databases,
+documents, _all_docs, _find with equality selectors, the by_email view,
+_bulk_docs and the _changes feed) after waiting a fixed latency, so
+the servers can be load tested where no CouchDB is running. A share of the
+requests can be made to wait much longer, like the occasional slow answers
+of a remote Cloudant. It is not a database: there are no real revisions
+trees, indexes or persistence.
+
+Run it on its own with:
+  python -m benchmarks.couch_standin [port] [latency ms] [slow share] [slow latency ms]
+"""
+from __future__ import print_function
+import sys
+import json
+import uuid
+import random
+import asyncio
+from collections import OrderedDict
+from aiohttp import web
+
+
+def _rev(document=None):
+    """ Returns the next revision of a document """
+    number = int(document['_rev'].split('-')[0]) + 1 if document else 1
+    return '{}-{}'.format(number, uuid.uuid4().hex)
+
+
+def _matches(document, selector):
+    """ True if a document equals every field of a selector, or is above its $gt """
+    for field, wanted in selector.items():
+        value = document.get(field)
+        if isinstance(wanted, dict) and '$gt' in wanted:
+            if value is None or (wanted['$gt'] is not None and value <= wanted['$gt']):
+                return False
+        elif isinstance(wanted, dict):
+            if not isinstance(value, dict) or not _matches(value, wanted):
+                return False
+        elif value != wanted:
+            return False
+    return True
+
+
+def _json_param(request, name, default=None):
+    """ Reads a query parameter that CouchDB decodes as JSON """
+    if name not in request.query:
+        return default
+    return json.loads(request.query[name])
+
+
+class CouchStandIn(object):
+    """ The databases and the handlers of the stand-in """
+
+    def __init__(self, latency=0.02, slow_share=0, slow_latency=0):
+        self.latency = latency
+        self.slow_share = slow_share
+        self.slow_latency = slow_latency
+        self.databases = {}     # name -> id -> document
+        self.logs = {}          # name -> id -> its last change, oldest first
+        self.sequences = {}     # name -> number of the last change
+        self.events = {}        # name -> event set on the next change
+
+    def application(self):
+        """ Returns the aiohttp application """
+        @web.middleware
+        async def slow(request, handler):
+            """ Waits the latency of a database round trip """
+            lagging = self.slow_share and random.random() < self.slow_share
+            await asyncio.sleep(self.slow_latency if lagging else self.latency)
+            return await handler(request)
+
+        app = web.Application(middlewares=[slow], client_max_size=64 * 1024 * 1024)
+        # the cloudant library asks for //db when the server url ends with a slash
+        root = '/{_slashes:/*}'
+        app.router.add_get(root, self.welcome)
+        app.router.add_route('*', root + '_session', self.session)
+        app.router.add_get(root + '_all_dbs', self.all_dbs)
+        app.router.add_route('*', root + '{db}', self.database)
+        app.router.add_route('*', root + '{db}/_all_docs', self.all_docs)
+        app.router.add_post(root + '{db}/_find', self.find)
+        app.router.add_post(root + '{db}/_index', self.index)
+        app.router.add_post(root + '{db}/_bulk_docs', self.bulk_docs)
+        app.router.add_get(root + '{db}/_changes', self.changes)
+        app.router.add_route('*', root + '{db}/_design/{name}/_view/{view}', self.view)
+        app.router.add_route('*', root + '{db}/_design/{name}', self.design_document)
+        app.router.add_route('*', root + '{db}/{id}', self.document)
+        return app
+
+    async def welcome(self, request):
+        """ GET / """
+        return web.json_response({'couchdb': 'Welcome', 'version': '2.3.1'})
+
+    async def session(self, request):
+        """ Every login succeeds """
+        response = web.json_response({'ok': True, 'name': 'admin', 'roles': ['_admin'],
+                                      'userCtx': {'name': 'admin', 'roles': ['_admin']}})
+        response.set_cookie('AuthSession', 'stand-in')
+        return response
+
+    async def all_dbs(self, request):
+        """ GET /_all_dbs """
+        return web.json_response(sorted(self.databases))
+
+    async def database(self, request):
+        """ Creates, checks or posts a document to a database """
+        name = request.match_info['db']
+        if request.method == 'PUT':
+            if name in self.databases:
+                return web.json_response({'error': 'file_exists'}, status=412)
+            self.databases[name] = {}
+            self.logs[name] = OrderedDict()
+            self.sequences[name] = 0
+            return web.json_response({'ok': True}, status=201)
+        if name not in self.databases:
+            return web.json_response({'error': 'not_found'}, status=404)
+        if request.method == 'POST':
+            return self._save(name, await request.json())
+        if request.method == 'DELETE':
+            del self.databases[name]
+            del self.logs[name]
+            return web.json_response({'ok': True})
+        return web.json_response({'db_name': name, 'doc_count': len(self.databases[name])})
+
+    def _save(self, name, document, document_id=None):
+        """ Writes a document unless its _rev is out of date """
+        documents = self.databases[name]
+        document_id = document_id or document.get('_id') or uuid.uuid4().hex
+        current = documents.get(document_id)
+        if current is not None and document.get('_rev') != current['_rev']:
+            return web.json_response({'error': 'conflict',
+                                      'reason': 'Document update conflict.'}, status=409)
+        if current is None and document.get('_rev'):
+            return web.json_response({'error': 'not_found', 'reason': 'missing'}, status=404)
+        document = dict(document, _id=document_id, _rev=_rev(current))
+        if document.get('_deleted'):
+            documents.pop(document_id, None)
+            document = {'_id': document_id, '_rev': document['_rev'], '_deleted': True}
+        else:
+            documents[document_id] = document
+        self._log(name, document)
+        return web.json_response({'ok': True, 'id': document_id, 'rev': document['_rev']},
+                                 status=201)
+
+    async def document(self, request):
+        """ Reads, writes or deletes one document """
+        if request.match_info['db'] not in self.databases:
+            return web.json_response({'error': 'not_found'}, status=404)
+        return await self._document(request, request.match_info['db'], request.match_info['id'])
+
+    async def design_document(self, request):
+        """ Reads or writes a design document """
+        if request.match_info['db'] not in self.databases:
+            return web.json_response({'error': 'not_found'}, status=404)
+        return await self._document(request, request.match_info['db'],
+                                    '_design/' + request.match_info['name'])
+
+    async def _document(self, request, name, document_id):
+        """ Handles the methods on a document """
+        if request.method == 'PUT':
+            return self._save(name, await request.json(), document_id)
+        current = self.databases[name].get(document_id)
+        if current is None:
+            return web.json_response({'error': 'not_found', 'reason': 'missing'}, status=404)
+        if request.method == 'DELETE':
+            return self._save(name, {'_rev': request.query.get('rev'), '_deleted': True},
+                              document_id)
+        headers = {'ETag': '"{}"'.format(current['_rev'])}
+        if request.method == 'HEAD':
+            return web.Response(headers=headers)
+        return web.json_response(current, headers=headers)
+
+    async def all_docs(self, request):
+        """ GET or POST /{db}/_all_docs """
+        documents = self.databases.get(request.match_info['db'], {})
+        body = await request.json() if request.method == 'POST' else {}
+        include_docs = request.query.get('include_docs') == 'true'
+        if 'keys' in body:
+            rows = []
+            for key in body['keys']:
+                document = documents.get(key)
+                if document is None:
+                    rows.append({'key': key, 'error': 'not_found'})
+                else:
+                    rows.append({'id': key, 'key': key, 'value': {'rev': document['_rev']}})
+        else:
+            ids = sorted(documents)
+            start = _json_param(request, 'startkey')
+            if start is not None:
+                ids = [document_id for document_id in ids if document_id >= start]
+            end = _json_param(request, 'endkey')
+            if end is not None:
+                ids = [document_id for document_id in ids if document_id <= end]
+            ids = ids[int(request.query.get('skip', 0)):]
+            if 'limit' in request.query:
+                ids = ids[:int(request.query['limit'])]
+            rows = [{'id': document_id, 'key': document_id,
+                     'value': {'rev': documents[document_id]['_rev']}} for document_id in ids]
+        if include_docs:
+            for row in rows:
+                if 'id' in row:
+                    row['doc'] = documents[row['id']]
+        return web.json_response({'total_rows': len(documents), 'offset': 0, 'rows': rows})
+
+    async def find(self, request):
+        """ POST /{db}/_find with a selector of equalities, in id order """
+        documents = self.databases.get(request.match_info['db'], {})
+        body = await request.json()
+        matches = [document for document_id, document in sorted(documents.items())
+                   if not document_id.startswith('_design/') and
+                   _matches(document, body.get('selector', {}))]
+        start = int(body.get('bookmark') or body.get('skip') or 0)
+        limit = body.get('limit', 25)
+        page = matches[start:start + limit]
+        return web.json_response({'docs': page, 'bookmark': str(start + len(page))})
+
+    async def index(self, request):
+        """ POST /{db}/_index """
+        body = await request.json()
+        name = body.get('name') or uuid.uuid4().hex
+        return web.json_response({'result': 'created', 'id': body.get('ddoc') or '_design/' + name,
+                                  'name': name})
+
+    async def bulk_docs(self, request):
+        """ POST /{db}/_bulk_docs """
+        results = []
+        for document in (await request.json())['docs']:
+            response = self._save(request.match_info['db'], document)
+            results.append(json.loads(response.body))
+        return web.json_response(results, status=201)
+
+    def _log(self, name, document):
+        """ Records a change and wakes the feeds waiting for one """
+        self.sequences[name] += 1
+        change = {'seq': '{}-standin'.format(self.sequences[name]), 'id': document['_id'],
+                  'changes': [{'rev': document['_rev']}], 'doc': document}
+        if document.get('_deleted'):
+            change['deleted'] = True
+        log = self.logs[name]
+        log.pop(document['_id'], None)
+        log[document['_id']] = change
+        event = self.events.pop(name, None)
+        if event is not None:
+            event.set()
+
+    def _changes_after(self, name, since, include_docs):
+        """ Returns the last change of every document changed after a sequence number """
+        results = []
+        for change in self.logs.get(name, {}).values():
+            if int(change['seq'].split('-')[0]) > since:
+                if not include_docs:
+                    change = dict((key, value) for key, value in change.items() if key != 'doc')
+                results.append(change)
+        return results
+
+    async def changes(self, request):
+        """ GET /{db}/_changes as a normal, longpoll or continuous feed """
+        name = request.match_info['db']
+        if name not in self.databases:
+            return web.json_response({'error': 'not_found'}, status=404)
+        since = request.query.get('since', '0')
+        since = self.sequences[name] if since == 'now' else int(since.split('-')[0])
+        include_docs = request.query.get('include_docs') == 'true'
+        feed = request.query.get('feed', 'normal')
+        wait = float(request.query.get('heartbeat') or request.query.get('timeout') or 60000)
+        if feed == 'continuous':
+            response = web.StreamResponse()
+            await response.prepare(request)
+            await response.write(b'\n')    # aiohttp holds the headers until the first write
+            while True:
+                event = self.events.setdefault(name, asyncio.Event())
+                for change in self._changes_after(name, since, include_docs):
+                    await response.write(json.dumps(change).encode('utf-8') + b'\n')
+                    since = int(change['seq'].split('-')[0])
+                try:
+                    await asyncio.wait_for(event.wait(), wait / 1000.0)
+                except asyncio.TimeoutError:
+                    await response.write(b'\n')
+        event = self.events.setdefault(name, asyncio.Event())
+        results = self._changes_after(name, since, include_docs)
+        if not results and feed == 'longpoll':
+            try:
+                await asyncio.wait_for(event.wait(), wait / 1000.0)
+            except asyncio.TimeoutError:
+                pass
+            results = self._changes_after(name, since, include_docs)
+        pending = 0
+        if 'limit' in request.query:
+            limit = int(request.query['limit'])
+            pending = max(0, len(results) - limit)
+            results = results[:limit]
+        last_seq = results[-1]['seq'] if results else '{}-standin'.format(since)
+        return web.json_response({'results': results, 'last_seq': last_seq, 'pending': pending})
+
+    async def view(self, request):
+        """ The by_email view, keyed by the lower-cased email of every document """
+        documents = self.databases.get(request.match_info['db'], {})
+        body = await request.json() if request.method == 'POST' else {}
+        keys = body.get('keys')
+        if keys is None:
+            key = _json_param(request, 'key')
+            keys = None if key is None else [key]
+        include_docs = request.query.get('include_docs') == 'true'
+        rows = []
+        for document_id, document in sorted(documents.items()):
+            email = document.get('email')
+            if not isinstance(email, str) or document_id.startswith('_design/'):
+                continue
+            if keys is None or email.lower() in keys:
+                row = {'id': document_id, 'key': email.lower(), 'value': None}
+                if include_docs:
+                    row['doc'] = document
+                rows.append(row)
+        return web.json_response({'total_rows': len(rows), 'offset': 0, 'rows': rows})
+
+
+def serve(port, latency, slow_share=0, slow_latency=0):
+    """ Runs the stand-in until it is killed """
+    web.run_app(CouchStandIn(latency, slow_share, slow_latency).application(),
+                host='127.0.0.1', port=port, print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else 5984,
+          float(sys.argv[2]) / 1000.0 if len(sys.argv) > 2 else 0.02,
+          float(sys.argv[3]) if len(sys.argv) > 3 else 0,
+          float(sys.argv[4]) / 1000.0 if len(sys.argv) > 4 else 0)
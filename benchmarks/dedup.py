@@ -0,0 +1,81 @@
+"""
+Benchmark of the duplicate customer detection job on synthetic customers
+
+Customers are made up by the CustomerFactory and a share of them is copied
+with typos, so the report can be checked against the duplicates planted.
+No database is needed.
+
+Run it with:
+  python -m benchmarks.dedup [customers] [workers]
+"""
+from __future__ import print_function
+import io
+import sys
+import json
+import random
+import multiprocessing
+from tests.customer_factory import CustomerFactory
+from service.commands.dedup import DuplicateFinder
+
+DUPLICATE_SHARE = 0.1
+
+
+def misspell(text):
+    """ Drops or doubles a random letter of a text """
+    if len(text) < 3:
+        return text
+    position = random.randrange(1, len(text) - 1)
+    if random.random() < 0.5:
+        return text[:position] + text[position + 1:]
+    return text[:position] + text[position] + text[position:]
+
+
+def synthetic_customers(count):
+    """ Returns count Customer documents and the pairs of ids that are duplicates """
+    documents = []
+    planted = set()
+    for number in range(count):
+        customer = CustomerFactory()
+        customer.id = 'c{:07d}'.format(number)
+        customer.email = '{}.{}{}@email.com'.format(customer.firstname, customer.lastname,
+                                                     number).lower()
+        documents.append(customer.serialize())
+    for original in random.sample(documents, int(count * DUPLICATE_SHARE)):
+        copy = json.loads(json.dumps(original))
+        copy['_id'] = original['_id'] + '-dup'
+        copy['firstname'] = misspell(copy['firstname'])
+        if random.random() < 0.5:
+            copy['email'] = copy['email'].replace('@', '+shop@')
+        else:
+            copy['email'] = 'other{}@email.com'.format(len(documents))
+            copy['address']['address1'] = copy['address']['address1'].replace(' St', ' Street')
+        documents.append(copy)
+        planted.add((original['_id'], copy['_id']))
+    random.shuffle(documents)
+    return documents, planted
+
+
+def main(count=20000, workers=None):
+    """ Times the job and measures how many planted duplicates it finds """
+    workers = workers or multiprocessing.cpu_count()
+    random.seed(1)
+    print('Generating {} customers...'.format(count))
+    documents, planted = synthetic_customers(count)
+    for processes in sorted(set([1, workers])):
+        report = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+        stats = DuplicateFinder(workers=processes).run(iter(documents), report)
+        found = set()
+        for line in report.getvalue().splitlines():
+            ids = json.loads(line)['ids']
+            found.update((first, second) for first in ids for second in ids if first < second)
+        recall = len(planted & found) / float(len(planted))
+        precision = len(planted & found) / float(len(found)) if found else 1.0
+        print('{} workers: {} customers in {:.2f}s ({:.0f}/sec), {} comparisons, '
+              'recall {:.3f}, precision {:.3f}'.format(
+                  processes, stats['customers'], stats['seconds'],
+                  stats['customers'] / stats['seconds'], stats['comparisons'],
+                  recall, precision))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
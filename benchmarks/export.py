@@ -0,0 +1,76 @@
+"""
+Benchmark of the columnar exports on synthetic customers
+
+Synthetic Customer documents are generated one at a time, as they are read
+from the database, and written to CSV and Parquet while the summary
+statistics are added up. No database is needed.
+
+Run it with:
+  python -m benchmarks.export [customers]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+import shutil
+import resource
+import tempfile
+from service import export
+from service.export import ColumnStats, column_batches, counted, csv_chunks, write_parquet
+
+COUNTRIES = ['USA'] * 6 + ['Canada', 'Mexico', 'UK', 'Germany']
+PROVINCES = ['NY', 'CA', 'TX', 'ON', 'QC', 'BY', 'ENG', 'JAL']
+CITIES = ['City {}'.format(number) for number in range(2000)]
+
+
+def synthetic_documents(count):
+    """ Generates count Customer documents """
+    for number in range(count):
+        yield {'_id': 'c{:08d}'.format(number), 'firstname': 'First{}'.format(number % 5000),
+               'lastname': 'Last{}'.format(number % 20000),
+               'email': 'customer{}@email.com'.format(number),
+               'subscribed': random.random() < 0.7,
+               'address': {'address1': '{} Main St'.format(number % 999), 'address2': '',
+                           'city': random.choice(CITIES), 'province': random.choice(PROVINCES),
+                           'country': random.choice(COUNTRIES),
+                           'zip': '{:05d}'.format(random.randrange(100000))}}
+
+
+def peak_megabytes():
+    """ Returns the peak resident memory of the process so far """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main(count=1000000):
+    """ Times the CSV and Parquet exports """
+    random.seed(1)
+    workdir = tempfile.mkdtemp(prefix='export-')
+    try:
+        targets = [('csv', os.path.join(workdir, 'customers.csv'))]
+        if export.load_pyarrow() is not None:
+            targets.append(('parquet', os.path.join(workdir, 'customers.parquet')))
+        for kind, path in targets:
+            stats = ColumnStats()
+            start = time.time()
+            batches = column_batches(synthetic_documents(count))
+            if kind == 'parquet':
+                write_parquet(batches, path, stats)
+            else:
+                batches = counted(batches, stats)
+                with open(path, 'w') as output:
+                    for chunk in csv_chunks(batches):
+                        output.write(chunk)
+            seconds = time.time() - start
+            summary = stats.summary()
+            print('{}: {} customers in {:.2f}s ({:.0f}/sec), {:.1f}MB file, peak memory {:.0f}MB, '
+                  'subscription rate {}'.format(kind, summary['customers'], seconds,
+                                                summary['customers'] / seconds,
+                                                os.path.getsize(path) / 1048576.0,
+                                                peak_megabytes(), summary['subscription_rate']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
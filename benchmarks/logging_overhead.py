@@ -0,0 +1,91 @@
+"""
+Benchmark of the time logging adds to a request
+
+Times GET /customers/<id> answered from the response cache, which logs a
+line per request, with the log written inline like gunicorn's handlers
+do and with it queued for the background writer of service.logs. The log
+goes to a sink that takes a while to accept every write, like stderr piped
+to a busy log collector.
+
+Run it with:
+  python -m benchmarks.logging_overhead [requests] [sink_ms]
+"""
+from __future__ import print_function
+import sys
+import time
+import logging
+from service import create_app, init_db
+from service.models import Customer
+from service.caching import ResponseCache
+from service.logs import JsonFormatter, QueuedHandler, SamplingFilter
+
+DATABASE = 'benchmark'
+
+
+class SlowSink(object):
+    """ A stream taking a number of seconds to accept every write """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.lines = 0
+
+    def write(self, text):
+        time.sleep(self.seconds)
+        self.lines += text.count('\n')
+
+    def flush(self):
+        pass
+
+
+def microseconds_per_request(client, url, count):
+    """ Times count GET requests of a url """
+    start = time.time()
+    for _ in range(count):
+        resp = client.get(url)
+        assert resp.status_code == 200
+    return (time.time() - start) / count * 1e6
+
+
+def main(count=2000, sink_ms=1):
+    """ Compares the requests without logs, with inline logs and with queued logs """
+    init_db(DATABASE)     # also keeps the app from connecting to its own database
+    Customer.remove_all()
+    customer = Customer(firstname='John', lastname='Doe', email='jdoe@email.com',
+                        subscribed=True, address1='1 Second St', address2='1B',
+                        city='New York', province='NY', country='USA', zip='24233')
+    customer.save()
+    Customer.response_cache = ResponseCache(16 * 1024 * 1024, 60)
+    app = create_app()
+    app.logger.setLevel(logging.INFO)
+    client = app.test_client()
+    url = '/customers/{}'.format(customer.id)
+    client.get(url)
+
+    def sink_handler(formatter=None):
+        sink = SlowSink(sink_ms / 1000.0)
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(formatter or logging.Formatter(
+            '[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s'))
+        return handler
+
+    runs = (
+        ('no logs', [], None),
+        ('inline', [sink_handler()], None),
+        ('queued', [QueuedHandler([sink_handler()])], None),
+        ('queued json', [QueuedHandler([sink_handler(JsonFormatter())])], None),
+        ('queued, 10% of INFO', [QueuedHandler([sink_handler()])],
+         SamplingFilter({logging.INFO: 0.1})),
+    )
+    for name, handlers, sampler in runs:
+        app.logger.handlers = handlers
+        app.logger.filters = [sampler] if sampler else []
+        elapsed = microseconds_per_request(client, url, count)
+        dropped = sum(getattr(handler, 'dropped', 0) for handler in handlers)
+        for handler in handlers:
+            handler.close()
+        print('{:22} {:8.0f}us per request ({} records dropped)'.format(name, elapsed, dropped))
+    Customer.remove_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
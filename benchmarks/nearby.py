@@ -0,0 +1,74 @@
+"""
+Benchmark of the zip code proximity index on synthetic customers
+
+Synthetic zip codes are scattered over the continental United States and
+customers are spread over them, then radius queries through the grid are
+timed against measuring the distance to every customer. No database is
+needed.
+
+Run it with:
+  python -m benchmarks.nearby [customers] [zip codes]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from service.geo import ZipIndex, haversine_miles
+
+QUERIES = 200
+RADIUS = 25
+
+
+def percentile(timings, share):
+    """ Returns the timing below which a share of the timings fall """
+    return sorted(timings)[int(share * (len(timings) - 1))]
+
+
+def main(count=1000000, zip_count=30000):
+    """ Times radius queries through the grid and by scanning every customer """
+    random.seed(1)
+    workdir = tempfile.mkdtemp(prefix='nearby-')
+    try:
+        path = os.path.join(workdir, 'centroids.csv')
+        zip_codes = ['{:05d}'.format(number) for number in random.sample(range(100000), zip_count)]
+        with open(path, 'w') as table:
+            table.write('zip,lat,lon\n')
+            for zip_code in zip_codes:
+                table.write('{},{:.6f},{:.6f}\n'.format(
+                    zip_code, random.uniform(25, 49), random.uniform(-124, -67)))
+        index = ZipIndex(enabled=True, centroids_path=path)
+        documents = [{'_id': 'c{:07d}'.format(number),
+                      'address': {'zip': random.choice(zip_codes)}} for number in range(count)]
+        start = time.time()
+        index.build(documents)
+        print('Indexed {} customers over {} zip codes in {:.2f}s'.format(
+            count, zip_count, time.time() - start))
+
+        queries = random.sample(zip_codes, QUERIES)
+        timings = []
+        found = 0
+        for zip_code in queries:
+            start = time.time()
+            found += len(index.nearby(zip_code, RADIUS))
+            timings.append((time.time() - start) * 1000)
+        print('Grid: p50 {:.2f}ms, p90 {:.2f}ms, p99 {:.2f}ms, {:.0f} customers per query'.format(
+            percentile(timings, 0.5), percentile(timings, 0.9), percentile(timings, 0.99),
+            found / float(QUERIES)))
+
+        timings = []
+        for zip_code in queries[:10]:
+            center = index.locate(zip_code)
+            start = time.time()
+            [document['_id'] for document in documents
+             if haversine_miles(center, index.locate(document['address']['zip'])) <= RADIUS]
+            timings.append((time.time() - start) * 1000)
+        print('Scan: p50 {:.0f}ms'.format(percentile(timings, 0.5)))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
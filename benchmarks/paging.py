@@ -0,0 +1,46 @@
+"""
+Benchmark of GET /customers as a whole list and as the first page the UI asks for
+
+Run it with:
+  python -m benchmarks.paging [customers] [page_size]
+"""
+from __future__ import print_function
+import sys
+import time
+from service import create_app, init_db
+from service.models import Customer
+
+DATABASE = 'benchmark-paging'
+
+
+def timed_get(client, url):
+    """ Returns the seconds and bytes of a GET request """
+    start = time.time()
+    resp = client.get(url)
+    assert resp.status_code == 200
+    return time.time() - start, len(resp.data)
+
+
+def main(count=10000, page_size=100):
+    """ Prints the time and size of the whole list and of its first page """
+    init_db(DATABASE)
+    Customer.remove_all()
+    documents = []
+    for number in range(count):
+        documents.append(Customer(firstname='First{}'.format(number), lastname='Last',
+                                  email='customer{}@email.com'.format(number), subscribed=True,
+                                  address1='1 Second St', address2='1B', city='New York',
+                                  province='NY', country='USA', zip='24233').serialize())
+    Customer.insert_many(documents)
+    client = create_app().test_client()
+    for name, url in (('whole list', '/customers'),
+                      ('first page', '/customers?start=0&limit={}'.format(page_size)),
+                      ('last page', '/customers?start={}&limit={}'.format(count - page_size,
+                                                                        page_size))):
+        seconds, size = timed_get(client, url)
+        print('{:10} {:8.1f}ms {:9} bytes'.format(name, seconds * 1000, size))
+    Customer.drop_db()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,57 @@
+"""
+Benchmark of the admission control overhead and of how it caps a spike
+
+Several processes, like gunicorn workers, take tokens from the same
+SQLite buckets as fast as they can. Prints the time a request spends in
+the limiter and how many requests were admitted, which stays at the
+burst plus the rate times the duration however many are sent.
+
+Run it with:
+  python -m benchmarks.rate_limit [processes] [seconds] [rate]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+from service.ratelimit import RateLimiter
+
+
+def hammer(path, rate, seconds, results):
+    """ Sends requests, a few clients per process, for a number of seconds """
+    limiter = RateLimiter(path, rate=rate, burst=rate, client_rate=rate, client_burst=rate)
+    sent = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        limiter.acquire('client{}'.format(sent % 10), 1)
+        sent += 1
+    results.put((sent, limiter.admitted, time.time() - start))
+
+
+def main(processes=4, seconds=5, rate=100):
+    """ Prints the requests sent and admitted and the cost of the limiter per request """
+    workdir = tempfile.mkdtemp(prefix='ratelimit-')
+    try:
+        path = os.path.join(workdir, 'buckets.db')
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=hammer, args=(path, rate, seconds, results))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        totals = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        sent = sum(total[0] for total in totals)
+        admitted = sum(total[1] for total in totals)
+        busy = sum(total[2] for total in totals)
+        print('{} processes for {}s at {}/sec: {} requests, {} admitted (at most {:.0f}), '
+              '{:.0f}us per request'.format(processes, seconds, rate, sent, admitted,
+                                             rate + rate * seconds, busy / sent * 1e6))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,79 @@
+"""
+Benchmark of GET /customers/<id> before the response cache and with cache hits
+
+The "before" route is the code path the service had before the cache:
+Customer.find reading database[id], then deserialize, serialize and the
+flask-restful JSON encoding. The client's local copy of the document is
+dropped before every request, so each one goes to the database like it
+does for a worker that hasn't read that Customer yet. Run it against a
+database answering with a realistic latency, e.g. the stand-in:
+  python -m benchmarks.couch_standin 5984 20 &
+  python -m benchmarks.response_cache [requests] [customers]
+"""
+from __future__ import print_function
+import sys
+import time
+from flask import abort
+from flask_api import status
+from flask_restful import Api, Resource
+from service import create_app, init_db
+from service.models import Customer
+from service.caching import ResponseCache
+
+DATABASE = 'benchmark-response-cache'
+
+
+class UncachedCustomer(Resource):
+    """ GET /customers/<id> as it was served before the response cache """
+
+    def get(self, customer_id):
+        """ Reads, deserializes and serializes the Customer on every request """
+        dict.pop(Customer.database, customer_id, None)     # a worker that hasn't read it yet
+        try:
+            document = Customer.database[customer_id]
+        except KeyError:
+            document = None
+        if not document or 'firstname' not in document:
+            abort(status.HTTP_404_NOT_FOUND)
+        return Customer().deserialize(document).serialize(), status.HTTP_200_OK
+
+
+def requests_per_second(client, urls, count):
+    """ Times count GET requests, going round the urls """
+    start = time.time()
+    for number in range(count):
+        resp = client.get(urls[number % len(urls)])
+        assert resp.status_code == 200
+    return count / (time.time() - start)
+
+
+def main(count=500, customers=50):
+    """ Compares the path before the cache with cache hits """
+    init_db(DATABASE)
+    Customer.remove_all()
+    ids = []
+    for number in range(customers):
+        customer = Customer(firstname='First{}'.format(number), lastname='Doe',
+                            email='customer{}@email.com'.format(number), subscribed=True,
+                            address1='1 Second St', address2='1B', city='New York',
+                            province='NY', country='USA', zip='24233')
+        customer.save()
+        ids.append(customer.id)
+    app = create_app()
+    Api(app).add_resource(UncachedCustomer, '/before/customers/<customer_id>')
+    client = app.test_client()
+
+    before = requests_per_second(client, ['/before/customers/' + id_ for id_ in ids], count)
+    Customer.response_cache = ResponseCache(16 * 1024 * 1024, 60)
+    urls = ['/customers/' + id_ for id_ in ids]
+    for url in urls:
+        client.get(url)
+    cached = requests_per_second(client, urls, count)
+
+    print('before the cache: {:8.0f} requests/sec'.format(before))
+    print('cache hits:       {:8.0f} requests/sec ({:.1f}x)'.format(cached, cached / before))
+    Customer.drop_db()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,74 @@
+"""
+Benchmark of the Customer search index
+
+Builds the index over synthetic customers whose names and cities are
+drawn from a pool made by the CustomerFactory, then times searches for
+prefixes, whole names and misspelled names. No database is needed.
+
+Run it with:
+  python -m benchmarks.search [customers] [searches]
+"""
+from __future__ import print_function
+import sys
+import time
+import random
+import resource
+from tests.customer_factory import CustomerFactory
+from service.search import SearchIndex
+
+POOL_SIZE = 2000
+
+
+def synthetic_documents(count):
+    """ Generates count Customer documents """
+    pool = [CustomerFactory() for _ in range(POOL_SIZE)]
+    for number in range(count):
+        first, last, place = random.choice(pool), random.choice(pool), random.choice(pool)
+        yield {'_id': 'c{:07d}'.format(number), 'firstname': first.firstname,
+               'lastname': last.lastname,
+               'email': '{}.{}{}@email.com'.format(first.firstname, last.lastname, number),
+               'address': {'city': place.city}}
+
+
+def queries(documents, count):
+    """ Returns count queries made from the names of random documents """
+    made = []
+    for document in random.sample(documents, count):
+        kind = len(made) % 3
+        if kind == 0:       # prefix
+            made.append(document['lastname'][:4])
+        elif kind == 1:     # whole name
+            made.append('{} {}'.format(document['firstname'], document['lastname']))
+        else:               # misspelled
+            name = document['lastname']
+            made.append(name[:2] + name[3:] if len(name) > 3 else name)
+    return made
+
+
+def main(count=1000000, searches=300):
+    """ Reports build time, memory and search latency percentiles """
+    random.seed(1)
+    documents = list(synthetic_documents(count))
+    index = SearchIndex(enabled=True)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    index.build(documents)
+    build = time.time() - start
+    grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    stats = index.stats()
+    print('indexed {} customers in {:.1f}s, {} words, {} postings, ~{:.0f} MB'.format(
+        stats['documents'], build, stats['words'], stats['postings'], grown / 1024.0))
+
+    timings = []
+    for query in queries(documents, searches):
+        start = time.time()
+        index.search(query, 20)
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    print('{} searches: p50 {:.2f} ms, p90 {:.2f} ms, p99 {:.2f} ms'.format(
+        searches, timings[len(timings) // 2], timings[int(len(timings) * 0.9)],
+        timings[int(len(timings) * 0.99)]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,61 @@
+"""
+Benchmark of loading fixtures from a snapshot instead of one create per customer
+
+Replaces the customers of a database with the same fixtures, like the BDD
+tests do before every scenario, in two ways: by deleting them and creating
+the fixtures with a request each, and by restoring a snapshot. Uses the
+database configured like the service's.
+
+Run it with:
+  python -m benchmarks.snapshot [customers]
+"""
+from __future__ import print_function
+import io
+import sys
+import time
+from service.models import Customer
+from service.snapshots import snapshot_chunks, restore
+
+DATABASE = 'benchmark'
+
+
+def fixtures(count):
+    """ Returns count Customer documents with ids of their own """
+    return [{'_id': 'fixture{:06d}'.format(number), 'firstname': 'First{}'.format(number),
+             'lastname': 'Last{}'.format(number), 'email': 'c{}@email.com'.format(number),
+             'subscribed': True,
+             'address': {'address1': '{} Main St'.format(number), 'address2': '',
+                         'city': 'New York', 'province': 'NY', 'country': 'USA', 'zip': '10001'}}
+            for number in range(count)]
+
+
+def one_at_a_time(documents):
+    """ Deletes every Customer and creates the fixtures with a request each """
+    for document in Customer.database:
+        if not document['_id'].startswith('_design/'):
+            document.delete()
+    for document in documents:
+        Customer().deserialize(dict(document)).create()
+
+
+def from_snapshot(snapshot):
+    """ Restores the fixtures from a snapshot """
+    restore(io.BytesIO(snapshot))
+
+
+def main(count=200):
+    """ Times seeding count customers both ways """
+    Customer.init_db(DATABASE)
+    documents = fixtures(count)
+    snapshot = b''.join(snapshot_chunks(documents))
+    for name, seed, argument in (('create one at a time', one_at_a_time, documents),
+                                 ('restore a snapshot', from_snapshot, snapshot)):
+        seed(argument)      # the customers of an earlier run are there
+        start = time.time()
+        seed(argument)
+        print('{:22} {} customers in {:6.2f}s'.format(name, count, time.time() - start))
+    Customer.remove_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
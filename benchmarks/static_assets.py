@@ -0,0 +1,80 @@
+"""
+Benchmark of what page views of the UI cost the workers
+
+Loads the home page and the assets it links like a browser with a cache
+would: assets still fresh under their Cache-Control aren't requested again,
+the others are asked for with their ETag. Prints the requests that reach
+the app, the bytes it sends and the time it spends for a first visit and
+for the visits after it.
+
+Run it with:
+  python -m benchmarks.static_assets [visits]
+"""
+from __future__ import print_function
+import io
+import re
+import sys
+import gzip
+import time
+from service import create_app
+
+LINK = re.compile(r'(?:src|href)\s*=\s*"/?(static/[^"]+)"')
+HEADERS = {'Accept-Encoding': 'gzip, deflate, br'}
+
+
+class Browser(object):
+    """ A client keeping responses as long as their Cache-Control allows """
+
+    def __init__(self, client):
+        self.client = client
+        self.cache = {}     # url -> (ETag, fresh until)
+        self.links = []
+        self.requests = 0
+        self.bytes = 0
+
+    def get(self, url):
+        """ Loads a url, from the cache when it is still fresh """
+        etag, fresh_until = self.cache.get(url, (None, 0))
+        if time.time() < fresh_until:
+            return None
+        headers = dict(HEADERS, **({'If-None-Match': etag} if etag else {}))
+        resp = self.client.get('/' + url.lstrip('/'), headers=headers)
+        self.requests += 1
+        self.bytes += len(resp.data)
+        max_age = re.search(r'max-age=(\d+)', resp.headers.get('Cache-Control', ''))
+        self.cache[url] = (resp.headers.get('ETag', etag),
+                           time.time() + (int(max_age.group(1)) if max_age else 0))
+        text = resp.data if resp.status_code == 200 else b''
+        resp.close()
+        return text
+
+    def visit(self):
+        """ Loads the home page and what it links """
+        page = self.get('/')
+        if page:    # else the page is still the one cached
+            if page[:2] == b'\x1f\x8b':
+                page = gzip.GzipFile(fileobj=io.BytesIO(page)).read()
+            self.links = LINK.findall(page.decode('utf-8'))
+        for link in self.links:
+            self.get(link)
+
+
+def main(visits=500):
+    """ Prints the cost of a first visit and of the visits after it """
+    client = create_app({'TESTING': True}).test_client()
+    browser = Browser(client)
+    start = time.time()
+    browser.visit()
+    print('first visit:  {} requests, {:7.0f} bytes, {:6.2f}ms'.format(
+        browser.requests, browser.bytes, (time.time() - start) * 1000))
+    browser.requests = browser.bytes = 0
+    start = time.time()
+    for _ in range(visits):
+        browser.visit()
+    print('later visits: {:.1f} requests, {:7.0f} bytes, {:6.2f}ms per visit'.format(
+        browser.requests / float(visits), browser.bytes / float(visits),
+        (time.time() - start) * 1000 / visits))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,53 @@
+"""
+Benchmark of concurrent creates with and without write batching
+
+Run it with:
+  python -m benchmarks.write_batching [clients] [writes per client]
+"""
+from __future__ import print_function
+import sys
+import time
+import threading
+from service.models import Customer
+from service.batching import WriteCoalescer
+
+DATABASE = 'benchmark'
+
+
+def writes_per_second(clients, writes):
+    """ Times clients threads each creating writes Customers """
+    def client():
+        for _ in range(writes):
+            Customer(firstname='John', lastname='Doe', email='jdoe@email.com',
+                     subscribed=True, address1='1 Second St', address2='1B',
+                     city='New York', province='NY', country='USA', zip='24233').create()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients * writes / (time.time() - start)
+
+
+def main(clients=50, writes=20):
+    """ Compares one request per write with coalesced writes """
+    Customer.init_db(DATABASE)
+    Customer.remove_all()
+    bulk_docs = lambda documents: Customer.database.bulk_docs(documents)
+
+    Customer.writer = WriteCoalescer(bulk_docs, window=0)
+    single = writes_per_second(clients, writes)
+    Customer.writer = WriteCoalescer(bulk_docs, window=0.005, max_batch=100)
+    batched = writes_per_second(clients, writes)
+
+    print('{} clients, {} writes each'.format(clients, writes))
+    print('single writes:  {:8.0f} writes/sec'.format(single))
+    print('batched writes: {:8.0f} writes/sec ({:.1f}x, {} batches)'.format(
+        batched, batched / single, Customer.writer.batches))
+    Customer.remove_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
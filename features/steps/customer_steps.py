@@ -4,8 +4,11 @@ Customer Steps
 Steps file for Customer.feature
 """
 from os import getenv
+import io
 import logging
 import json
+import gzip
+import uuid
 import requests
 from behave import *
 from compare import expect, ensure
@@ -19,13 +22,12 @@ WAIT_SECONDS = int(getenv('WAIT_SECONDS', '25'))
 
 @given('the following customers')
 def step_impl(context):
-    """ Delete all Customers and load new ones """
-    headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
-    context.resp = requests.delete(context.base_url + '/customers/reset', headers=headers)
-    expect(context.resp.status_code).to_equal(204)
-    create_url = context.base_url + '/customers'
+    """ Replace all Customers with a snapshot of the table """
+    lines = []
     for row in context.table:
-        data = {
+        customer_id = uuid.uuid4().hex
+        lines.append(json.dumps({
+            "_id": customer_id,
             "firstname": row['firstname'],
             "lastname": row['lastname'],
             "email": row['email'],
@@ -38,13 +40,17 @@ def step_impl(context):
                 "country": row['country'],
                 "zip": row['zip']
                 }
-            }
-        payload = json.dumps(data)
-        context.resp = requests.post(create_url, data=payload, headers=headers)
+            }))
         if row['firstname'] == "John":
-            tempdict = context.resp.json()
-            context.john_id = tempdict["_id"]
-        expect(context.resp.status_code).to_equal(201)
+            context.john_id = customer_id
+    snapshot = io.BytesIO()
+    with gzip.GzipFile(fileobj=snapshot, mode='wb') as compressed:
+        compressed.write('\n'.join(lines).encode('utf-8'))
+    headers = {'Content-Type': 'application/gzip', 'Cache-Control': 'no-cache'}
+    context.resp = requests.put(context.base_url + '/customers/snapshot', data=snapshot.getvalue(),
+                                headers=headers)
+    expect(context.resp.status_code).to_equal(200)
+    expect(context.resp.json()['imported']).to_equal(len(lines))
 
 @when('I visit the "home page"')
 def step_impl(context):
@@ -0,0 +1,34 @@
+"""
+Gunicorn Settings
+
+Run the service with:
+  gunicorn -c gunicorn.conf.py "service:create_app()"
+
+The app is built once in the master and shared by the forked workers
+(GUNICORN_PRELOAD=false builds it in every worker instead). Nothing that
+talks to Cloudant is created before the fork: every worker connects with
+clients of its own in post_fork.
+
+Workers are threaded: every open stream of changes holds a thread for as
+long as the client listens, so each worker gets CHANGES_MAX_SUBSCRIBERS
+threads for the streams and 32 more for the rest of the API.
+"""
+import os
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8080')
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS',
+                             str(int(os.environ.get('CHANGES_MAX_SUBSCRIBERS', '100')) + 32)))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """ Connects the new worker to the database before it takes requests """
+    from service import init_db
+    try:
+        init_db()
+    except Exception as error:      # pylint: disable=broad-except
+        # leave it to the first request, which fails the way it always did
+        server.log.warning('Worker %s could not connect to the database: %s', worker.pid, error)
@@ -3,55 +3,125 @@ Package: app
 
 Package for the application models and services
 This module also sets up the logging to be used with gunicorn
+
+Importing the package is cheap: the Flask app is built by create_app(),
+which imports Flask, the models and the resources only when it runs, so
+the commands and the benchmarks that use a single module don't pay for
+the web stack. Serve the app with:
+  gunicorn -c gunicorn.conf.py "service:create_app()"
 """
 # RESTful Doc links:
 # https://flask-restful.readthedocs.io/en/0.3.6/intermediate-usage.html
 # https://flask-restful.readthedocs.io/en/0.3.6/quickstart.html
 import os
-import sys
 import logging
-from flask import Flask
-from flask_restful import Api
-from .models import Customer, DataValidationError
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'the customer isnt always right... Shhhh'
-app.config['LOGGING_LEVEL'] = logging.INFO
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-
-api = Api(app)
-
-from service.resources import CustomerResource
-from service.resources import NoResource
-from service.resources import CustomerCollection
-from service.resources import HomePage
-from service.resources import UnsubscribeAction
-from service.resources import ResetAction
-from service.resources import Address
-
-api.add_resource(HomePage, '/')
-api.add_resource(CustomerCollection, '/customers')
-api.add_resource(CustomerResource, '/customers/<customer_id>')
-api.add_resource(NoResource, '/customers/')
-api.add_resource(UnsubscribeAction, '/customers/<customer_id>/unsubscribe')
-api.add_resource(ResetAction, '/customers/reset')
-api.add_resource(Address, '/customers/<customer_id>/address')
-
-# Set up logging for production
-print('Setting up logging for {}...'.format(__name__))
-if __name__ != '__main__':
+
+_connected_pid = None   # the process that init_db connected to the database
+
+
+def create_app(config=None):
+    """
+    Builds the Flask app with every route of the service
+
+    Args:
+        config (dict): settings overriding the defaults. With TESTING the
+            app doesn't connect to the database on the first request,
+            the tests connect to databases of their own.
+    """
+    from flask import Flask
+    from flask_restful import Api
+    from service.resources import CustomerResource
+    from service.resources import NoResource
+    from service.resources import CustomerCollection
+    from service.resources import HomePage
+    from service.resources import UnsubscribeAction
+    from service.resources import ResetAction
+    from service.resources import Address
+    from service.resources import LookupAction
+    from service.resources import BulkUnsubscribeAction
+    from service.resources import Metrics
+    from service.resources import JobResource
+    from service.resources import ChangesStream
+    from service.resources import CustomerSearch
+    from service.resources import NearbyCustomers
+    from service.resources import CustomerExport
+    from service.resources import CustomerSummary
+    from service.resources import CustomerSnapshot
+    from service.resources import StaticAsset
+    from service.resources import admit_request
+    from service.resources import track_request
+    from service.resources import finish_request
+    from service.logs import queued_handlers, sampling_filter
+    from service.assets import AssetManifest
+
+    app = Flask(__name__, static_folder=None)   # StaticAsset serves the static folder
+    app.config['SECRET_KEY'] = 'the customer isnt always right... Shhhh'
+    app.config['LOGGING_LEVEL'] = logging.INFO
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+    app.config.update(config or {})
+    app.extensions['assets'] = AssetManifest()
+    app.jinja_env.globals['asset'] = app.extensions['assets'].url
+    app.before_request(admit_request)
+    app.after_request(track_request)
+    app.teardown_request(finish_request)
+
+    api = Api(app)
+    api.add_resource(HomePage, '/')
+    api.add_resource(CustomerCollection, '/customers')
+    api.add_resource(CustomerResource, '/customers/<customer_id>')
+    api.add_resource(NoResource, '/customers/')
+    api.add_resource(UnsubscribeAction, '/customers/<customer_id>/unsubscribe')
+    api.add_resource(ResetAction, '/customers/reset')
+    api.add_resource(LookupAction, '/customers/lookup')
+    api.add_resource(BulkUnsubscribeAction, '/customers/unsubscribe')
+    api.add_resource(Metrics, '/metrics')
+    api.add_resource(JobResource, '/jobs/<job_id>')
+    api.add_resource(ChangesStream, '/customers/changes')
+    api.add_resource(CustomerSearch, '/customers/search')
+    api.add_resource(NearbyCustomers, '/customers/nearby')
+    api.add_resource(CustomerExport, '/customers/export')
+    api.add_resource(CustomerSummary, '/customers/summary')
+    api.add_resource(CustomerSnapshot, '/customers/snapshot')
+    api.add_resource(Address, '/customers/<customer_id>/address')
+    api.add_resource(StaticAsset, '/static/<path:filename>', endpoint='static')
+
+    # Set up logging for production, written by a background thread (see service/logs.py)
     gunicorn_logger = logging.getLogger('gunicorn.error')
     if gunicorn_logger:
-        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.handlers = queued_handlers(gunicorn_logger.handlers)
         app.logger.setLevel(gunicorn_logger.level)
+    sampler = sampling_filter()
+    if sampler is not None:
+        app.logger.addFilter(sampler)
 
-app.logger.info('************************************************************')
-app.logger.info('     C U S T O M E R   R E S T   A P I   S E R V I C E ')
-app.logger.info('************************************************************')
-app.logger.info('Logging established')
+    app.logger.info('************************************************************')
+    app.logger.info('     C U S T O M E R   R E S T   A P I   S E R V I C E ')
+    app.logger.info('************************************************************')
+    app.logger.info('Logging established')
+
+    if not app.testing:
+        app.before_first_request(init_db)
+    return app
 
 
-@app.before_first_request
 def init_db(dbname="customers"):
-    """ Initlaize the model """
+    """
+    Initlaize the model once per process
+
+    Runs in every gunicorn worker right after the fork (see gunicorn.conf.py)
+    or else before the first request. A process that inherited a client
+    from its parent, like the workers of gunicorn --preload, connects again
+    with clients of its own instead of sharing the parent's connections.
+    """
+    global _connected_pid   # pylint: disable=global-statement
+    from service.models import Customer
+    if _connected_pid == os.getpid():
+        return
     Customer.init_db(dbname)
+    indexed = Customer.search_index.enabled or Customer.zip_index.enabled
+    if Customer.query_cache.enabled or Customer.response_cache.enabled or indexed:
+        Customer.follow_changes()
+    if indexed:
+        Customer.index_customers()
+    Customer.jobs.start(Customer.apply_jobs)
+    _connected_pid = os.getpid()
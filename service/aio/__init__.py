@@ -0,0 +1,10 @@
+"""
+Package: service.aio
+
+Asynchronous access to the Customer database and an ASGI entry point
+(Python 3 only). A single process keeps many requests in flight while it
+waits on CouchDB instead of tying up a worker per request.
+
+Run it with:
+  uvicorn service.aio.asgi:app --port 8080
+"""
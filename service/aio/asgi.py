@@ -0,0 +1,282 @@
+"""
+ASGI Entry Point
+
+Serves the same routes as the app of service.create_app(). Requests are matched against the
+URL map of the Flask app: reading, creating, updating and deleting
+Customers (GET and POST /customers, GET, PUT and DELETE /customers/{id})
+are answered by coroutines using AsyncCustomer, so one process keeps as
+many of them in flight as the connection pool allows. Every other route,
+and the variants these don't cover (form posts, asynchronous writes,
+?since), is handed to the Flask app on a pool of threads.
+
+Run it with:
+  uvicorn service.aio.asgi:app --port 8080
+"""
+import os
+import json
+import math
+import asyncio
+from urllib.parse import parse_qsl
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from service import create_app
+from service.models import Customer, DataValidationError, DuplicateEmailError, \
+    RATE_LIMIT_SCAN_COST, TRUSTED_PROXIES
+from service.ratelimit import forwarded_client
+from service.resources.admission import is_scan, SHED_RETRY_AFTER
+from service.resources.changes_stream import CHANGES_MAX_SUBSCRIBERS
+from .models import AsyncCustomer
+from .wsgi import WsgiBridge
+
+# threads running the routes served by the Flask app, on top of one per stream of changes
+ASYNC_WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', '32')) + CHANGES_MAX_SUBSCRIBERS
+
+# query parameters of GET /customers and the selector each one is found with
+ADDRESS_QUERIES = ('address1', 'address2', 'city', 'province', 'country', 'zip')
+
+flask_app = create_app()
+flask_bridge = WsgiBridge(flask_app, ASYNC_WSGI_THREADS)
+
+
+class Request(object):
+    """ The parts of an ASGI HTTP request the handlers use """
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.method = scope['method']
+        self.args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        self.headers = dict((name.decode('latin-1'), value.decode('latin-1'))
+                            for name, value in scope['headers'])
+
+    def url(self, path):
+        """ Returns the external URL of a path on this server """
+        host = self.headers.get('host') or '{}:{}'.format(*self.scope['server'])
+        return '{}://{}{}'.format(self.scope.get('scheme', 'http'), host, path)
+
+    def client(self):
+        """ The address of the client, from X-Forwarded-For behind the router """
+        return forwarded_client(self.headers.get('x-forwarded-for'),
+                                (self.scope.get('client') or ('',))[0], TRUSTED_PROXIES)
+
+    def prefers_async(self):
+        """ True when the write is left to the job queue of the Flask routes """
+        return Customer.jobs.enabled and \
+            'respond-async' in self.headers.get('prefer', '').lower()
+
+    def json(self):
+        """ Returns the decoded JSON body or None if it isn't valid JSON """
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            return None
+
+
+async def respond(send, status, body=b'', content_type='application/json', headers=None):
+    """ Sends a whole response """
+    raw_headers = [(b'content-type', content_type.encode('latin-1')),
+                   (b'content-length', str(len(body)).encode('latin-1'))]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode('latin-1'), value.encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def respond_json(send, status, data, headers=None):
+    """ Sends data as JSON the way Flask-RESTful encodes it """
+    await respond(send, status, (json.dumps(data) + '\n').encode('utf-8'), headers=headers)
+
+
+async def respond_error(send, status, message):
+    """ Sends an error with its message """
+    await respond_json(send, status, {'message': message})
+
+######################################################################
+#  C U S T O M E R   H A N D L E R S
+######################################################################
+
+async def list_customers(request, send):
+    """ GET /customers, finding the Customers by the first query parameter given """
+    args = request.args
+    if args.get('email'):
+        customers = await AsyncCustomer.find_by_email(args['email'])
+    elif args.get('firstname'):
+        customers = await AsyncCustomer.find_by(firstname=args['firstname'])
+    elif args.get('lastname'):
+        customers = await AsyncCustomer.find_by(lastname=args['lastname'])
+    elif args.get('subscribed'):
+        customers = await AsyncCustomer.find_by(
+            subscribed=args['subscribed'].lower() in ('true', '1'))
+    else:
+        field = next((name for name in ADDRESS_QUERIES if args.get(name)), None)
+        if field:
+            customers = await AsyncCustomer.find_by(address={field: args[field]})
+        else:
+            customers = await AsyncCustomer.all()
+    flask_app.logger.info('[%s] Customers returned', len(customers))
+    await respond_json(send, 200, [customer.serialize() for customer in customers])
+
+
+async def create_customer(request, send):
+    """ POST /customers with a JSON body """
+    customer = Customer()
+    try:
+        customer.deserialize(request.json())
+        await AsyncCustomer.create(customer)
+    except DuplicateEmailError as error:
+        return await respond_error(send, 409, str(error))
+    except DataValidationError as error:
+        return await respond_error(send, 400, str(error))
+    flask_app.logger.info('Customer with new id [%s] saved!', customer.id)
+    await respond_json(send, 201, customer.serialize(),
+                       {'Location': request.url('/customers/' + customer.id)})
+
+
+async def get_customer(request, send, customer_id):
+    """ GET /customers/{id}, served from the response cache when it holds the Customer """
+    encoded = await AsyncCustomer.find_encoded(customer_id)
+    if encoded is None:
+        return await respond_error(send, 404, 'Customer WAS NOT FOUND ')
+    gzipped = encoded.gzipped.get('customer')
+    use_gzip = gzipped is not None and 'gzip' in request.headers.get('accept-encoding', '')
+    headers = {}
+    if gzipped is not None:
+        headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    if encoded.rev:
+        headers['ETag'] = '"{}{}"'.format(encoded.rev, '-gzip' if use_gzip else '')
+        if headers['ETag'] in request.headers.get('if-none-match', ''):
+            return await respond(send, 304, headers=headers)
+    await respond(send, 200, gzipped if use_gzip else encoded.bodies['customer'],
+                  headers=headers)
+
+
+async def update_customer(request, send, customer_id):
+    """ PUT /customers/{id} """
+    customer = await AsyncCustomer.find(customer_id)
+    if customer is None:
+        return await respond_error(send, 404,
+                                   "Customer with id '{}' was not found.".format(customer_id))
+    try:
+        customer.deserialize(request.json())
+        customer.id = customer_id
+        if not await AsyncCustomer.update(customer):
+            return await respond_error(send, 404, "Customer with id '{}' was not found."
+                                       .format(customer_id))
+    except DuplicateEmailError as error:
+        return await respond_error(send, 409, str(error))
+    except DataValidationError as error:
+        return await respond_error(send, 400, str(error))
+    await respond_json(send, 200, customer.serialize())
+
+
+async def delete_customer(request, send, customer_id):
+    """ DELETE /customers/{id} """
+    await AsyncCustomer.delete(customer_id)
+    await respond(send, 204, content_type='text/html; charset=utf-8')
+
+
+async def admit(request, endpoint, send):
+    """
+    Refuses a native request when the service is overloaded
+
+    Answers 503 when the load shedder refuses it and 429 when it is over the
+    rate limits, like the Flask app does for the requests handed to it.
+
+    Returns:
+        bool: True when the request may go on
+    """
+    scan = is_scan(endpoint, request.method, request.args)
+    reason = Customer.shedder.shed(scan)
+    if reason:
+        flask_app.logger.info('Shed %s %s: %s', request.method, request.scope['path'], reason)
+        await respond_json(send, 503, {'message': 'The service is overloaded, try again later'},
+                           {'Retry-After': SHED_RETRY_AFTER})
+        return False
+    if not Customer.rate_limiter.enabled:
+        return True
+    wait = await asyncio.get_event_loop().run_in_executor(
+        flask_bridge.executor, Customer.rate_limiter.acquire, request.client(),
+        RATE_LIMIT_SCAN_COST if scan else 1)
+    if not wait:
+        return True
+    await respond_json(send, 429, {'message': 'Too many requests, try again later'},
+                       {'Retry-After': str(int(math.ceil(wait)))})
+    return False
+
+
+def native_handler(request, endpoint):
+    """ Returns the coroutine serving a request, or None to leave it to the Flask app """
+    if endpoint == 'customercollection':
+        if request.method == 'GET' and not any(name in request.args
+                                               for name in ('since', 'start', 'limit')):
+            return list_customers
+        if request.method == 'POST' and not request.prefers_async() and \
+                request.headers.get('content-type') == 'application/json':
+            return create_customer
+    elif endpoint == 'customerresource':
+        if request.method == 'GET':
+            return get_customer
+        if request.method == 'PUT' and not request.prefers_async():
+            return update_customer
+        if request.method == 'DELETE':
+            return delete_customer
+    return None
+
+######################################################################
+#  A S G I   A P P L I C A T I O N
+######################################################################
+
+async def read_body(receive):
+    """ Receives the whole body of a request """
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def lifespan(receive, send):
+    """ Connects to the database on startup, like the first request to the Flask app """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await AsyncCustomer.init_db()
+                await asyncio.get_event_loop().run_in_executor(
+                    flask_bridge.executor, flask_app.try_trigger_before_first_request_functions)
+            except Exception as error:      # pylint: disable=broad-except
+                await send({'type': 'lifespan.startup.failed', 'message': str(error)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await AsyncCustomer.close()
+            Customer.jobs.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ The ASGI application """
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return None
+    body = await read_body(receive)
+    request = Request(scope, body)
+    try:
+        endpoint, args = flask_app.url_map.bind('').match(scope['path'], request.method)
+    except (HTTPException, RequestRedirect):
+        endpoint, args = None, {}
+    handler = native_handler(request, endpoint) if AsyncCustomer.database else None
+    if handler is None:
+        return await flask_bridge(scope, body, receive, send)
+    if not await admit(request, endpoint, send):
+        return None
+    Customer.shedder.begin()
+    try:
+        return await handler(request, send, **args)
+    finally:
+        Customer.shedder.end()
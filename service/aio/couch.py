@@ -0,0 +1,182 @@
+"""
+Asynchronous CouchDB Client
+
+Speaks the same CouchDB endpoints as the cloudant library (documents,
+_all_docs, _find, views and _bulk_docs) over a pooled aiohttp session.
+Reads that fail on the connection or with a 5xx or 429 status are
+retried with a growing delay. Writes are only retried when they were
+never carried out: when no connection could be made or on a 429 status,
+so that retrying a create never makes a second document.
+"""
+import json
+import time
+import asyncio
+from urllib.parse import quote
+import aiohttp
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# methods that can be sent again without changing the outcome
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+# query parameters that CouchDB reads as JSON, so strings among them are quoted
+JSON_PARAMS = ('key', 'startkey', 'endkey', 'start_key', 'end_key')
+
+
+class CouchError(Exception):
+    """ Used when CouchDB answers with an error status """
+
+    def __init__(self, status, body):
+        super().__init__('{}: {}'.format(status, body))
+        self.status = status
+        self.body = body
+
+
+class AsyncDatabase(object):
+    """ One CouchDB database reached through a pool of keep-alive connections """
+
+    def __init__(self, url, dbname, username=None, password=None, pool_size=100,
+                 timeout=30, tries=3, observe=None):
+        """
+        Args:
+            url (str): the server, e.g. http://localhost:5984/
+            dbname (str): the database
+            username (str): sent with basic authentication unless None
+            password (str): the password of username
+            pool_size (int): most connections open at once
+            timeout (float): seconds before a request is given up
+            tries (int): attempts of a request that keeps failing
+            observe (function): called with the seconds every answer took
+        """
+        self.url = url.rstrip('/') + '/' + quote(dbname, safe='')
+        self.auth = aiohttp.BasicAuth(username, password) if username else None
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.tries = tries
+        self.observe = observe
+        self.session = None
+
+    async def open(self):
+        """ Opens the connection pool and creates the database if it doesn't exist """
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, auth=self.auth,
+                                                 timeout=self.timeout,
+                                                 json_serialize=json.dumps)
+        try:
+            await self.request('PUT', '')
+        except CouchError as error:
+            if error.status != 412:     # it already exists
+                raise
+
+    async def close(self):
+        """ Closes every pooled connection """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, path, params=None, body=None, idempotent=None):
+        """
+        Sends a request to the database and returns its decoded JSON answer
+
+        Args:
+            idempotent (bool): whether a failed attempt may be sent again, by
+                default only for GET and HEAD (reads sent as POST pass True)
+
+        Raises:
+            CouchError: when the answer has an error status or isn't JSON
+        """
+        url = self.url + ('/' + path if path else '')
+        if params:
+            params = dict((key, value if isinstance(value, str) and key not in JSON_PARAMS
+                           else json.dumps(value)) for key, value in params.items())
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        delay = 0.1
+        for attempt in range(1, self.tries + 1):
+            last = attempt == self.tries
+            try:
+                start = time.time()
+                async with self.session.request(method, url, params=params,
+                                                json=body) as response:
+                    if self.observe is not None:
+                        self.observe(time.time() - start)
+                    data = await self._decode(response)
+                    if response.status < 400:
+                        return data
+                    retry = response.status == 429 or \
+                        (idempotent and response.status in RETRY_STATUSES)
+                    if last or not retry:
+                        raise CouchError(response.status, data)
+            except aiohttp.ClientConnectorError:    # nothing was sent
+                if last:
+                    raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last or not idempotent:
+                    raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    @staticmethod
+    async def _decode(response):
+        """
+        Returns the JSON body of an answer
+
+        Raises:
+            CouchError: when the body isn't JSON, e.g. an error page of a proxy
+        """
+        text = await response.text()
+        try:
+            return json.loads(text)
+        except ValueError:
+            raise CouchError(response.status if response.status >= 400 else 502,
+                             {'error': 'bad_response', 'reason': text[:200]})
+
+    async def get(self, document_id):
+        """ Returns a document or None if there is no such document """
+        try:
+            return await self.request('GET', quote(document_id, safe=''))
+        except CouchError as error:
+            if error.status == 404:
+                return None
+            raise
+
+    async def save(self, document):
+        """ Creates or updates (when it has a _rev) a document and returns its id and rev """
+        if '_id' in document:
+            return await self.request('PUT', quote(document['_id'], safe=''), body=document)
+        return await self.request('POST', '', body=document)
+
+    async def delete(self, document_id, rev):
+        """ Deletes a revision of a document """
+        return await self.request('DELETE', quote(document_id, safe=''), params={'rev': rev})
+
+    async def all_docs(self, keys=None, **params):
+        """ Returns the rows of an _all_docs request """
+        if keys is not None:
+            result = await self.request('POST', '_all_docs', params=params, body={'keys': keys},
+                                        idempotent=True)
+        else:
+            result = await self.request('GET', '_all_docs', params=params)
+        return result.get('rows', [])
+
+    async def find(self, selector, limit=None, bookmark=None):
+        """ Returns one page of documents matching a Mango selector """
+        body = {'selector': selector}
+        if limit:
+            body['limit'] = limit
+        if bookmark:
+            body['bookmark'] = bookmark
+        return await self.request('POST', '_find', body=body, idempotent=True)
+
+    async def view(self, ddoc_id, view, keys=None, **params):
+        """ Returns the rows of a view """
+        path = '{}/_view/{}'.format(ddoc_id, view)
+        if keys is not None:
+            result = await self.request('POST', path, params=params, body={'keys': keys},
+                                        idempotent=True)
+        else:
+            result = await self.request('GET', path, params=params)
+        return result.get('rows', [])
+
+    async def bulk_docs(self, documents):
+        """ Writes many documents and returns the result of every one """
+        return await self.request('POST', '_bulk_docs', body={'docs': documents})
@@ -0,0 +1,193 @@
+"""
+Asynchronous Customer Data Access
+
+The coroutine counterparts of the Customer finders and writes. Customers
+are still validated and serialized by service.models.Customer, and every
+write drops the stale entries of the caches and indexes Customer shares
+with the synchronous routes of the same process.
+"""
+import os
+import json
+import asyncio
+from service.models import Customer, DataValidationError, DuplicateEmailError, \
+    ADMIN_PARTY, BULK_PAGE_SIZE, DESIGN_DOC_ID, EMAIL_VIEW, MAX_LOOKUP_IDS, UNIQUE_EMAILS, \
+    same_email
+from .couch import AsyncDatabase, CouchError
+
+# most connections to the database kept open by one process
+ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', '100'))
+
+
+class AsyncCustomer(object):
+    """ Coroutines reading and writing Customers """
+    database = None     # service.aio.couch.AsyncDatabase
+    _inflight = {}      # lookup key -> future of the request already sent for it
+
+    @classmethod
+    async def init_db(cls, dbname='customers'):
+        """ Opens the connection pool to the database of the Customers """
+        opts = Customer.credentials()
+        username = None if ADMIN_PARTY else opts['username']
+        cls.database = AsyncDatabase(opts['url'], dbname, username, opts['password'],
+                                     ASYNC_POOL_SIZE, observe=Customer.shedder.observe)
+        await cls.database.open()
+
+    @classmethod
+    async def close(cls):
+        """ Closes the connection pool """
+        if cls.database is not None:
+            await cls.database.close()
+            cls.database = None
+
+    @classmethod
+    async def _shared(cls, key, coroutine_function, *args, **kwargs):
+        """ Runs one request for concurrent lookups of the same key and shares its result """
+        future = cls._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coroutine_function(*args, **kwargs))
+            cls._inflight[key] = future
+            future.add_done_callback(lambda _: cls._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+######################################################################
+#  F I N D E R S
+######################################################################
+
+    @classmethod
+    async def find_document(cls, customer_id):
+        """ Returns the document of a Customer or None if there isn't one """
+        if customer_id in Customer.missing_ids:
+            return None
+        document = await cls._shared(('find', customer_id), cls.database.get, customer_id)
+        if document is None or 'firstname' not in document:
+            Customer.missing_ids.add(customer_id)
+            return None
+        return document
+
+    @classmethod
+    async def find(cls, customer_id):
+        """ Finds a Customer by its ID """
+        document = await cls.find_document(customer_id)
+        return None if document is None else Customer().deserialize(document)
+
+    @classmethod
+    async def find_encoded(cls, customer_id):
+        """ Finds a Customer by its ID already encoded as JSON, like Customer.find_encoded """
+        encoded = Customer.response_cache.get(customer_id)
+        if encoded is not None:
+            return encoded
+        generation = Customer.response_cache.generation
+        document = await cls.find_document(customer_id)
+        if document is None:
+            return None
+        data = Customer().deserialize(document).serialize()
+        return Customer.response_cache.put(customer_id, document.get('_rev'),
+                                           {'customer': data, 'address': data['address']},
+                                           generation)
+
+    @classmethod
+    async def find_by(cls, **kwargs):
+        """ Finds the Customers matching a selector """
+        key = json.dumps(kwargs, sort_keys=True)
+        documents = Customer.query_cache.get(key)
+        if documents is None:
+            generation = Customer.query_cache.generation
+            documents = await cls._shared(('find_by', key), cls._query_documents, kwargs)
+            Customer.query_cache.put(key, kwargs, documents, generation)
+        return [Customer().deserialize(document) for document in documents]
+
+    @classmethod
+    async def _query_documents(cls, selector):
+        """ Returns every document matching a selector, a page at a time """
+        documents = []
+        bookmark = None
+        while True:
+            result = await cls.database.find(selector, MAX_LOOKUP_IDS, bookmark)
+            page = result.get('docs', [])
+            documents.extend(page)
+            bookmark = result.get('bookmark')
+            if len(page) < MAX_LOOKUP_IDS or not bookmark:
+                return documents
+
+    @classmethod
+    async def find_by_email(cls, email):
+        """ Finds the Customers with an email, ignoring its case """
+        if not email:
+            return []
+        rows = await cls._shared(('by_email', email.lower()), cls.database.view, DESIGN_DOC_ID,
+                                 EMAIL_VIEW, key=email.lower(), include_docs=True, reduce=False)
+        return [Customer().deserialize(row['doc']) for row in rows if row.get('doc')]
+
+    @classmethod
+    async def all(cls):
+        """ Returns all of the Customers, reading BULK_PAGE_SIZE documents per request """
+        customers = []
+        params = {'include_docs': True, 'limit': BULK_PAGE_SIZE + 1}
+        while True:
+            rows = await cls.database.all_docs(**params)
+            customers.extend(Customer().deserialize(row['doc']) for row in rows[:BULK_PAGE_SIZE]
+                             if row.get('doc') and not row['id'].startswith('_design/'))
+            if len(rows) <= BULK_PAGE_SIZE:
+                return customers
+            params['startkey'] = rows[BULK_PAGE_SIZE]['id']
+
+######################################################################
+#  W R I T E S
+######################################################################
+
+    @classmethod
+    async def _check_email(cls, customer):
+        """ Raises DuplicateEmailError if another Customer has the email of customer """
+        if not UNIQUE_EMAILS or not customer.email:
+            return
+        rows = await cls.database.view(DESIGN_DOC_ID, EMAIL_VIEW, key=customer.email.lower(),
+                                       reduce=False)
+        if any(row['id'] != customer.id for row in rows):
+            raise DuplicateEmailError('A customer with email {} already exists'
+                                      .format(customer.email))
+
+    @classmethod
+    async def create(cls, customer):
+        """ Creates a Customer and gives it the id of its new document """
+        if customer.firstname is None:
+            raise DataValidationError('firstName attribute is not set')
+        await cls._check_email(customer)
+        document = customer.serialize()
+        result = await cls.database.save(document)
+        customer.id = result['id']
+        document['_id'], document['_rev'] = result['id'], result['rev']
+        Customer._written(customer.id, document)
+
+    @classmethod
+    async def update(cls, customer):
+        """ Saves the changes to a Customer; returns False if it no longer exists """
+        for _ in range(3):      # try again when someone else changed it meanwhile
+            document = await cls.database.get(customer.id)
+            if document is None:
+                return False
+            if not same_email(document.get('email'), customer.email):
+                await cls._check_email(customer)
+            document.update(customer.serialize())
+            try:
+                result = await cls.database.save(document)
+            except CouchError as error:
+                if error.status == 409:
+                    continue
+                raise
+            document['_rev'] = result['rev']
+            Customer._written(customer.id, document)
+            return True
+        raise CouchError(409, {'error': 'conflict', 'reason': 'Document update conflict.'})
+
+    @classmethod
+    async def delete(cls, customer_id):
+        """ Deletes a Customer if it exists """
+        document = await cls.database.get(customer_id)
+        if document is None:
+            return
+        try:
+            await cls.database.delete(customer_id, document['_rev'])
+        except CouchError as error:
+            if error.status != 404:
+                raise
+        Customer._written(customer_id)
@@ -0,0 +1,108 @@
+"""
+WSGI Bridge
+
+Serves a WSGI application, the Flask app, from ASGI. Every request runs on
+a thread of a pool, so slow or streaming responses (like the stream of
+changes) don't hold up the others, and the body is sent a chunk at a time
+as the application produces it.
+"""
+import io
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ClientDisconnected(IOError):
+    """ Raised in the application thread once the client has gone away """
+
+
+def wsgi_environ(scope, body):
+    """ Returns the WSGI environ of an ASGI HTTP request """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+class WsgiBridge(object):
+    """ Runs a WSGI application on a pool of threads for ASGI requests """
+
+    def __init__(self, application, threads=32):
+        self.application = application
+        self.executor = ThreadPoolExecutor(threads)
+
+    async def __call__(self, scope, body, receive, send):
+        """ Serves one request whose body was already received """
+        loop = asyncio.get_event_loop()
+        disconnected = []
+
+        async def watch():
+            """ Notices when the client goes away """
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.append(True)
+
+        def send_from_thread(message):
+            """ Sends a message from the application thread """
+            if disconnected:
+                raise ClientDisconnected()
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await loop.run_in_executor(self.executor, self._run, scope, body, send_from_thread)
+        except ClientDisconnected:
+            pass
+        finally:
+            watcher.cancel()
+
+    def _run(self, scope, body, send):
+        """ Calls the application and sends its response """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            """ Keeps the status and headers until the first chunk of the body """
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+            return lambda data: send_body(data, True)
+
+        def send_body(data, more):
+            """ Sends the headers on the first call and then a chunk of the body """
+            if 'sent' not in response:
+                response['sent'] = True
+                send({'type': 'http.response.start', 'status': response['status'],
+                      'headers': response['headers']})
+            send({'type': 'http.response.body', 'body': data, 'more_body': more})
+
+        result = self.application(wsgi_environ(scope, body), start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    send_body(chunk, True)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        send_body(b'', False)
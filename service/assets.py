@@ -0,0 +1,153 @@
+"""
+Static Assets
+
+The stylesheets, scripts and images of the UI are served under URLs that
+carry a hash of their content, e.g. /static/js/rest_api_1.3f2a9c1d0b7e.js,
+so browsers keep them for a year without asking again: a file that changes
+gets a new URL. The hashed copies and their gzip and brotli compressed
+variants are written ahead of time into static/dist, with a manifest of
+the hashed names, by:
+  python -m service.commands.assets
+Without them the hashes are computed when the app starts and the files are
+served uncompressed from where they are.
+"""
+import os
+import io
+import json
+import gzip
+import shutil
+import hashlib
+
+try:
+    import brotli
+except ImportError:     # brotli variants are only written when it is installed
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST = 'dist'                       # the directory of the hashed copies under STATIC_DIR
+MANIFEST = 'manifest.json'          # the hashed name of every asset in DIST
+HASH_LENGTH = 12                    # hex digits of the content hash in a name
+MAX_AGE = 365 * 24 * 60 * 60        # seconds browsers keep a hashed asset
+COMPRESSED = ('.css', '.js', '.html', '.svg', '.json', '.txt')   # images already are
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))    # in order of preference
+
+
+def hashed_name(path, content):
+    """ Returns the name of an asset with the hash of its content before the extension """
+    name, extension = os.path.splitext(path)
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    return '{}.{}{}'.format(name, digest, extension)
+
+
+def source_files(static_dir):
+    """ Yields the path of every asset relative to static_dir, with forward slashes """
+    for folder, folders, files in os.walk(static_dir):
+        if folder == static_dir and DIST in folders:
+            folders.remove(DIST)
+        folders.sort()
+        for filename in sorted(files):
+            path = os.path.relpath(os.path.join(folder, filename), static_dir)
+            yield path.replace(os.sep, '/')
+
+
+def _gzip(content):
+    """ Returns content compressed with gzip, the same bytes for the same content """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buffer, compresslevel=9, mtime=0) as out:
+        out.write(content)
+    return buffer.getvalue()
+
+
+def build(static_dir=STATIC_DIR):
+    """
+    Writes the hashed copy of every asset and its compressed variants into DIST
+
+    Variants are only kept when they are smaller than the asset.
+
+    Returns:
+        dict: the number of assets and their bytes as they are and compressed
+    """
+    dist_dir = os.path.join(static_dir, DIST)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    stats = {'assets': 0, 'bytes': 0, 'gzip': 0, 'br': 0}
+    manifest = {}
+    for path in source_files(static_dir):
+        with open(os.path.join(static_dir, path), 'rb') as source:
+            content = source.read()
+        hashed = manifest[path] = hashed_name(path, content)
+        target = os.path.join(dist_dir, hashed)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        variants = [('', content, 'bytes')]
+        if os.path.splitext(path)[1] in COMPRESSED:
+            variants.append(('.gz', _gzip(content), 'gzip'))
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(content, quality=11), 'br'))
+        for suffix, data, counter in variants:
+            if suffix and len(data) >= len(content):
+                continue
+            with open(target + suffix, 'wb') as out:
+                out.write(data)
+            stats[counter] += len(data)
+        stats['assets'] += 1
+    with open(os.path.join(dist_dir, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+    return stats
+
+
+class AssetManifest(object):
+    """ The hashed URL of every asset and the files that answer them """
+
+    def __init__(self, static_dir=STATIC_DIR):
+        self.static_dir = static_dir
+        self.built = False  # True when serving the output of build()
+        self.names = {}     # asset path -> hashed path
+        self.files = {}     # hashed path -> {encoding: file}, None for the file as it is
+        self.load()
+
+    def load(self):
+        """ Reads the manifest of build(), else hashes the assets where they are """
+        dist_dir = os.path.join(self.static_dir, DIST)
+        manifest = os.path.join(dist_dir, MANIFEST)
+        self.built = os.path.exists(manifest)
+        if self.built:
+            with open(manifest) as source:
+                self.names = json.load(source)
+        else:
+            self.names = {}
+            for path in source_files(self.static_dir):
+                with open(os.path.join(self.static_dir, path), 'rb') as source:
+                    self.names[path] = hashed_name(path, source.read())
+        self.files = {}
+        for path, hashed in self.names.items():
+            if not self.built:
+                self.files[hashed] = {None: os.path.join(self.static_dir, path)}
+                continue
+            target = os.path.join(dist_dir, hashed)
+            files = self.files[hashed] = {None: target}
+            for encoding, suffix in ENCODINGS:
+                if os.path.exists(target + suffix):
+                    files[encoding] = target + suffix
+
+    def url(self, path):
+        """ Returns the URL of an asset, its hashed one when there is one """
+        return '/static/' + self.names.get(path, path)
+
+    def find(self, hashed, accept_encodings):
+        """
+        Returns the file to send for a hashed asset and its content encoding
+
+        Args:
+            hashed (str): the hashed path of an asset
+            accept_encodings: the encodings the client accepts, by quality
+
+        Returns:
+            tuple: (file, encoding or None), or None if hashed isn't a hashed asset
+        """
+        files = self.files.get(hashed)
+        if files is None:
+            return None
+        for encoding, _ in ENCODINGS:
+            if encoding in files and accept_encodings[encoding]:
+                return files[encoding], encoding
+        return files[None], None
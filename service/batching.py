@@ -0,0 +1,121 @@
+"""
+Write Coalescer
+
+Gathers single document writes that arrive within a few milliseconds of
+each other into one _bulk_docs request and hands each writer back its own
+result. A write that Cloudant rejects raises HTTPError in the thread that
+made it, just like saving the document on its own would.
+"""
+import os
+import time
+import logging
+import threading
+from requests import HTTPError
+
+try:
+    from queue import Queue, Empty     # Python 3
+except ImportError:
+    from Queue import Queue, Empty     # Python 2
+
+
+class _PendingWrite(object):
+    """ A document waiting to be written """
+    def __init__(self, document):
+        self.document = document
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WriteCoalescer(object):
+    """ Coalesces concurrent document writes into _bulk_docs requests """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, bulk_docs, window, max_batch=100):
+        """
+        Args:
+            bulk_docs (callable): writes a list of documents and returns the results
+            window (float): seconds to wait for more writes after the first one
+            max_batch (int): largest number of documents written at once
+        """
+        self.bulk_docs = bulk_docs
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    @property
+    def enabled(self):
+        """ Writes are only coalesced when there is a window to gather them in """
+        return self.window > 0
+
+    def save(self, document):
+        """
+        Writes a document and returns its result, e.g. {"id": ..., "rev": ...}
+
+        Raises HTTPError if the document could not be written
+        """
+        pending = _PendingWrite(document)
+        self._ensure_started().put(pending)
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_started(self):
+        """ Starts the writer thread, again in a forked child process """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = Queue()
+                thread = threading.Thread(target=self._run, args=(self._queue,),
+                                          name='write-coalescer')
+                thread.daemon = True
+                thread.start()
+            return self._queue
+
+    def _run(self, queue):
+        """ Gathers writes into batches and flushes them """
+        while True:
+            batch = [queue.get()]
+            deadline = time.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(queue.get(timeout=remaining))
+                except Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """ Writes a batch and hands every writer its result """
+        try:
+            results = self.bulk_docs([pending.document for pending in batch])
+        except Exception as error:  # every writer in the batch gets the error
+            self.logger.warning('Bulk write of %s documents failed: %s', len(batch), error)
+            results = [error] * len(batch)
+        if len(results) != len(batch):
+            results = [HTTPError('Bulk write returned {} results for {} documents'
+                                 .format(len(results), len(batch)))] * len(batch)
+        self.batches += 1
+        self.writes += len(batch)
+        for pending, result in zip(batch, results):
+            if isinstance(result, Exception):
+                pending.error = result
+            elif 'error' in result:
+                pending.error = HTTPError('{}: {}'.format(result['error'], result.get('reason')))
+            else:
+                pending.result = result
+            pending.event.set()
+
+    def stats(self):
+        """ Returns counters describing the coalescer """
+        return {
+            'batches': self.batches,
+            'writes': self.writes
+        }
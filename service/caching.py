@@ -0,0 +1,372 @@
+"""
+Caching helpers for the Customer model
+
+SingleFlight lets concurrent callers asking for the same thing share a
+single backend request, NegativeCache remembers for a short time which
+keys were not found so that repeated misses don't reach Cloudant,
+QueryCache keeps serialized query results until a change invalidates
+them and ResponseCache keeps single documents as ready to send bytes.
+All of them are per worker process and thread safe.
+"""
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+class _Call(object):
+    """ A backend call that other threads can wait on """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls that share the same key """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0      # calls that went to the backend
+        self.shared = 0     # calls that waited on another caller instead
+
+    def do(self, key, function, *args):
+        """
+        Calls function(*args) unless a call for the same key is already in
+        flight, in which case the result of that call is returned instead
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class NegativeCache(object):
+    """ Remembers keys that were recently not found """
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._expires = OrderedDict()
+
+    def __contains__(self, key):
+        if self.ttl <= 0:
+            return False
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is None:
+                return False
+            if expires < time.time():
+                del self._expires[key]
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, key):
+        """ Records that a key was not found """
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._expires.pop(key, None)
+            while len(self._expires) >= self.max_size:
+                self._expires.popitem(last=False)
+            self._expires[key] = time.time() + self.ttl
+
+    def discard(self, key):
+        """ Forgets a key, e.g. because it has just been created """
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def clear(self):
+        """ Forgets all keys """
+        with self._lock:
+            self._expires.clear()
+
+
+def selector_may_match(selector, document):
+    """
+    Returns False only when a document certainly does not match a selector
+
+    Plain field equality (including nested fields) is checked; anything
+    using an operator is assumed to match so that callers err on the side
+    of invalidating.
+    """
+    if not isinstance(document, dict):
+        return False
+    for field, expected in selector.items():
+        if field.startswith('$'):
+            return True
+        if isinstance(expected, dict):
+            if any(key.startswith('$') for key in expected):
+                return True
+            if not selector_may_match(expected, document.get(field)):
+                return False
+        elif document.get(field) != expected:
+            return False
+    return True
+
+
+class _Entry(object):
+    """ A cached query result """
+    __slots__ = ('selector', 'body', 'ids', 'created')
+
+    def __init__(self, selector, body, ids):
+        self.selector = selector
+        self.body = body
+        self.ids = ids
+        self.created = time.time()
+
+
+class QueryCache(object):
+    """
+    LRU cache of serialized query results
+
+    Results are stored as JSON text and the cache is bounded by the total
+    size of that text. An entry is dropped when a change touches one of
+    the documents it holds or a changed document may match its selector,
+    and it is never served once it is older than max_age seconds.
+    """
+
+    def __init__(self, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self):
+        """ The cache is disabled with a max_age or max_bytes of zero """
+        return self.max_age > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        """ Returns the cached documents for a key or None """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry.created + self.max_age < time.time():
+                if entry is not None:
+                    self.size -= len(entry.body)
+                self.misses += 1
+                return None
+            self._entries[key] = entry      # most recently used goes last
+            self.hits += 1
+            body = entry.body
+        return json.loads(body)
+
+    def put(self, key, selector, documents, generation):
+        """
+        Caches the documents returned for a key
+
+        generation must be the value of self.generation read before the query
+        was sent; if anything was invalidated meanwhile the result may already
+        be stale and it isn't cached.
+        """
+        if not self.enabled:
+            return
+        body = json.dumps(documents)
+        if len(body) > self.max_bytes:
+            return
+        ids = frozenset(document.get('_id') for document in documents)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = _Entry(selector, body, ids)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                self.size -= len(entry.body)
+                self.evictions += 1
+
+    def invalidate(self, document_id, document=None):
+        """
+        Drops every entry holding a document or that a changed document
+        may now match. Pass document=None for deletions.
+        """
+        with self._lock:
+            self.generation += 1
+            for key, entry in list(self._entries.items()):
+                if document_id in entry.ids or \
+                   (document is not None and selector_may_match(entry.selector, document)):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """ Drops every entry """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        """ Removes an entry; the lock must be held """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+    def stats(self):
+        """ Returns counters describing the cache """
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions
+        }
+
+
+def gzip_bytes(data, level=6):
+    """ Compresses bytes into the gzip format """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class EncodedDocument(object):
+    """ The JSON encoded parts of one revision of a document """
+
+    def __init__(self, rev, parts, compress=False):
+        self.rev = rev
+        self.bodies = dict((name, (json.dumps(data) + '\n').encode('utf-8'))
+                           for name, data in parts.items())
+        self.gzipped = {}
+        if compress:
+            for name, body in self.bodies.items():
+                self.gzipped[name] = gzip_bytes(body)
+        self.created = time.time()
+
+    @property
+    def size(self):
+        """ Bytes held by this document """
+        return sum(len(body) for body in self.bodies.values()) + \
+               sum(len(body) for body in self.gzipped.values())
+
+
+class ResponseCache(object):
+    """
+    LRU cache of documents encoded as response bodies
+
+    Each entry holds one revision of a document already encoded as JSON
+    (and gzip when compress is set) so that serving it needs neither model
+    objects nor a JSON encoder. Entries are dropped when the document
+    changes and are never served once older than max_age seconds.
+    """
+
+    def __init__(self, max_bytes, max_age, compress=False):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self):
+        """ The cache is disabled with a max_age or max_bytes of zero """
+        return self.max_age > 0 and self.max_bytes > 0
+
+    def get(self, document_id):
+        """ Returns the EncodedDocument cached for an id or None """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.pop(document_id, None)
+            if entry is None or entry.created + self.max_age < time.time():
+                if entry is not None:
+                    self.size -= entry.size
+                self.misses += 1
+                return None
+            self._entries[document_id] = entry
+            self.hits += 1
+            return entry
+
+    def put(self, document_id, rev, parts, generation):
+        """
+        Encodes the parts of a document and caches them
+
+        Returns the EncodedDocument, which is usable even when it wasn't cached
+        because the cache is disabled or something changed since generation.
+        """
+        entry = EncodedDocument(rev, parts, self.compress and self.enabled)
+        if not self.enabled or entry.size > self.max_bytes:
+            return entry
+        with self._lock:
+            if generation != self.generation:
+                return entry
+            self._remove(document_id)
+            self._entries[document_id] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, document_id, rev=None):
+        """ Drops a document unless the cached revision is rev """
+        with self._lock:
+            self.generation += 1
+            entry = self._entries.get(document_id)
+            if entry is not None and (rev is None or entry.rev != rev):
+                self._remove(document_id)
+                self.invalidations += 1
+
+    def clear(self):
+        """ Drops every entry """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, document_id):
+        """ Removes an entry; the lock must be held """
+        entry = self._entries.pop(document_id, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def stats(self):
+        """ Returns counters describing the cache """
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions
+        }
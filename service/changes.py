@@ -0,0 +1,186 @@
+"""
+Changes Feed Follower
+
+Follows the CouchDB _changes feed of the customer database in a background
+thread and hands every change to the listeners that subscribed to it. One
+follower is shared by everything in a worker process that needs to hear
+about writes made by other workers, so the number of feeds open against
+Cloudant doesn't grow with the number of consumers.
+"""
+import json
+import logging
+import threading
+from requests import HTTPError, ConnectionError, Timeout
+
+try:
+    from queue import Queue, Empty, Full   # Python 3
+except ImportError:
+    from Queue import Queue, Empty, Full   # Python 2
+
+
+class ChangeFollower(object):
+    """ Follows the _changes feed of a database in a background thread """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, database, heartbeat=10000, retry_delay=1, max_retry_delay=30):
+        self.database = database
+        self.heartbeat = heartbeat                  # milliseconds
+        self.retry_delay = retry_delay              # seconds
+        self.max_retry_delay = max_retry_delay      # seconds
+        self.last_seq = None
+        self.connected = False
+        self.changes = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def subscribe(self, listener, max_subscriptions=None):
+        """
+        Registers a callable that is given every change
+
+        Args:
+            max_subscriptions (int): refuse a Subscription when this many
+                Subscriptions are registered already, None for no limit
+
+        Returns:
+            bool: False when the listener was refused
+        """
+        with self._lock:
+            if listener in self._listeners:
+                return True
+            if max_subscriptions is not None and isinstance(listener, Subscription) and \
+                    self._subscriptions() >= max_subscriptions:
+                return False
+            self._listeners.append(listener)
+            return True
+
+    def _subscriptions(self):
+        """ Returns the number of registered Subscriptions """
+        return sum(1 for listener in self._listeners if isinstance(listener, Subscription))
+
+    def unsubscribe(self, listener):
+        """ Removes a listener """
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def start(self):
+        """ Starts following the feed unless it is already being followed """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='changes-follower')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops following the feed """
+        self._stopped.set()
+
+    @property
+    def running(self):
+        """ True while the background thread is alive """
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        """ Follows the feed, reconnecting with a backoff when it fails """
+        delay = self.retry_delay
+        while not self._stopped.is_set():
+            try:
+                self._follow()
+                delay = self.retry_delay
+            except (HTTPError, ConnectionError, Timeout, ValueError) as error:
+                self.logger.warning('Changes feed failed: %s', error)
+                self._stopped.wait(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+            finally:
+                self.connected = False
+
+    def _follow(self):
+        """ Reads the continuous feed from the last sequence seen """
+        params = {
+            'feed': 'continuous',
+            'include_docs': 'true',
+            'heartbeat': self.heartbeat,
+            'since': self.last_seq if self.last_seq is not None else 'now'
+        }
+        url = '/'.join((self.database.database_url, '_changes'))
+        response = self._session().get(url, params=params, stream=True)
+        response.raise_for_status()
+        self.connected = True
+        try:
+            for line in response.iter_lines():
+                if self._stopped.is_set():
+                    break
+                if not line:
+                    continue    # heartbeat
+                change = json.loads(line.decode('utf-8'))
+                if 'seq' not in change or 'id' not in change:
+                    continue
+                self.last_seq = change['seq']
+                self._publish(change)
+        finally:
+            response.close()
+
+    def _session(self):
+        """
+        Returns the client's session with a read timeout of its own for the feed
+
+        The cloudant session sends every request with the timeout of the
+        client, so the feed is read through a copy of it that shares its
+        cookies and connections, and still renews an expired cookie itself.
+        """
+        shared = self.database.r_session
+        session = shared.__class__.__new__(shared.__class__)
+        session.__dict__.update(shared.__dict__)    # copy.copy only keeps the requests fields
+        session._timeout = (10, self.heartbeat * 3 / 1000.0)   # pylint: disable=protected-access
+        return session
+
+    def _publish(self, change):
+        """ Hands a change to every listener """
+        self.changes += 1
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(change)
+            except Exception:   # a broken listener must not stop the feed
+                self.logger.exception('Change listener failed')
+
+    def stats(self):
+        """ Returns counters describing the follower """
+        return {
+            'running': self.running,
+            'connected': self.connected,
+            'changes': self.changes,
+            'listeners': len(self._listeners),
+            'subscriptions': self._subscriptions()
+        }
+
+
+class Subscription(object):
+    """
+    A bounded queue of changes for one consumer of a ChangeFollower
+
+    Subscribe the Subscription itself as a listener. A consumer that falls
+    more than max_pending changes behind is marked as overflowed instead of
+    holding up the feed or growing without bounds.
+    """
+
+    def __init__(self, max_pending=1000):
+        self.overflowed = False
+        self._queue = Queue(max_pending)
+
+    def __call__(self, change):
+        try:
+            self._queue.put_nowait(change)
+        except Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """ Returns the next change, or None if none arrived within timeout seconds """
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
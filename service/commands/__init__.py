@@ -0,0 +1,6 @@
+"""
+This Package contains the command line jobs that work on the Customer database
+
+Each module is run on its own, e.g.
+  python -m service.commands.dedup --help
+"""
@@ -0,0 +1,30 @@
+"""
+Static Asset Build
+
+Writes a copy of every asset of the UI named with the hash of its content,
+with gzip and brotli compressed variants, and the manifest the app reads
+to link them (see service/assets.py). Run it whenever the static folder
+changes, before the app starts:
+  python -m service.commands.assets
+"""
+from __future__ import print_function
+import sys
+import json
+import argparse
+from service.assets import STATIC_DIR, build, brotli
+
+
+def main(argv=None):
+    """ Builds the hashed and compressed assets """
+    parser = argparse.ArgumentParser(description='Build the hashed and compressed assets')
+    parser.add_argument('--static-dir', default=STATIC_DIR, help='the folder of the assets')
+    args = parser.parse_args(argv)
+
+    stats = build(args.static_dir)
+    if brotli is None:
+        print('brotli is not installed, only gzip variants were written', file=sys.stderr)
+    print(json.dumps(stats, sort_keys=True), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
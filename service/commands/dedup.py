@@ -0,0 +1,281 @@
+"""
+Duplicate Customer Detection
+
+Finds customers that were probably entered more than once, e.g. with a
+slightly different spelling of their name or address. Comparing every
+customer with every other one doesn't scale, so customers are only
+compared with the candidates that share a blocking key with them: their
+normalized email, their zip code and last name, or the sound of their
+names in the same city. The job makes three passes:
+
+1. Customers are streamed out of the database a page at a time and a
+   compact record is appended for every blocking key to one of several
+   partition files chosen by hashing the key, so that all the records of
+   a block end up in the same partition.
+2. Every partition is loaded on its own (several at once with --workers)
+   and the records within each block are compared in pairs.
+3. Matching pairs are merged into clusters with a union-find and written
+   to the report as one JSON line per cluster.
+
+Memory is bounded by the size of a partition instead of the number of
+customers. Blocks larger than --max-block, such as a placeholder email
+shared by thousands of customers, are skipped instead of compared.
+
+Run it with:
+  python -m service.commands.dedup --output duplicates.ndjson [--workers 4]
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from service.text import normalize_text, normalize_email, soundex, trigrams, jaccard
+
+######################################################################
+#  B L O C K I N G   A N D   S C O R I N G
+######################################################################
+
+def compact_record(document):
+    """ Keeps the normalized fields of a Customer document that are compared """
+    address = document.get('address') or {}
+    first = normalize_text(document.get('firstname'))
+    last = normalize_text(document.get('lastname'))
+    return {
+        'id': document['_id'],
+        'first': first,
+        'last': last,
+        'sound': soundex(first) + soundex(last) if first and last else '',
+        'email': normalize_email(document.get('email')),
+        'street': normalize_text(address.get('address1')),
+        'city': normalize_text(address.get('city')),
+        'zip': normalize_text(address.get('zip')).replace(' ', '')
+    }
+
+
+def blocking_keys(record):
+    """ Returns the keys of the blocks a record is compared within """
+    keys = []
+    if record['email']:
+        keys.append('email:' + record['email'])
+    if record['zip'] and record['last']:
+        keys.append('zip:{}|{}'.format(record['zip'], record['last']))
+    if record['sound'] and record['city']:
+        keys.append('sound:{}|{}'.format(record['sound'], record['city']))
+    return keys
+
+
+def similarity(first, second):
+    """
+    Scores how likely two records are the same customer, from 0 to 1
+
+    The same email is taken as proof; otherwise the score weighs how
+    alike the names are (spelled or sounded out) against how alike the
+    addresses are.
+    """
+    if first['email'] and first['email'] == second['email']:
+        return 1.0
+    names = jaccard(trigrams(first['first'] + ' ' + first['last']),
+                    trigrams(second['first'] + ' ' + second['last']))
+    if first['sound'] and first['sound'] == second['sound']:
+        names = max(names, 0.9)
+    streets = jaccard(trigrams(first['street']), trigrams(second['street']))
+    if first['zip'] and first['zip'] == second['zip']:
+        streets = min(1.0, streets + 0.2)
+    return 0.6 * names + 0.4 * streets
+
+
+def compare_partition(path, threshold, max_block):
+    """
+    Compares the records of every block in a partition file
+
+    Returns:
+        tuple: the matching (id, id, score) pairs, the number of comparisons
+        made and the number of blocks skipped for being larger than max_block
+    """
+    blocks = {}
+    with open(path) as partition:
+        for line in partition:
+            key, record = json.loads(line)
+            blocks.setdefault(key, []).append(record)
+    pairs = []
+    comparisons = 0
+    skipped = 0
+    for records in blocks.values():
+        if len(records) > max_block:
+            skipped += 1
+            continue
+        for i, first in enumerate(records):
+            for second in records[i + 1:]:
+                if first['id'] == second['id']:
+                    continue
+                comparisons += 1
+                score = similarity(first, second)
+                if score >= threshold:
+                    ids = sorted((first['id'], second['id']))
+                    pairs.append((ids[0], ids[1], round(score, 3)))
+    return pairs, comparisons, skipped
+
+
+def _compare_partition(args):
+    """ compare_partition taking a single tuple, for Pool.imap_unordered """
+    return compare_partition(*args)
+
+
+class UnionFind(object):
+    """ Merges ids into clusters as pairs of them are found to match """
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        """ Returns the representative of the cluster of an item """
+        root = self.parent.setdefault(item, item)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while item != root:     # compress the path for next time
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first, second):
+        """ Merges the clusters of two items """
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+
+######################################################################
+#  D U P L I C A T E   F I N D E R
+######################################################################
+
+class DuplicateFinder(object):
+    """ Finds clusters of duplicate customers in a stream of documents """
+
+    def __init__(self, partitions=64, workers=1, threshold=0.75, max_block=500):
+        """
+        Args:
+            partitions (int): number of files the blocks are spread over
+            workers (int): number of processes comparing partitions
+            threshold (float): lowest score of a pair taken as duplicates
+            max_block (int): largest block that is compared
+        """
+        self.partitions = partitions
+        self.workers = workers
+        self.threshold = threshold
+        self.max_block = max_block
+
+    def run(self, documents, report):
+        """
+        Writes the clusters of duplicates found in documents to report
+
+        Args:
+            documents (iterable): Customer documents as stored in the database
+            report (file): where each cluster is written as a line of JSON
+
+        Returns:
+            dict: counters describing the run
+        """
+        start = time.time()
+        workdir = tempfile.mkdtemp(prefix='dedup-')
+        try:
+            paths, scanned = self._partition(documents, workdir)
+            clusters = UnionFind()
+            cluster_pairs = []
+            stats = {'customers': scanned, 'comparisons': 0, 'skipped_blocks': 0}
+            for pairs, comparisons, skipped in self._compare(paths):
+                stats['comparisons'] += comparisons
+                stats['skipped_blocks'] += skipped
+                for first, second, score in pairs:
+                    clusters.union(first, second)
+                    cluster_pairs.append((first, second, score))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        members = {}
+        for item in clusters.parent:
+            members.setdefault(clusters.find(item), []).append(item)
+        pairs_by_root = {}
+        for first, second, score in set(cluster_pairs):
+            pairs_by_root.setdefault(clusters.find(first), []).append([first, second, score])
+        for root in sorted(members):
+            report.write(json.dumps({'ids': sorted(members[root]),
+                                     'pairs': sorted(pairs_by_root[root])}) + '\n')
+
+        stats['pairs'] = len(set((first, second) for first, second, _ in cluster_pairs))
+        stats['clusters'] = len(members)
+        stats['duplicates'] = sum(len(ids) - 1 for ids in members.values())
+        stats['seconds'] = round(time.time() - start, 3)
+        return stats
+
+    def _partition(self, documents, workdir):
+        """ Appends the record of every document to the partition of each of its blocks """
+        paths = [os.path.join(workdir, '{:04d}.ndjson'.format(number))
+                 for number in range(self.partitions)]
+        files = [open(path, 'w') for path in paths]
+        scanned = 0
+        try:
+            for document in documents:
+                scanned += 1
+                record = compact_record(document)
+                for key in blocking_keys(record):
+                    number = (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % self.partitions
+                    files[number].write(json.dumps([key, record]) + '\n')
+        finally:
+            for partition in files:
+                partition.close()
+        return [path for path in paths if os.path.getsize(path)], scanned
+
+    def _compare(self, paths):
+        """ Generates the results of comparing every partition """
+        tasks = [(path, self.threshold, self.max_block) for path in paths]
+        if self.workers <= 1:
+            for task in tasks:
+                yield _compare_partition(task)
+            return
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            for result in pool.imap_unordered(_compare_partition, tasks):
+                yield result
+        finally:
+            pool.terminate()
+
+
+######################################################################
+#   M A I N
+######################################################################
+
+def main(argv=None):
+    """ Scans the customer database and writes a report of its duplicates """
+    from service.models import Customer, BULK_PAGE_SIZE
+    parser = argparse.ArgumentParser(description='Find duplicate customers')
+    parser.add_argument('--database', default='customers', help='database to scan')
+    parser.add_argument('--output', default='-', help='report file, - for stdout')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='processes comparing partitions')
+    parser.add_argument('--partitions', type=int, default=64,
+                        help='number of temporary partition files')
+    parser.add_argument('--threshold', type=float, default=0.75,
+                        help='lowest similarity taken as a duplicate, from 0 to 1')
+    parser.add_argument('--max-block', type=int, default=500,
+                        help='blocks with more customers are skipped')
+    parser.add_argument('--page-size', type=int, default=BULK_PAGE_SIZE,
+                        help='customers read per database request')
+    args = parser.parse_args(argv)
+
+    Customer.init_db(args.database)
+    finder = DuplicateFinder(args.partitions, args.workers, args.threshold, args.max_block)
+    report = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        stats = finder.run(Customer.iter_documents(args.page_size), report)
+    finally:
+        if report is not sys.stdout:
+            report.close()
+    print(json.dumps(stats, sort_keys=True), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
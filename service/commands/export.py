@@ -0,0 +1,57 @@
+"""
+Customer Export
+
+Streams every customer out of the database a page at a time into a CSV
+or Parquet file for analysis, and optionally prints summary statistics
+(customers by country and province, subscription rate) computed over the
+same columns. Parquet needs pyarrow to be installed.
+
+Run it with:
+  python -m service.commands.export --format parquet --output customers.parquet --stats
+"""
+from __future__ import print_function
+import sys
+import json
+import argparse
+from service.export import BATCH_SIZE, ColumnStats, column_batches, counted, csv_chunks, \
+    write_parquet
+
+
+def main(argv=None):
+    """ Writes every customer of the database to a CSV or Parquet file """
+    from service.models import Customer, BULK_PAGE_SIZE
+    parser = argparse.ArgumentParser(description='Export customers')
+    parser.add_argument('--database', default='customers', help='database to export')
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv',
+                        help='file format')
+    parser.add_argument('--output', default='-', help='export file, - for stdout (CSV only)')
+    parser.add_argument('--stats', action='store_true',
+                        help='print summary statistics to stderr')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='rows held in memory, and per Parquet row group')
+    parser.add_argument('--page-size', type=int, default=BULK_PAGE_SIZE,
+                        help='customers read per database request')
+    args = parser.parse_args(argv)
+    if args.format == 'parquet' and args.output == '-':
+        parser.error('--output is required for Parquet exports')
+
+    Customer.init_db(args.database)
+    stats = ColumnStats()
+    batches = column_batches(Customer.iter_documents(args.page_size), args.batch_size)
+    if args.format == 'parquet':
+        write_parquet(batches, args.output, stats)
+    else:
+        batches = counted(batches, stats)
+        output = sys.stdout if args.output == '-' else open(args.output, 'w')
+        try:
+            for chunk in csv_chunks(batches):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    if args.stats:
+        print(json.dumps(stats.summary(), sort_keys=True), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
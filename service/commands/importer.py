@@ -0,0 +1,273 @@
+"""
+Customer Import
+
+Loads a large CSV or NDJSON file of customers, e.g. from a partner, without
+a POST per customer. The file is streamed a row at a time and every row is
+validated by Customer.deserialize. Valid rows are written in batches with
+_bulk_docs, several batches at once, and invalid rows are written to the
+rejects file together with the reason.
+
+CSV files have the columns of the export (firstname, lastname, email,
+subscribed, address1, address2, city, province, country, zip and an
+optional _id). NDJSON lines are either in the same flat shape or shaped
+like the body of POST /customers.
+
+Rows without an _id are given one derived from the file name and their row
+number, so a row written twice is only stored once. With --checkpoint the
+number of the last row whose batch was written is saved after every batch,
+and an interrupted import run again with the same checkpoint continues
+after it.
+
+Run it with:
+  python -m service.commands.importer customers.csv --checkpoint customers.checkpoint
+"""
+from __future__ import print_function
+import io
+import os
+import csv
+import sys
+import json
+import time
+import uuid
+import argparse
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from service.models import Customer, DataValidationError, ADDRESS_FIELDS, BULK_PAGE_SIZE
+
+TRUE_VALUES = ('true', 't', 'yes', 'y', '1')
+FALSE_VALUES = ('false', 'f', 'no', 'n', '0', '')
+PROGRESS_SECONDS = 10
+
+######################################################################
+#  R O W S
+######################################################################
+
+def open_source(path):
+    """ Opens a file to import, - for stdin """
+    if path == '-':
+        return sys.stdin
+    if sys.version_info[0] > 2:
+        return io.open(path, encoding='utf-8', newline='')
+    return open(path, 'rb')
+
+
+def read_records(source, kind):
+    """ Generates the (row number, record) of every row of a CSV or NDJSON file """
+    if kind == 'csv':
+        for number, row in enumerate(csv.DictReader(source), 1):
+            # cells missing from short rows are left out so that they are reported
+            yield number, dict((name, value) for name, value in row.items()
+                               if name is not None and value is not None)
+        return
+    for number, line in enumerate(source, 1):
+        if line.strip():
+            yield number, line
+
+
+def parse_subscribed(value):
+    """ Reads the subscribed flag of a row, which is text in CSV files """
+    if isinstance(value, bool):
+        return value
+    text = (value or '').strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise DataValidationError('Invalid customer: subscribed must be true or false')
+
+
+def to_document(record, make_id):
+    """
+    Validates a row and returns it as a Customer document
+
+    Args:
+        record (dict or str): a CSV row or an NDJSON line
+        make_id (function): returns the _id of a row that has none
+
+    Raises:
+        DataValidationError: when the row isn't a valid Customer
+    """
+    if not isinstance(record, dict):
+        try:
+            record = json.loads(record)
+        except ValueError as error:
+            raise DataValidationError('Invalid JSON: {}'.format(error))
+        if not isinstance(record, dict):
+            raise DataValidationError('Invalid customer: expected a JSON object')
+    if not isinstance(record.get('address'), dict):
+        record = dict(record)
+        record['address'] = dict((name, record.pop(name)) for name in ADDRESS_FIELDS
+                                 if name in record)
+    if 'subscribed' in record:
+        record['subscribed'] = parse_subscribed(record['subscribed'])
+    customer = Customer().deserialize(record)
+    if not customer.firstname:
+        raise DataValidationError('Invalid customer: firstname is empty')
+    document = customer.serialize()
+    document['_id'] = customer.id or make_id()
+    return document
+
+######################################################################
+#  I M P O R T E R
+######################################################################
+
+class Importer(object):
+    """ Writes a stream of rows to the database in concurrent batches """
+
+    def __init__(self, write, batch_size=BULK_PAGE_SIZE, workers=4, id_prefix='',
+                 checkpoint=None, rejects=None):
+        """
+        Args:
+            write (function): writes a list of documents, returning None or an error for each
+            batch_size (int): documents per _bulk_docs request
+            workers (int): batches being written at the same time
+            id_prefix (str): makes the derived ids of rows unique to their file
+            checkpoint (str): file where progress is saved, to continue after a failure
+            rejects (file): where invalid rows are written as lines of JSON
+        """
+        self.write = write
+        self.batch_size = batch_size
+        self.workers = workers
+        self.id_prefix = id_prefix
+        self.checkpoint = checkpoint
+        self.rejects = rejects
+        self.stats = {'rows': 0, 'imported': 0, 'existing': 0, 'rejected': 0}
+        self.done = 0           # every row up to this one has been handled
+
+    def run(self, records):
+        """
+        Imports (row number, record) tuples and returns counters describing the run
+
+        Rows up to the one saved in the checkpoint are skipped. Rows that
+        were already stored, by an earlier run or with the same _id, are
+        counted as existing.
+        """
+        self._load_checkpoint()
+        start = time.time()
+        progress = start
+        skipped = 0
+        pool = ThreadPool(self.workers)
+        pending = deque()
+        batch = []
+        number = self.done
+        try:
+            for number, record in records:
+                if number <= self.done:
+                    skipped += 1
+                    continue
+                self.stats['rows'] += 1
+                try:
+                    batch.append((number, to_document(record, self._id_maker(number))))
+                except DataValidationError as error:
+                    self._reject(number, str(error), record)
+                if len(batch) >= self.batch_size:
+                    pending.append(self._submit(pool, batch, number))
+                    batch = []
+                while len(pending) >= self.workers:
+                    self._finish(*pending.popleft())
+                if time.time() - progress >= PROGRESS_SECONDS:
+                    progress = time.time()
+                    self._progress(start, skipped)
+            if batch:
+                pending.append(self._submit(pool, batch, number))
+            while pending:
+                self._finish(*pending.popleft())
+            if number > self.done:  # rejected rows after the last batch
+                self.done = number
+                self._save_checkpoint()
+        finally:
+            pool.terminate()
+        stats = dict(self.stats, skipped=skipped, seconds=round(time.time() - start, 3))
+        stats['rows_per_second'] = round(stats['rows'] / stats['seconds']) if stats['seconds'] else 0
+        return stats
+
+    def _id_maker(self, number):
+        """ Returns a function making the _id of a row that has none """
+        return lambda: uuid.uuid5(uuid.NAMESPACE_URL,
+                                  'import:{}:{}'.format(self.id_prefix, number)).hex
+
+    def _submit(self, pool, batch, last):
+        """ Starts writing a batch; its rows are done up to last once it is written """
+        documents = [document for _, document in batch]
+        return batch, last, pool.apply_async(self.write, (documents,))
+
+    def _finish(self, batch, last, result):
+        """ Waits for a batch to be written and counts the outcome of every row """
+        for (number, document), error in zip(batch, result.get()):
+            if error is None:
+                self.stats['imported'] += 1
+            elif error == 'conflict':
+                self.stats['existing'] += 1
+            else:
+                self._reject(number, error, document)
+        self.done = last
+        self._save_checkpoint()
+
+    def _reject(self, number, error, record):
+        """ Counts an invalid row and writes it to the rejects file """
+        self.stats['rejected'] += 1
+        if self.rejects is not None:
+            self.rejects.write(json.dumps({'row': number, 'error': error,
+                                           'record': record}) + '\n')
+
+    def _progress(self, start, skipped):
+        """ Prints how far the import got """
+        seconds = time.time() - start
+        print('{} rows ({:.0f}/sec), {} imported, {} existing, {} rejected, {} skipped'.format(
+            self.stats['rows'], self.stats['rows'] / seconds, self.stats['imported'],
+            self.stats['existing'], self.stats['rejected'], skipped), file=sys.stderr)
+
+    def _load_checkpoint(self):
+        """ Continues from the row saved in the checkpoint, if there is one """
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return
+        with open(self.checkpoint) as saved:
+            self.done = json.load(saved)['row']
+
+    def _save_checkpoint(self):
+        """ Saves the last row handled, replacing the checkpoint atomically """
+        if not self.checkpoint:
+            return
+        partial = self.checkpoint + '.tmp'
+        with open(partial, 'w') as saved:
+            json.dump({'row': self.done}, saved)
+        os.rename(partial, self.checkpoint)
+
+######################################################################
+#   M A I N
+######################################################################
+
+def main(argv=None):
+    """ Imports a CSV or NDJSON file of customers """
+    parser = argparse.ArgumentParser(description='Import customers')
+    parser.add_argument('source', help='CSV or NDJSON file, - for stdin')
+    parser.add_argument('--format', choices=('csv', 'ndjson'),
+                        help='file format, by default from the file extension')
+    parser.add_argument('--database', default='customers', help='database to import into')
+    parser.add_argument('--batch-size', type=int, default=BULK_PAGE_SIZE,
+                        help='customers per _bulk_docs request')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='batches written at the same time')
+    parser.add_argument('--checkpoint', help='file saving progress, to continue an import')
+    parser.add_argument('--rejects', default='-',
+                        help='file for invalid rows as lines of JSON, - for stderr')
+    args = parser.parse_args(argv)
+    kind = args.format or ('csv' if args.source.lower().endswith('.csv') else 'ndjson')
+
+    Customer.init_db(args.database)
+    source = open_source(args.source)
+    rejects = sys.stderr if args.rejects == '-' else open(args.rejects, 'a')
+    importer = Importer(Customer.insert_many, args.batch_size, args.workers,
+                        os.path.basename(args.source), args.checkpoint, rejects)
+    try:
+        stats = importer.run(read_records(source, kind))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if rejects is not sys.stderr:
+            rejects.close()
+    print(json.dumps(stats, sort_keys=True), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
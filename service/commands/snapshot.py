@@ -0,0 +1,47 @@
+"""
+Customer Snapshot
+
+Dumps every customer of a database to a compressed snapshot file, and
+restores a database from one, e.g. to put the fixtures of the BDD tests
+or of a staging environment in place. Restoring removes the customers
+that are there first.
+
+Run it with:
+  python -m service.commands.snapshot dump fixtures.ndjson.gz
+  python -m service.commands.snapshot restore fixtures.ndjson.gz --workers 4
+"""
+from __future__ import print_function
+import sys
+import json
+import argparse
+from service.models import Customer, BULK_PAGE_SIZE
+from service.snapshots import SnapshotError, dump, restore
+
+
+def main(argv=None):
+    """ Dumps or restores a snapshot of the customers """
+    parser = argparse.ArgumentParser(description='Dump or restore a snapshot of the customers')
+    parser.add_argument('action', choices=('dump', 'restore'))
+    parser.add_argument('snapshot', help='gzip compressed file of JSON lines')
+    parser.add_argument('--database', default='customers', help='database to dump or restore')
+    parser.add_argument('--batch-size', type=int, default=BULK_PAGE_SIZE,
+                        help='customers per _bulk_docs request')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='batches written at the same time')
+    args = parser.parse_args(argv)
+
+    Customer.init_db(args.database)
+    if args.action == 'dump':
+        with open(args.snapshot, 'wb') as output:
+            stats = {'bytes': dump(output)}
+    else:
+        with open(args.snapshot, 'rb') as source:
+            try:
+                stats = restore(source, args.batch_size, args.workers, sys.stderr)
+            except SnapshotError as error:
+                parser.error(str(error))
+    print(json.dumps(stats, sort_keys=True), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Columnar Customer Exports
+
+Turns the stream of Customer documents into batches of columns (one list
+of values per field) that are written out as CSV or, when pyarrow is
+installed, as Parquet with the country, province and city columns
+dictionary encoded. Summary statistics are computed a whole column at a
+time from the same batches, with pyarrow.compute when pyarrow is
+installed. Only one batch is held in memory at once, so
+millions of Customers can be exported in bounded memory.
+"""
+import io
+import csv
+import sys
+from collections import Counter
+from .text import TEXT_TYPE, to_text
+
+EXPORT_COLUMNS = ('_id', 'firstname', 'lastname', 'email', 'subscribed',
+                  'address1', 'address2', 'city', 'province', 'country', 'zip')
+DICTIONARY_COLUMNS = ('country', 'province', 'city')
+BATCH_SIZE = 50000      # rows per batch, and per Parquet row group
+
+if sys.version_info[0] > 2:
+    _Buffer = io.StringIO
+
+    def _encode(row):
+        """ Rows are written as they are by the Python 3 csv module """
+        return row
+else:
+    _Buffer = io.BytesIO
+
+    def _encode(row):
+        """ The Python 2 csv module only writes bytes """
+        return [value.encode('utf-8') if isinstance(value, TEXT_TYPE) else value
+                for value in row]
+
+_pyarrow = []       # pyarrow once it has been imported, or None if it isn't installed
+
+
+def load_pyarrow():
+    """ Imports pyarrow on first use, so only Parquet exports pay for it """
+    if not _pyarrow:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.parquet
+        except ImportError:     # optional, only needed for Parquet exports
+            pyarrow = None
+        _pyarrow.append(pyarrow)
+    return _pyarrow[0]
+
+
+def flatten(document):
+    """ Returns the values of a Customer document in the order of EXPORT_COLUMNS """
+    address = document.get('address') or {}
+    return (to_text(document.get('_id')),
+            to_text(document.get('firstname')),
+            to_text(document.get('lastname')),
+            to_text(document.get('email')),
+            bool(document.get('subscribed')),
+            to_text(address.get('address1')),
+            to_text(address.get('address2')),
+            to_text(address.get('city')),
+            to_text(address.get('province')),
+            to_text(address.get('country')),
+            to_text(address.get('zip')))
+
+
+def column_batches(documents, batch_size=BATCH_SIZE):
+    """ Generates dicts of column name to the list of its values, batch_size rows at a time """
+    rows = []
+    for document in documents:
+        rows.append(flatten(document))
+        if len(rows) >= batch_size:
+            yield _columns(rows)
+            rows = []
+    if rows:
+        yield _columns(rows)
+
+
+def _columns(rows):
+    """ Turns a list of rows into a dict of columns """
+    return dict(zip(EXPORT_COLUMNS, (list(values) for values in zip(*rows))))
+
+
+class ColumnStats(object):
+    """ Summary statistics of an export, added up a batch of columns at a time """
+
+    def __init__(self):
+        self.customers = 0
+        self.subscribed = 0
+        self.countries = Counter()
+        self.provinces = Counter()
+
+    def add(self, columns):
+        """
+        Counts a batch of columns, either lists or the Arrow arrays of a Parquet export
+
+        The columns are counted by pyarrow.compute, lists being turned into
+        Arrow arrays first. Without pyarrow lists are counted in Python.
+        """
+        self.customers += len(columns['_id'])
+        pyarrow = load_pyarrow()
+        if pyarrow is None:
+            self.subscribed += sum(columns['subscribed'])
+            self.countries.update(columns['country'])
+            self.provinces.update(columns['province'])
+            return
+        columns = _arrow_columns(pyarrow, columns, ('subscribed', 'country', 'province'))
+        self.subscribed += pyarrow.compute.sum(columns['subscribed']).as_py() or 0
+        for counter, name in ((self.countries, 'country'), (self.provinces, 'province')):
+            counts = pyarrow.compute.value_counts(columns[name])
+            counter.update(dict(zip(counts.field('values').to_pylist(),
+                                    counts.field('counts').to_pylist())))
+
+    def summary(self):
+        """ Returns the statistics as a dictionary """
+        return {
+            'customers': self.customers,
+            'subscribed': self.subscribed,
+            'subscription_rate': round(self.subscribed / float(self.customers), 4)
+                                 if self.customers else 0.0,
+            'by_country': dict(self.countries),
+            'by_province': dict(self.provinces)
+        }
+
+
+def _arrow_columns(pyarrow, columns, names):
+    """ Returns the named columns as Arrow arrays, converting the ones that are lists """
+    arrays = {}
+    for name in names:
+        values = columns[name]
+        if isinstance(values, list):
+            values = pyarrow.array(values, pyarrow.bool_() if name == 'subscribed'
+                                   else pyarrow.string())
+        arrays[name] = values
+    return arrays
+
+
+def counted(batches, stats):
+    """ Passes batches of columns through, adding each one to stats """
+    for columns in batches:
+        stats.add(columns)
+        yield columns
+
+
+def csv_chunks(batches):
+    """ Generates the CSV text of a header line and then of every batch """
+    buffer = _Buffer()
+    csv.writer(buffer).writerow(_encode(EXPORT_COLUMNS))
+    yield buffer.getvalue()
+    for columns in batches:
+        buffer = _Buffer()
+        rows = zip(*(columns[name] for name in EXPORT_COLUMNS))
+        csv.writer(buffer).writerows(_encode(row) for row in rows)
+        yield buffer.getvalue()
+
+
+def parquet_schema():
+    """ Returns the Arrow schema of a Parquet export """
+    pyarrow = load_pyarrow()
+    fields = []
+    for name in EXPORT_COLUMNS:
+        if name == 'subscribed':
+            kind = pyarrow.bool_()
+        elif name in DICTIONARY_COLUMNS:
+            kind = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        else:
+            kind = pyarrow.string()
+        fields.append(pyarrow.field(name, kind))
+    return pyarrow.schema(fields)
+
+
+def write_parquet(batches, path, stats=None):
+    """
+    Writes every batch of columns as a row group of a Parquet file
+
+    Args:
+        stats (ColumnStats): adds up the Arrow arrays of every batch if given
+    """
+    pyarrow = load_pyarrow()
+    if pyarrow is None:
+        raise RuntimeError('Parquet exports need pyarrow, install it with: pip install pyarrow')
+    schema = parquet_schema()
+    writer = pyarrow.parquet.ParquetWriter(path, schema, use_dictionary=list(DICTIONARY_COLUMNS),
+                                           compression='snappy')
+    try:
+        for columns in batches:
+            arrays = []
+            for field in schema:
+                if field.name in DICTIONARY_COLUMNS:
+                    array = pyarrow.array(columns[field.name], pyarrow.string()).dictionary_encode()
+                else:
+                    array = pyarrow.array(columns[field.name], field.type)
+                arrays.append(array)
+            if stats is not None:
+                stats.add(dict(zip(schema.names, arrays)))
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+    finally:
+        writer.close()
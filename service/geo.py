@@ -0,0 +1,216 @@
+"""
+Zip Code Proximity Index
+
+Answers "which Customers live within so many miles of a zip code" without
+looking at every Customer. Zip codes are placed on their centroids from a
+local table, and the centroids are bucketed into a grid of cells a fixed
+number of degrees wide. A radius query only measures the distance to the
+zip codes in the cells overlapping the circle, then returns the Customers
+indexed under the zip codes that are close enough.
+
+The bundled table only covers a seed set of zip codes; set
+ZIP_CENTROIDS_PATH to the Census ZCTA Gazetteer file (tab separated with
+GEOID, INTPTLAT and INTPTLONG columns) or to any zip,lat,lon CSV for
+complete coverage. Circles crossing the 180th meridian are not handled.
+Like the search index, the Customers are read without holding the lock
+and the updates made meanwhile are replayed before the new maps are used.
+"""
+import io
+import os
+import csv
+import math
+import threading
+from .text import to_text
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE = 69.0
+DEFAULT_CENTROIDS = os.path.join(os.path.dirname(__file__), 'data', 'zip_centroids.csv')
+
+
+def normalize_zip(value):
+    """ Returns the five digit zip code of e.g. "12345-6789" or 12345, or '' """
+    digits = ''.join(char for char in to_text(value) if char.isdigit())
+    return digits[:5] if len(digits) >= 5 else ''
+
+
+def haversine_miles(first, second):
+    """ Returns the great circle distance in miles between two (lat, lon) points """
+    lat1, lon1 = math.radians(first[0]), math.radians(first[1])
+    lat2, lon2 = math.radians(second[0]), math.radians(second[1])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def load_centroids(path):
+    """
+    Reads a table of zip code centroids
+
+    Lines starting with # are skipped. The first line left names the columns,
+    either zip, lat and lon or the GEOID, INTPTLAT and INTPTLONG of the Census
+    Gazetteer files, separated by commas or tabs.
+
+    Returns:
+        dict: zip code to its (lat, lon)
+    """
+    with io.open(path, encoding='utf-8') as table:
+        lines = [line for line in table if line.strip() and not line.startswith('#')]
+    if not lines:
+        return {}
+    delimiter = '\t' if '\t' in lines[0] else ','
+    rows = csv.reader(lines, delimiter=str(delimiter))
+    header = [name.strip().lower() for name in next(rows)]
+    zip_column = header.index('zip') if 'zip' in header else header.index('geoid')
+    lat_column = header.index('lat') if 'lat' in header else header.index('intptlat')
+    lon_column = header.index('lon') if 'lon' in header else header.index('intptlong')
+    centroids = {}
+    for row in rows:
+        zip_code = normalize_zip(row[zip_column])
+        if zip_code:
+            centroids[zip_code] = (float(row[lat_column]), float(row[lon_column]))
+    return centroids
+
+
+def _file(customers, zips, document_id, document):
+    """ Files a document under its zip code in the maps of a ZipIndex """
+    zip_code = normalize_zip((document.get('address') or {}).get('zip'))
+    if zip_code:
+        zips[document_id] = zip_code
+        customers.setdefault(zip_code, set()).add(document_id)
+
+
+class ZipIndex(object):
+    """ Grid of zip code centroids and the Customers living in each zip code """
+
+    def __init__(self, enabled=False, centroids_path='', cell_degrees=0.5):
+        """
+        Args:
+            enabled (bool): whether the index is used at all
+            centroids_path (str): zip code centroid table, the bundled one if empty
+            cell_degrees (float): width and height of the grid cells
+        """
+        self.enabled = enabled
+        self.centroids_path = centroids_path or DEFAULT_CENTROIDS
+        self.cell_degrees = cell_degrees
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()     # one build at a time
+        self._generation = 0                    # bumped by clear() to drop builds under way
+        self._pending = None                    # updates made during a build
+        self._centroids = None      # zip -> (lat, lon), read on first use
+        self._grid = {}             # (row, column) -> list of zips
+        self.clear()
+
+    def clear(self):
+        """ Forgets the Customers; they are read again on next use """
+        with self._lock:
+            self.built = False
+            self._generation += 1
+            self._pending = None
+            self._customers = {}    # zip -> set of Customer ids
+            self._zips = {}         # Customer id -> zip
+
+    def _cell(self, lat, lon):
+        """ Returns the grid cell of a point """
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def _load(self):
+        """ Reads the centroids and puts them on the grid; the lock must be held """
+        if self._centroids is not None:
+            return
+        self._centroids = load_centroids(self.centroids_path)
+        for zip_code, point in self._centroids.items():
+            self._grid.setdefault(self._cell(*point), []).append(zip_code)
+
+    def locate(self, zip_code):
+        """ Returns the (lat, lon) of a zip code or None if it isn't in the table """
+        with self._lock:
+            self._load()
+            return self._centroids.get(normalize_zip(zip_code))
+
+    def build(self, documents):
+        """
+        Indexes the zip code of every document unless the index is already built
+
+        The documents are filed into new maps without holding the lock,
+        which then take the place of the ones in use.
+        """
+        with self._build_lock:
+            with self._lock:
+                if self.built:
+                    return
+                self._load()
+                generation = self._generation
+                self._pending = []
+            customers, zips = {}, {}
+            try:
+                for document in documents:
+                    _file(customers, zips, document['_id'], document)
+            except Exception:
+                with self._lock:
+                    if self._generation == generation:
+                        self._pending = None
+                raise
+            with self._lock:
+                if self._generation != generation:
+                    return      # cleared meanwhile, what was read may be stale
+                pending, self._pending = self._pending, None
+                self._customers, self._zips = customers, zips
+                self.built = True
+                for document_id, document in pending:
+                    self.update(document_id, document)
+
+    def update(self, document_id, document=None):
+        """ Indexes a new or changed document; pass document=None for deletions """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((document_id, document))
+            if not self.built:
+                return      # everything is read when the index is built
+            zip_code = self._zips.pop(document_id, None)
+            if zip_code is not None:
+                customers = self._customers[zip_code]
+                customers.discard(document_id)
+                if not customers:
+                    del self._customers[zip_code]
+            if document is not None:
+                _file(self._customers, self._zips, document_id, document)
+
+    def nearby(self, zip_code, radius):
+        """
+        Returns the Customers within radius miles of a zip code, closest first
+
+        Returns:
+            list: (Customer id, miles) tuples, or None if the zip code is unknown
+        """
+        with self._lock:
+            self._load()
+            center = self._centroids.get(normalize_zip(zip_code))
+            if center is None:
+                return None
+            lat_span = radius / MILES_PER_DEGREE
+            lon_span = radius / (MILES_PER_DEGREE * max(0.01, math.cos(math.radians(center[0]))))
+            first_row, first_column = self._cell(center[0] - lat_span, center[1] - lon_span)
+            last_row, last_column = self._cell(center[0] + lat_span, center[1] + lon_span)
+            close = []
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    for candidate in self._grid.get((row, column), ()):
+                        if candidate not in self._customers:
+                            continue
+                        miles = haversine_miles(center, self._centroids[candidate])
+                        if miles <= radius:
+                            close.append((miles, candidate))
+            close.sort()
+            return [(customer_id, round(miles, 2)) for miles, candidate in close
+                    for customer_id in sorted(self._customers[candidate])]
+
+    def stats(self):
+        """ Returns counters describing the index """
+        return {
+            'enabled': self.enabled,
+            'built': self.built,
+            'zip_codes': len(self._centroids or ()),
+            'customers': len(self._zips),
+            'unlocated': sum(len(customers) for zip_code, customers in self._customers.items()
+                             if self._centroids is not None and zip_code not in self._centroids)
+        }
@@ -0,0 +1,146 @@
+"""
+Hedged Reads
+
+Most reads of a Customer are quick but a few take much longer than the
+rest, and those few set the tail latency. A hedged read sends the request
+and, if it hasn't been answered within the time most reads of its kind
+take (a percentile of the recent ones), sends the same request again and
+returns whichever answer comes first. Only idempotent reads are hedged,
+and the number of duplicate requests is capped to a share of all reads so
+that hedging can't double the load on a database that is slow for everyone.
+"""
+import time
+import threading
+from collections import deque
+
+MAX_SAMPLES = 1000      # latencies kept per kind of read
+MIN_SAMPLES = 20        # latencies needed before reads of a kind are hedged
+
+
+class _Race(object):
+    """ The attempts of one hedged read """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.winner = None
+        self.result = None
+        self.errors = []
+
+    def finish(self, name, result, error):
+        """ Records the outcome of an attempt; the first success wins """
+        with self.lock:
+            self.pending -= 1
+            if error is not None:
+                self.errors.append(error)
+            elif self.winner is None:
+                self.winner = name
+                self.result = result
+                self.event.set()
+            if self.pending == 0:
+                self.event.set()
+
+
+class Hedger(object):
+    """ Sends a second request for reads that take longer than usual """
+
+    def __init__(self, enabled=False, percentile=0.95, min_delay=0.005, max_ratio=0.05):
+        """
+        Args:
+            enabled (bool): reads are only hedged when enabled
+            percentile (float): the share of recent reads of a kind that
+                complete before the read is hedged
+            min_delay (float): seconds to wait at least before hedging
+            max_ratio (float): largest share of reads that may be hedged
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.calls = 0      # reads made
+        self.hedged = 0     # duplicate requests sent
+        self.won = 0        # reads answered by the duplicate request
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def call(self, kind, function, *args, **kwargs):
+        """
+        Returns function(*args, **kwargs), calling it a second time if it is slow
+
+        Args:
+            kind (str): reads of the same kind share their latencies
+            function (callable): an idempotent read
+
+        Raises the error of the read when every attempt failed
+        """
+        if not self.enabled:
+            return function(*args, **kwargs)
+        with self._lock:
+            self.calls += 1
+        race = _Race()
+        self._start(race, 'first', kind, function, args, kwargs)
+        delay = self.delay(kind)
+        if delay is not None and not race.event.wait(delay) and self._allow_hedge():
+            self._start(race, 'hedge', kind, function, args, kwargs)
+        race.event.wait()
+        if race.winner is None:
+            raise race.errors[0]
+        if race.winner == 'hedge':
+            with self._lock:
+                self.won += 1
+        return race.result
+
+    def delay(self, kind):
+        """ Returns the seconds after which reads of a kind are hedged, None if they aren't """
+        with self._lock:
+            latencies = sorted(self._samples.get(kind, ()))
+        if len(latencies) < MIN_SAMPLES:
+            return None
+        return max(self.min_delay, latencies[int((len(latencies) - 1) * self.percentile)])
+
+    def _allow_hedge(self):
+        """ Counts a duplicate request unless too many reads were hedged already """
+        with self._lock:
+            if self.hedged + 1 > self.max_ratio * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def _start(self, race, name, kind, function, args, kwargs):
+        """ Starts an attempt of a read in a thread of its own """
+        with race.lock:
+            race.pending += 1
+        thread = threading.Thread(target=self._attempt,
+                                  args=(race, name, kind, function, args, kwargs),
+                                  name='hedged-read')
+        thread.daemon = True
+        thread.start()
+
+    def _attempt(self, race, name, kind, function, args, kwargs):
+        """ Makes one attempt of a read and records how long the first ones take """
+        start = time.time()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:      # pylint: disable=broad-except
+            race.finish(name, None, error)
+            return
+        if name == 'first':
+            with self._lock:
+                self._samples.setdefault(kind, deque(maxlen=MAX_SAMPLES)) \
+                    .append(time.time() - start)
+        race.finish(name, result, None)
+
+    def stats(self):
+        """ Returns the reads made, hedged and won by the hedge and the current delays """
+        delays = {}
+        for kind in list(self._samples):
+            delay = self.delay(kind)
+            delays[kind] = round(delay * 1000, 1) if delay is not None else None
+        return {
+            'enabled': self.enabled,
+            'calls': self.calls,
+            'hedged': self.hedged,
+            'won': self.won,
+            'delay_ms': delays
+        }
@@ -0,0 +1,249 @@
+"""
+Write-behind Job Queue
+
+Writes that don't need a synchronous answer are stored in a local SQLite
+database and acknowledged right away. A background thread in every worker
+process claims queued jobs in batches and applies them, recording the
+outcome so clients can look it up later. Because the queue lives on disk,
+jobs survive a restart, and jobs left running by a process that died are
+handed out again once their lease expires. Finished jobs are kept for a
+retention period and then purged.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# seconds between purges of the finished jobs past their retention
+PURGE_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    action TEXT NOT NULL,
+    customer_id TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created);
+"""
+
+
+class QueueFullError(Exception):
+    """ Used when there are too many jobs waiting to be applied """
+    pass
+
+
+class JobQueue(object):
+    """ A durable queue of customer writes backed by SQLite """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, max_pending=10000, batch_size=100, poll_interval=0.5, lease=300,
+                 retention=86400):
+        """
+        Args:
+            path (str): the SQLite database file, the queue is disabled without one
+            max_pending (int): queued jobs beyond which new jobs are refused
+            batch_size (int): largest number of jobs applied at once
+            poll_interval (float): seconds to wait when there is nothing to do
+            lease (float): seconds after which a running job is handed out again
+            retention (float): seconds a finished job can still be looked up
+        """
+        self.path = path
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._pid = None
+        self._schema_ready = False
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        """ The queue is only used when it has a file to live in """
+        return bool(self.path)
+
+    def _connect(self):
+        """ Opens a connection; each call gets its own so threads don't share one """
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            connection.executescript(SCHEMA)
+            self._schema_ready = True
+        return connection
+
+    def enqueue(self, action, payload, customer_id=None):
+        """
+        Stores a write to be applied later and returns the job
+
+        Raises QueueFullError when max_pending jobs are already waiting
+        """
+        now = time.time()
+        job = {
+            'id': uuid.uuid4().hex,
+            'action': action,
+            'customer_id': customer_id,
+            'status': QUEUED,
+            'error': None,
+            'created': now,
+            'updated': now
+        }
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            pending = connection.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)',
+                                         (QUEUED, RUNNING)).fetchone()[0]
+            if pending >= self.max_pending:
+                connection.execute('ROLLBACK')
+                raise QueueFullError('{} jobs are already waiting'.format(pending))
+            connection.execute('INSERT INTO jobs (id, action, customer_id, payload, status, '
+                               'created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (job['id'], action, customer_id, json.dumps(payload),
+                                QUEUED, now, now))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id):
+        """ Returns a job without its payload, or None if there is no such job """
+        connection = self._connect()
+        try:
+            row = connection.execute('SELECT id, action, customer_id, status, error, created, '
+                                     'updated FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            connection.close()
+        return dict(zip(row.keys(), row)) if row else None
+
+    def claim(self):
+        """ Marks the oldest queued jobs as running and returns them with their payload """
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('UPDATE jobs SET status = ?, updated = ? '
+                               'WHERE status = ? AND updated < ?',
+                               (QUEUED, now, RUNNING, now - self.lease))
+            rows = connection.execute('SELECT id, action, customer_id, payload FROM jobs '
+                                      'WHERE status = ? ORDER BY created LIMIT ?',
+                                      (QUEUED, self.batch_size)).fetchall()
+            connection.executemany('UPDATE jobs SET status = ?, updated = ? WHERE id = ?',
+                                   [(RUNNING, now, row['id']) for row in rows])
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        return [{'id': row['id'], 'action': row['action'], 'customer_id': row['customer_id'],
+                 'payload': json.loads(row['payload'])} for row in rows]
+
+    def finish(self, outcomes):
+        """
+        Records the outcome of jobs
+
+        Args:
+            outcomes (list): (job id, customer id, error) tuples, error is None on success
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('UPDATE jobs SET status = ?, customer_id = ?, error = ?, '
+                                   'updated = ? WHERE id = ?',
+                                   [(FAILED if error else DONE, customer_id, error, now, job_id)
+                                    for job_id, customer_id, error in outcomes])
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def purge(self):
+        """ Deletes the jobs that finished longer than the retention period ago """
+        connection = self._connect()
+        try:
+            deleted = connection.execute('DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?',
+                                         (DONE, FAILED, time.time() - self.retention)).rowcount
+        finally:
+            connection.close()
+        return deleted
+
+    def start(self, apply_jobs):
+        """
+        Starts the background thread that applies jobs, again in a forked child
+
+        Args:
+            apply_jobs (callable): applies a list of claimed jobs and returns
+                their outcomes as accepted by finish()
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped = threading.Event()
+            thread = threading.Thread(target=self._run, args=(apply_jobs, self._stopped),
+                                      name='job-worker')
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """ Stops the background thread after the batch it is applying """
+        with self._lock:
+            self._pid = None
+            self._stopped.set()
+            self._wakeup.set()
+
+    def _run(self, apply_jobs, stopped):
+        """ Applies batches of jobs until there are none left, then waits for more """
+        purged = 0
+        while not stopped.is_set():
+            try:
+                jobs = self.claim()
+                if jobs:
+                    self.finish(self._apply(apply_jobs, jobs))
+                    continue
+                if time.time() - purged >= PURGE_INTERVAL:
+                    purged = time.time()
+                    self.purge()
+            except Exception:   # keep going, the jobs are handed out again later
+                self.logger.exception('Applying jobs failed')
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _apply(self, apply_jobs, jobs):
+        """
+        Returns the outcomes of a batch, failing all of its jobs if it crashes
+
+        Part of a batch that crashed may have been written, so rather than
+        being handed out again when the lease expires its jobs are failed.
+        """
+        try:
+            return apply_jobs(jobs)
+        except Exception as error:  # pylint: disable=broad-except
+            self.logger.exception('Applying a batch of %d jobs failed', len(jobs))
+            message = 'Applying the job failed: {}'.format(error)
+            return [(job['id'], job['customer_id'], message) for job in jobs]
+
+    def stats(self):
+        """ Returns the number of jobs in every status """
+        if not self.enabled:
+            return {}
+        connection = self._connect()
+        try:
+            rows = connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        finally:
+            connection.close()
+        return dict((row[0], row[1]) for row in rows)
@@ -0,0 +1,188 @@
+"""
+Queued Logging
+
+Log records are put on a bounded in-memory queue by the thread that logs
+them and written out by a background thread, so a request never waits for
+stderr or a log file. When the writer falls behind and the queue is full,
+records are dropped and counted instead of blocking requests. Records can
+be written as one JSON object per line, and the high-volume levels (INFO
+and below) can be sampled. Configure it with:
+
+  LOG_QUEUE_SIZE    records waiting to be written, 0 writes them inline (10000)
+  LOG_FORMAT        "json" for JSON lines, "text" keeps gunicorn's format (text)
+  LOG_SAMPLE_INFO   share of INFO records kept, e.g. 0.1 (1)
+  LOG_SAMPLE_DEBUG  share of DEBUG records kept (1)
+"""
+import os
+import copy
+import json
+import time
+import logging
+import threading
+
+try:
+    from queue import Queue, Full     # Python 3
+except ImportError:
+    from Queue import Queue, Full     # Python 2
+
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+LOG_SAMPLE_INFO = float(os.environ.get('LOG_SAMPLE_INFO', '1'))
+LOG_SAMPLE_DEBUG = float(os.environ.get('LOG_SAMPLE_DEBUG', '1'))
+
+_STOP = object()    # tells the writer thread to finish
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats a record as a single line JSON object """
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) +
+                    '.{:03d}Z'.format(int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class SamplingFilter(logging.Filter):
+    """ Keeps a share of the records of the levels it samples, every record of the others """
+
+    def __init__(self, shares):
+        """
+        Args:
+            shares (dict): the share of records kept by level, e.g. {logging.INFO: 0.1}
+        """
+        logging.Filter.__init__(self)
+        self.shares = dict((level, share) for level, share in shares.items() if share < 1)
+        self._counts = dict((level, 0) for level in self.shares)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        share = self.shares.get(record.levelno)
+        if share is None:
+            return True
+        with self._lock:
+            count = self._counts[record.levelno] = self._counts[record.levelno] + 1
+        # keeps the records that take the kept count up to the next whole number
+        return int(count * share) != int((count - 1) * share)
+
+
+class QueuedHandler(logging.Handler):
+    """ Hands records to other handlers from a background thread """
+
+    def __init__(self, handlers, size=LOG_QUEUE_SIZE):
+        """
+        Args:
+            handlers (list): the handlers that write the records out
+            size (int): records waiting to be written beyond which they are dropped
+        """
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.size = size
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def emit(self, record):
+        """ Queues a record, dropping it when the queue is full """
+        try:
+            self._ensure_started().put_nowait(self._prepare(record))
+        except Full:
+            self.dropped += 1
+        except Exception:   # pylint: disable=broad-except
+            self.handleError(record)
+
+    @staticmethod
+    def _prepare(record):
+        """ Returns a copy of a record with its arguments merged into the message """
+        record = copy.copy(record)      # other handlers may still use the original
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def _ensure_started(self):
+        """ Starts the writer thread, again in a forked child process """
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = Queue(self.size)
+                self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                                name='log-writer')
+                self._thread.daemon = True
+                self._thread.start()
+            return self._queue
+
+    def _run(self, queue):
+        """ Writes queued records until told to stop """
+        while True:
+            record = queue.get()
+            if record is _STOP:
+                return
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def waiting(self):
+        """ Returns the number of records not written yet """
+        queue = self._queue
+        return queue.qsize() if queue is not None and self._pid == os.getpid() else 0
+
+    def close(self):
+        """ Writes the records still queued and stops the writer thread """
+        with self._start_lock:
+            running = self._pid == os.getpid() and self._thread is not None
+            if running:
+                self._pid = None
+        if running:
+            try:
+                self._queue.put(_STOP, timeout=1)
+            except Full:
+                pass
+            self._thread.join(5)
+        logging.Handler.close(self)
+
+
+def queued_handlers(handlers):
+    """
+    Returns the handlers for the app's logger to use instead of handlers
+
+    With LOG_QUEUE_SIZE they are wrapped in a single QueuedHandler, and
+    with LOG_FORMAT=json they format their records as JSON.
+    """
+    if LOG_FORMAT == 'json':
+        for handler in handlers:
+            handler.setFormatter(JsonFormatter())
+    if not handlers or LOG_QUEUE_SIZE <= 0:
+        return list(handlers)
+    return [QueuedHandler(handlers)]
+
+
+def sampling_filter():
+    """ Returns the filter sampling the levels configured, None when every record is kept """
+    sampler = SamplingFilter({logging.INFO: LOG_SAMPLE_INFO, logging.DEBUG: LOG_SAMPLE_DEBUG})
+    return sampler if sampler.shares else None
+
+
+def stats(logger):
+    """ Returns the records a logger's queues hold and have dropped """
+    queued = [handler for handler in logger.handlers if isinstance(handler, QueuedHandler)]
+    return {
+        'queued': bool(queued),
+        'format': LOG_FORMAT,
+        'waiting': sum(handler.waiting() for handler in queued),
+        'dropped': sum(handler.dropped for handler in queued)
+    }
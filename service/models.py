@@ -29,24 +29,149 @@ Docker Note:
     You can also use Docker volumes like this: -v couchdb_data:/opt/couchdb/data
 """
 import os
+import re
 import json
 import logging
+import threading
 from retry import retry
 from cloudant.client import Cloudant
 from cloudant.query import Query
+from cloudant.design_document import DesignDocument
+from cloudant.document import Document
 from requests import HTTPError, ConnectionError
+from .caching import SingleFlight, NegativeCache, QueryCache, ResponseCache
+from .changes import ChangeFollower
+from .batching import WriteCoalescer
+from .jobs import JobQueue
+from .search import SearchIndex
+from .geo import ZipIndex
+from .ratelimit import RateLimiter
+from .shedding import LoadShedder
+from .hedging import Hedger
+from .text import TEXT_TYPE
 
 # get configruation from enviuronment (12-factor)
 ADMIN_PARTY = os.environ.get('ADMIN_PARTY', 'False').lower() == 'true'
 CLOUDANT_HOST = os.environ.get('CLOUDANT_HOST', 'localhost')
 CLOUDANT_USERNAME = os.environ.get('CLOUDANT_USERNAME', 'admin')
 CLOUDANT_PASSWORD = os.environ.get('CLOUDANT_PASSWORD', 'pass')
+# largest number of ids that can be fetched in a single multi-get
+MAX_LOOKUP_IDS = int(os.environ.get('MAX_LOOKUP_IDS', '200'))
+# number of documents read and written per request by bulk operations
+BULK_PAGE_SIZE = int(os.environ.get('BULK_PAGE_SIZE', '500'))
+# seconds to remember that a customer id was not found (0 disables it)
+NEGATIVE_CACHE_TTL = float(os.environ.get('NEGATIVE_CACHE_TTL', '5'))
+# seconds a cached query result may be served for (0 disables the query cache)
+QUERY_CACHE_MAX_AGE = float(os.environ.get('QUERY_CACHE_MAX_AGE', '0'))
+# memory bound of the cached query results in bytes of JSON
+QUERY_CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+# seconds an encoded customer may be served for (0 disables the response cache)
+RESPONSE_CACHE_MAX_AGE = float(os.environ.get('RESPONSE_CACHE_MAX_AGE', '0'))
+# memory bound of the encoded customers in bytes
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+# also keep a gzip compressed copy of every encoded customer
+RESPONSE_CACHE_GZIP = os.environ.get('RESPONSE_CACHE_GZIP', 'False').lower() == 'true'
+# milliseconds to gather concurrent writes into one _bulk_docs request (0 disables it)
+WRITE_BATCH_WINDOW_MS = float(os.environ.get('WRITE_BATCH_WINDOW_MS', '0'))
+# largest number of concurrent writes sent in one _bulk_docs request
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', '100'))
+# SQLite file of the write-behind job queue (asynchronous writes are off without one)
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', '')
+# queued jobs beyond which asynchronous writes are refused
+JOB_QUEUE_MAX_PENDING = int(os.environ.get('JOB_QUEUE_MAX_PENDING', '10000'))
+# seconds a finished job can still be looked up before it is purged
+JOB_RETENTION = float(os.environ.get('JOB_RETENTION', '86400'))
+# keep an in-memory search index of the Customers in every worker
+SEARCH_INDEX = os.environ.get('SEARCH_INDEX', 'False').lower() == 'true'
+# keep an in-memory index of the Customers by zip code for proximity searches
+NEARBY_INDEX = os.environ.get('NEARBY_INDEX', 'False').lower() == 'true'
+# table of zip code centroids used by proximity searches (a bundled seed set if empty)
+ZIP_CENTROIDS_PATH = os.environ.get('ZIP_CENTROIDS_PATH', '')
+# refuse to save a Customer with the email of another Customer (ignoring case)
+UNIQUE_EMAILS = os.environ.get('UNIQUE_EMAILS', 'False').lower() == 'true'
+# SQLite file of the rate limit buckets shared by the workers (rate limits are off without one)
+RATE_LIMIT_PATH = os.environ.get('RATE_LIMIT_PATH', '')
+# requests per second, and at once, admitted for the whole service (0 for no limit)
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', '0'))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', '0'))
+# requests per second, and at once, admitted for a single client (0 for no limit)
+RATE_LIMIT_CLIENT_RATE = float(os.environ.get('RATE_LIMIT_CLIENT_RATE', '0'))
+RATE_LIMIT_CLIENT_BURST = float(os.environ.get('RATE_LIMIT_CLIENT_BURST', '0'))
+# proxies in front of the service that append to X-Forwarded-For (0 to ignore the header)
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', '1'))
+# requests a full scan of the database counts as, a lookup counts as one
+RATE_LIMIT_SCAN_COST = float(os.environ.get('RATE_LIMIT_SCAN_COST', '10'))
+# milliseconds of database latency (90th percentile) above which requests reading or
+# writing every Customer are refused with 503 (0 to never refuse them for latency)
+SHED_LATENCY_MS = float(os.environ.get('SHED_LATENCY_MS', '0'))
+# seconds of database requests the latency is measured over
+SHED_WINDOW_SECONDS = float(os.environ.get('SHED_WINDOW_SECONDS', '10'))
+# requests in flight in a worker from which requests reading or writing every
+# Customer are refused (0 for no limit)
+SHED_LOW_PRIORITY_IN_FLIGHT = int(os.environ.get('SHED_LOW_PRIORITY_IN_FLIGHT', '0'))
+# requests in flight in a worker from which every request is refused (0 for no limit)
+SHED_MAX_IN_FLIGHT = int(os.environ.get('SHED_MAX_IN_FLIGHT', '0'))
+# send a second request for reads by id that take longer than most do
+HEDGE_READS = os.environ.get('HEDGE_READS', 'False').lower() == 'true'
+# percentile of the recent reads after which a read is hedged
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '95'))
+# milliseconds to wait at least before hedging a read
+HEDGE_MIN_DELAY_MS = float(os.environ.get('HEDGE_MIN_DELAY_MS', '5'))
+# largest share of reads that may be hedged
+HEDGE_MAX_RATIO = float(os.environ.get('HEDGE_MAX_RATIO', '0.05'))
+
+CUSTOMER_FIELDS = ('firstname', 'lastname', 'email', 'subscribed')
+ADDRESS_FIELDS = ('address1', 'address2', 'city', 'province', 'country', 'zip')
+
+# design document with the views the Customer finders use
+DESIGN_DOC_ID = '_design/customers'
+EMAIL_VIEW = 'by_email'
+EMAIL_VIEW_MAP = ('function (doc) {\n'
+                  '  if (typeof doc.email === "string") {\n'
+                  '    emit(doc.email.toLowerCase(), null);\n'
+                  '  }\n'
+                  '}')
+
+# the sequence tokens CouchDB and Cloudant hand out, e.g. "now", "42" or "42-g1AAAA..."
+SEQUENCE_PATTERN = re.compile(r'^(now|[0-9]+(-[A-Za-z0-9_=-]+)?)$')
+
 
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
     pass
 
 
+class DuplicateEmailError(DataValidationError):
+    """ Used when another Customer already has the email being saved """
+    pass
+
+
+def same_email(first, second):
+    """ Returns True if two emails are the same, ignoring case """
+    return (first or '').lower() == (second or '').lower()
+
+
+def _bad_sequence(response):
+    """
+    True when CouchDB refused a well-formed since token it can't decode
+
+    Depending on the version it answers 400, or 500 with the reason "badarg".
+    """
+    if response.status_code == 400:
+        return True
+    if response.status_code != 500:
+        return False
+    try:
+        return response.json().get('reason') == 'badarg'
+    except ValueError:
+        return False
+
+
+def valid_sequence(token):
+    """ True for a _changes sequence: "now", a number, or a number and an opaque part """
+    return SEQUENCE_PATTERN.match(str(token)) is not None
+
+
 class Customer(object):
     """
     Class that represents a Customer
@@ -54,6 +179,24 @@ class Customer(object):
     logger = logging.getLogger(__name__)
     client = None   # cloudant.client.Cloudant
     database = None # cloudant.database.CloudantDatabase
+    lookups = SingleFlight()
+    missing_ids = NegativeCache(NEGATIVE_CACHE_TTL)
+    query_cache = QueryCache(QUERY_CACHE_MAX_BYTES, QUERY_CACHE_MAX_AGE)
+    response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_AGE,
+                                   RESPONSE_CACHE_GZIP)
+    follower = None # service.changes.ChangeFollower
+    writer = WriteCoalescer(lambda documents: Customer.database.bulk_docs(documents),
+                            WRITE_BATCH_WINDOW_MS / 1000.0, WRITE_BATCH_SIZE)
+    jobs = JobQueue(JOB_QUEUE_PATH, JOB_QUEUE_MAX_PENDING, BULK_PAGE_SIZE,
+                    retention=JOB_RETENTION)
+    search_index = SearchIndex(SEARCH_INDEX)
+    zip_index = ZipIndex(NEARBY_INDEX, ZIP_CENTROIDS_PATH)
+    rate_limiter = RateLimiter(RATE_LIMIT_PATH, RATE_LIMIT_RATE, RATE_LIMIT_BURST,
+                               RATE_LIMIT_CLIENT_RATE, RATE_LIMIT_CLIENT_BURST)
+    shedder = LoadShedder(SHED_LATENCY_MS / 1000.0, SHED_LOW_PRIORITY_IN_FLIGHT,
+                          SHED_MAX_IN_FLIGHT, SHED_WINDOW_SECONDS)
+    hedger = Hedger(HEDGE_READS, HEDGE_PERCENTILE / 100.0, HEDGE_MIN_DELAY_MS / 1000.0,
+                    HEDGE_MAX_RATIO)
 
     def __init__(self, firstname=None, lastname=None, email=None, address1=None, address2=None, city=None, province=None, country=None, zip=None, subscribed=True):
         """ Constructor """
@@ -76,6 +219,17 @@ class Customer(object):
         """
         if self.firstname is None:
             raise DataValidationError('firstName attribute is not set')
+        if UNIQUE_EMAILS:
+            self._check_email()
+        if Customer.writer.enabled:
+            try:
+                result = Customer.writer.save(self.serialize())
+            except HTTPError as err:
+                Customer.logger.warning('Create failed: %s', err)
+                return
+            self.id = result['id']
+            Customer._written(self.id, self.serialize())
+            return
         try:
             document = self.database.create_document(self.serialize())
         except HTTPError as err:
@@ -84,6 +238,7 @@ class Customer(object):
 
         if document.exists():
             self.id = document['_id']
+            Customer._written(self.id, document)
 
     @retry(HTTPError, delay=1, backoff=2, tries=5)
     def update(self):
@@ -95,8 +250,14 @@ class Customer(object):
         except KeyError:
             document = None
         if document:
+            if UNIQUE_EMAILS and not same_email(document.get('email'), self.email):
+                self._check_email()
             document.update(self.serialize())
-            document.save()
+            if Customer.writer.enabled:
+                document['_rev'] = Customer.writer.save(dict(document))['rev']
+            else:
+                document.save()
+            Customer._written(self.id, document)
 
     @retry(HTTPError, delay=1, backoff=2, tries=5)
     def save(self):
@@ -119,6 +280,16 @@ class Customer(object):
             document = None
         if document:
             document.delete()
+            Customer._written(self.id)
+
+    def _check_email(self):
+        """ Raises DuplicateEmailError if another Customer has this email """
+        if not self.email:
+            return
+        owners = Customer.email_owners([self.email]).get(self.email.lower(), [])
+        if any(owner != self.id for owner in owners):
+            raise DuplicateEmailError('A customer with email {} already exists'
+                                      .format(self.email))
 
     def serialize(self):
         """ Serializes a Customer into a dictionary """
@@ -175,24 +346,247 @@ class Customer(object):
     def connect(cls):
         """ Connect to the server """
         cls.client.connect()
+        cls._observe_latency()
+
+    @classmethod
+    def _observe_latency(cls):
+        """ Has the load shedder measure every request of the client's session """
+        def observe(response, *args, **kwargs):
+            # the changes feed stays open on purpose, it says nothing about the load
+            if '/_changes' not in response.url:
+                cls.shedder.observe(response.elapsed.total_seconds())
+        cls.client.r_session.hooks['response'].append(observe)
 
     @classmethod
     def disconnect(cls):
         """ Disconnect from the server """
         cls.client.disconnect()
 
+    @classmethod
+    def _forget_document(cls, customer_id):
+        """ Drops the copy of a document the cloudant client keeps once it has read it """
+        if cls.database is not None:
+            dict.pop(cls.database, customer_id, None)
+
+    @classmethod
+    def _written(cls, customer_id, document=None):
+        """ Drops cached data made stale by a write (document is None for deletes) """
+        cls._forget_document(customer_id)
+        cls.missing_ids.discard(customer_id)
+        cls.query_cache.invalidate(customer_id, document)
+        cls.response_cache.invalidate(customer_id)
+        cls._update_indexes(customer_id, document)
+
+    @classmethod
+    def _on_change(cls, change):
+        """ Drops cached data made stale by a change made by another worker """
+        if change['id'].startswith('_design/'):
+            return
+        document = None if change.get('deleted') else change.get('doc')
+        cls._forget_document(change['id'])
+        cls.missing_ids.discard(change['id'])
+        cls.query_cache.invalidate(change['id'], document)
+        revs = change.get('changes') or [{}]
+        cls.response_cache.invalidate(change['id'], revs[0].get('rev'))
+        cls._update_indexes(change['id'], document)
+
+    @classmethod
+    def _update_indexes(cls, customer_id, document):
+        """
+        Keeps the in-memory indexes current with a write
+
+        The write has already succeeded, so an index that fails to take it
+        is cleared to be built again instead of failing the request.
+        """
+        for index in (cls.search_index, cls.zip_index):
+            try:
+                index.update(customer_id, document)
+            except Exception:   # pylint: disable=broad-except
+                cls.logger.exception('Indexing Customer %s failed, rebuilding the index',
+                                     customer_id)
+                index.clear()
+
+    @classmethod
+    def follow_changes(cls):
+        """ Starts following the _changes feed to keep the caches current """
+        if cls.follower is None:
+            cls.follower = ChangeFollower(cls.database)
+            cls.follower.subscribe(cls._on_change)
+        cls.follower.start()
+
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def changes_since(cls, since=0, limit=BULK_PAGE_SIZE):
+        """
+        Returns one page of the _changes feed including the documents
+
+        Returns:
+            dict: the "results", the "last_seq" to continue from and whether
+            there are "more" changes after this page
+
+        Raises DataValidationError, without retrying, when since is not a
+        sequence of this database
+        """
+        if not valid_sequence(since):
+            raise DataValidationError('Invalid since token: {}'.format(since))
+        url = '/'.join((cls.database.database_url, '_changes'))
+        response = cls.database.r_session.get(url, params={'since': since, 'limit': limit,
+                                                           'include_docs': 'true'})
+        if _bad_sequence(response):
+            raise DataValidationError('Invalid since token: {}'.format(since))
+        response.raise_for_status()
+        page = response.json()
+        if 'pending' in page:
+            page['more'] = bool(page['results']) and page['pending'] > 0
+        else:
+            page['more'] = len(page['results']) >= limit
+        return page
+
+    @staticmethod
+    def change_event(change):
+        """
+        Describes a change of the _changes feed as a Customer event
+
+        Returns None for changes to documents that aren't Customers
+        """
+        if change['id'].startswith('_design/'):
+            return None
+        rev = (change.get('changes') or [{}])[0].get('rev', '')
+        event = {'seq': change['seq'], 'id': change['id'], 'rev': rev}
+        if change.get('deleted'):
+            event['type'] = 'deleted'
+            event['customer'] = None
+            return event
+        document = change.get('doc') or {}
+        if 'firstname' not in document:
+            return None
+        try:
+            event['customer'] = Customer().deserialize(document).serialize()
+        except DataValidationError:
+            return None
+        event['type'] = 'created' if rev.startswith('1-') else 'updated'
+        return event
+
+    @classmethod
+    def delta(cls, since=0, limit=BULK_PAGE_SIZE):
+        """
+        Returns the Customers created, updated or deleted after a sequence
+
+        Returns:
+            dict: the serialized "customers" that were created or updated,
+            the ids of the "deleted" ones, the "since" token to pass next time
+            and whether there are "more" changes after this page
+        """
+        page = cls.changes_since(since, limit)
+        customers = []
+        deleted = []
+        for change in page['results']:
+            event = cls.change_event(change)
+            if event is None:
+                continue
+            if event['type'] == 'deleted':
+                deleted.append(event['id'])
+            else:
+                customers.append(event['customer'])
+        return {
+            'customers': customers,
+            'deleted': deleted,
+            'since': page['last_seq'],
+            'more': page['more']
+        }
+
+    @classmethod
+    def stats(cls):
+        """ Returns counters describing how the lookup caches are doing """
+        return {
+            'lookups': {
+                'backend_calls': cls.lookups.calls,
+                'coalesced': cls.lookups.shared,
+                'negative_hits': cls.missing_ids.hits,
+                'saved_calls': cls.lookups.shared + cls.missing_ids.hits
+            },
+            'query_cache': cls.query_cache.stats(),
+            'response_cache': cls.response_cache.stats(),
+            'write_batching': cls.writer.stats(),
+            'jobs': cls.jobs.stats(),
+            'search': cls.search_index.stats(),
+            'nearby': cls.zip_index.stats(),
+            'rate_limit': cls.rate_limiter.stats(),
+            'shedding': cls.shedder.stats(),
+            'hedging': cls.hedger.stats(),
+            'changes': cls.follower.stats() if cls.follower else {'running': False}
+        }
+
     @classmethod
     @retry(HTTPError, delay=1, backoff=2, tries=5)
     def create_query_index(cls, field_name, order='asc'):
         """ Creates a new query index for searching """
         cls.database.create_query_index(index_name=field_name, fields=[{field_name: order}])
 
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def create_views(cls):
+        """ Creates or updates the design document with the finder views """
+        design = DesignDocument(cls.database, DESIGN_DOC_ID)
+        if design.exists():
+            design.fetch()
+            view = design.get_view(EMAIL_VIEW)
+            if view is not None and view.get('map') == EMAIL_VIEW_MAP:
+                return
+            if view is not None:
+                design.update_view(EMAIL_VIEW, EMAIL_VIEW_MAP)
+            else:
+                design.add_view(EMAIL_VIEW, EMAIL_VIEW_MAP)
+        else:
+            design.add_view(EMAIL_VIEW, EMAIL_VIEW_MAP)
+        design.save()
+
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def drop_db(cls):
+        """ Deletes the whole database, faster than removing every document (use for testing) """
+        if cls.follower is not None:
+            cls.follower.stop()
+            cls.follower = None
+        cls.client.delete_database(cls.database.database_name)
+        cls.database = None
+        cls.missing_ids.clear()
+        cls.query_cache.clear()
+        cls.response_cache.clear()
+        cls.search_index.clear()
+        cls.zip_index.clear()
+
     @classmethod
     @retry(HTTPError, delay=1, backoff=2, tries=5)
     def remove_all(cls):
-        """ Removes all documents from the database (use for testing)  """
-        for document in cls.database:
-            document.delete()
+        """
+        Removes all documents from the database (use for testing)
+
+        Deletes a page of documents at a time with a _bulk_docs request
+        instead of one DELETE per document.
+
+        Returns:
+            int: the number of documents removed
+        """
+        removed = 0
+        kwargs = {'limit': BULK_PAGE_SIZE}
+        while True:
+            rows = cls._all_docs(**kwargs)
+            deletions = [{'_id': row['id'], '_rev': row['value']['rev'], '_deleted': True}
+                         for row in rows if not row['id'].startswith('_design/')]
+            results = cls._bulk_save(deletions) if deletions else []
+            deleted = set(result['id'] for result in results if 'error' not in result)
+            removed += len(deleted)
+            if len(rows) < BULK_PAGE_SIZE:
+                break
+            # the next page starts after the last row, which is gone if it was deleted
+            kwargs['startkey'] = rows[-1]['id']
+            kwargs['skip'] = 0 if rows[-1]['id'] in deleted else 1
+        cls.query_cache.clear()
+        cls.response_cache.clear()
+        cls.search_index.clear()
+        cls.zip_index.clear()
+        return removed
 
     @classmethod
     @retry(HTTPError, delay=1, backoff=2, tries=5)
@@ -200,39 +594,520 @@ class Customer(object):
         """ Query that returns all Customers """
         results = []
         for doc in cls.database:
+            if doc['_id'].startswith('_design/'):
+                continue
             customer = Customer().deserialize(doc)
             customer.id = doc['_id']
             results.append(customer)
         return results
 
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def page(cls, start=0, limit=BULK_PAGE_SIZE):
+        """
+        Returns limit Customers in id order, skipping the first start ones
+
+        The page is read with a query, which leaves the design documents out
+        so that start counts Customers only.
+        """
+        query = Query(cls.database, selector={'_id': {'$gt': None}})
+        result = query(skip=start, limit=limit, sort=[{'_id': 'asc'}])
+        return [Customer().deserialize(document) for document in result.get('docs', [])]
+
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def count(cls):
+        """ Returns the number of Customers """
+        total = cls.database.all_docs(limit=0).get('total_rows', 0)
+        designs = cls._all_docs(startkey='_design/', endkey='_design0')
+        return total - len(designs)
+
 ######################################################################
-#  F I N D E R   M E T H O D S
+#  B U L K   M E T H O D S
 ######################################################################
 
+    @classmethod
+    def update_many(cls, changes, customer_ids=None, selector=None):
+        """
+        Applies the same changes to many Customers
+
+        The matching documents are read a page at a time and written back
+        with one _bulk_docs request per page, so memory use and the number
+        of round trips stay small no matter how many Customers match.
+
+        Args:
+            changes (dict): the fields to change, e.g. {"subscribed": False}
+            customer_ids (list): the ids of the Customers to change
+            selector (dict): a query selector matching the Customers to change
+
+        Returns:
+            dict: counts of matched, updated, unchanged, conflicted and failed documents
+        """
+        cls._validate_changes(changes)
+        if (customer_ids is None) == (selector is None):
+            raise DataValidationError('Either a list of ids or a selector is required')
+        if customer_ids is not None and not isinstance(customer_ids, list):
+            raise DataValidationError('Invalid ids: expected a list')
+        if selector is not None and (not isinstance(selector, dict) or not selector):
+            raise DataValidationError('Invalid selector: expected a non-empty dictionary')
+        if customer_ids is not None:
+            pages = cls._pages_by_ids(customer_ids)
+        else:
+            pages = cls._pages_by_selector(selector)
+
+        # the ids of the Customers with the new email, only one of them may keep it
+        owners = None
+        if UNIQUE_EMAILS and changes.get('email'):
+            owners = set(cls.email_owners([changes['email']]).get(changes['email'].lower(), []))
+
+        counts = {'matched': 0, 'updated': 0, 'unchanged': 0, 'conflicts': 0, 'failed': 0}
+        for page in pages:
+            documents = []
+            for document in page:
+                if document.get('_id', '').startswith('_design/') or 'firstname' not in document:
+                    continue
+                counts['matched'] += 1
+                if owners is not None and not same_email(document.get('email'), changes['email']):
+                    if owners - set([document['_id']]):
+                        Customer.logger.warning('Bulk update: %s would duplicate email %s',
+                                                document['_id'], changes['email'])
+                        counts['failed'] += 1
+                        continue
+                    owners.add(document['_id'])
+                if cls._apply_changes(document, changes):
+                    documents.append(document)
+                else:
+                    counts['unchanged'] += 1
+            if not documents:
+                continue
+            for result in cls._bulk_save(documents):
+                if 'error' not in result:
+                    counts['updated'] += 1
+                elif result['error'] == 'conflict':
+                    counts['conflicts'] += 1
+                else:
+                    counts['failed'] += 1
+        Customer.logger.info('Bulk update: %s', counts)
+        return counts
+
+    @classmethod
+    def save_many(cls, customers):
+        """
+        Saves many Customers with a single _bulk_docs request
+
+        Customers with an id are updated and the others are created and
+        given the id of their new document.
+
+        Returns:
+            list: None for every Customer that was saved, or the error why not
+        """
+        revs = {}
+        updates = [customer.id for customer in customers if customer.id]
+        if updates:
+            for row in cls._all_docs(keys=updates):
+                if 'value' in row and not row['value'].get('deleted'):
+                    revs[row['id']] = row['value']['rev']
+
+        owners = {}
+        if UNIQUE_EMAILS:
+            owners = cls.email_owners([customer.email for customer in customers
+                                       if customer.email])
+
+        errors = [None] * len(customers)
+        documents = []
+        positions = []
+        for position, customer in enumerate(customers):
+            if customer.firstname is None:
+                errors[position] = 'firstName attribute is not set'
+                continue
+            if customer.email and UNIQUE_EMAILS:
+                taken = owners.setdefault(customer.email.lower(), [])
+                if any(owner != customer.id for owner in taken):
+                    errors[position] = 'A customer with email {} already exists' \
+                                       .format(customer.email)
+                    continue
+                # new Customers are told apart by position to catch duplicates within the batch
+                taken.append(customer.id or position)
+            document = customer.serialize()
+            if customer.id:
+                if customer.id not in revs:
+                    errors[position] = "Customer with id '{}' was not found.".format(customer.id)
+                    continue
+                document['_rev'] = revs[customer.id]
+            documents.append(document)
+            positions.append(position)
+
+        if documents:
+            for position, result in zip(positions, cls._bulk_save(documents)):
+                if 'error' in result:
+                    errors[position] = '{}: {}'.format(result['error'], result.get('reason'))
+                else:
+                    customers[position].id = result['id']
+        return errors
+
+    @classmethod
+    def insert_many(cls, documents):
+        """
+        Creates many Customer documents with a single _bulk_docs request
+
+        Every document must carry its own _id. A document whose _id is
+        already used is not written and gets the error "conflict", so
+        inserting the same documents again changes nothing.
+
+        Returns:
+            list: None for every document that was written, or the error why not
+        """
+        errors = [None] * len(documents)
+        if UNIQUE_EMAILS:
+            owners = cls.email_owners([document['email'] for document in documents
+                                       if document.get('email')])
+            for position, document in enumerate(documents):
+                if not document.get('email'):
+                    continue
+                taken = owners.setdefault(document['email'].lower(), [])
+                if any(owner != document['_id'] for owner in taken):
+                    errors[position] = 'A customer with email {} already exists' \
+                                       .format(document['email'])
+                taken.append(document['_id'])
+        positions = [position for position, error in enumerate(errors) if error is None]
+        if positions:
+            results = cls._bulk_save([documents[position] for position in positions])
+            for position, result in zip(positions, results):
+                if 'error' in result:
+                    errors[position] = result['error'] if result['error'] == 'conflict' else \
+                        '{}: {}'.format(result['error'], result.get('reason'))
+        return errors
+
+    @classmethod
+    def enqueue(cls, action, data, customer_id=None):
+        """
+        Validates a write and queues it to be applied in the background
+
+        Args:
+            action (str): "create" or "update"
+            data (dict): the Customer as it would be posted
+            customer_id (str): the id of the Customer to update
+
+        Returns:
+            dict: the queued job
+
+        Raises DataValidationError for invalid data and QueueFullError
+        when too many jobs are waiting
+        """
+        customer = Customer().deserialize(data)
+        if customer.firstname is None:
+            raise DataValidationError('firstName attribute is not set')
+        cls.jobs.start(cls.apply_jobs)
+        return cls.jobs.enqueue(action, customer.serialize(), customer_id)
+
+    @classmethod
+    def apply_jobs(cls, jobs):
+        """
+        Applies a batch of queued writes and returns their outcomes
+
+        Updates of the same Customer are saved in the order they were queued,
+        each in its own _bulk_docs request, so that they don't share a _rev.
+        """
+        rounds = []
+        seen = {}
+        for position, job in enumerate(jobs):
+            customer = Customer().deserialize(job['payload'])
+            customer.id = job['customer_id'] if job['action'] == 'update' else None
+            turn = 0
+            if customer.id:
+                turn = seen[customer.id] = seen.get(customer.id, -1) + 1
+            if turn == len(rounds):
+                rounds.append([])
+            rounds[turn].append((position, customer))
+
+        outcomes = [None] * len(jobs)
+        for batch in rounds:
+            customers = [customer for _, customer in batch]
+            for (position, customer), error in zip(batch, cls.save_many(customers)):
+                outcomes[position] = (jobs[position]['id'], customer.id, error)
+        return outcomes
+
+    @staticmethod
+    def _validate_changes(changes):
+        """ Makes sure only known Customer fields are being changed, to values of their type """
+        if not isinstance(changes, dict) or not changes:
+            raise DataValidationError('Invalid changes: expected a dictionary of fields')
+        for key, value in changes.items():
+            if key == 'address':
+                if not isinstance(value, dict):
+                    raise DataValidationError('Invalid changes: address must be a dictionary')
+                unknown = [field for field in value if field not in ADDRESS_FIELDS]
+                fields = value.items()
+            else:
+                unknown = [key] if key not in CUSTOMER_FIELDS else []
+                fields = [(key, value)]
+            if unknown:
+                raise DataValidationError('Invalid changes: unknown field ' + unknown[0])
+            for field, field_value in fields:
+                if field == 'subscribed':
+                    if not isinstance(field_value, bool):
+                        raise DataValidationError('Invalid changes: subscribed must be true or false')
+                elif field_value is not None and not isinstance(field_value, (str, TEXT_TYPE)):
+                    raise DataValidationError('Invalid changes: {} must be a string'.format(field))
+        if 'firstname' in changes and changes['firstname'] is None:
+            raise DataValidationError('firstName attribute is not set')
+
+    @staticmethod
+    def _apply_changes(document, changes):
+        """ Applies changes to a document and returns True if anything changed """
+        changed = False
+        for key, value in changes.items():
+            if key == 'address':
+                address = document.setdefault('address', {})
+                for field, field_value in value.items():
+                    if address.get(field) != field_value:
+                        address[field] = field_value
+                        changed = True
+            elif document.get(key) != value:
+                document[key] = value
+                changed = True
+        return changed
+
+    @classmethod
+    def iter_documents(cls, page_size=BULK_PAGE_SIZE):
+        """
+        Generates every Customer document a page at a time
+
+        Pages are read with _all_docs in id order starting after the last id
+        of the previous page, so memory use doesn't grow with the database.
+        """
+        kwargs = {'include_docs': True, 'limit': page_size}
+        while True:
+            rows = cls._all_docs(**kwargs)
+            for row in rows:
+                if row.get('doc') and not row['id'].startswith('_design/'):
+                    yield row['doc']
+            if len(rows) < page_size:
+                break
+            kwargs['startkey'] = rows[-1]['id']
+            kwargs['skip'] = 1
+
+    @classmethod
+    def _pages_by_ids(cls, customer_ids):
+        """ Generates pages of documents for a list of ids """
+        for start in range(0, len(customer_ids), BULK_PAGE_SIZE):
+            keys = customer_ids[start:start + BULK_PAGE_SIZE]
+            yield [row['doc'] for row in cls._all_docs(keys=keys, include_docs=True)
+                   if row.get('doc')]
+
+    @classmethod
+    def _pages_by_selector(cls, selector):
+        """ Generates pages of documents matching a selector using bookmarks """
+        query = Query(cls.database, selector=selector)
+        bookmark = None
+        while True:
+            result = cls._query_page(query, bookmark)
+            documents = result.get('docs', [])
+            if documents:
+                yield documents
+            bookmark = result.get('bookmark')
+            if len(documents) < BULK_PAGE_SIZE or not bookmark:
+                break
+
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def _all_docs(cls, **kwargs):
+        """ Returns the rows of an _all_docs request """
+        return cls.database.all_docs(**kwargs).get('rows', [])
+
+    @staticmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def _query_page(query, bookmark=None):
+        """ Returns one page of query results """
+        if bookmark:
+            return query(limit=BULK_PAGE_SIZE, bookmark=bookmark)
+        return query(limit=BULK_PAGE_SIZE)
+
     @classmethod
     @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def _bulk_save(cls, documents):
+        """ Writes a batch of documents with a single _bulk_docs request """
+        results = cls.database.bulk_docs(documents)
+        for document, result in zip(documents, results):
+            if 'error' not in result:
+                cls._written(result['id'], None if document.get('_deleted') else document)
+        return results
+
+######################################################################
+#  F I N D E R   M E T H O D S
+######################################################################
+
+    @classmethod
     def find_by(cls, **kwargs):
         """ Find records using selector """
-        query = Query(cls.database, selector=kwargs)
-        results = []
-        for doc in query.result:
-            customer = Customer()
-            customer.deserialize(doc)
-            results.append(customer)
-        return results
+        key = json.dumps(kwargs, sort_keys=True)
+        documents = cls.query_cache.get(key)
+        if documents is None:
+            generation = cls.query_cache.generation
+            documents = cls.lookups.do(('find_by', key), cls._query_documents, kwargs)
+            cls.query_cache.put(key, kwargs, documents, generation)
+        return [Customer().deserialize(document) for document in documents]
 
     @classmethod
     @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def _query_documents(cls, selector):
+        """ Returns the documents matching a selector """
+        query = Query(cls.database, selector=selector)
+        return list(query.result)
+
+    @classmethod
     def find(cls, customer_id):
         """ Query that finds Customers by their ID """
-        try:
-            document = cls.database[customer_id]
-            if 'firstname' in document:
-                return Customer().deserialize(document)
-            else :
+        if customer_id in cls.missing_ids:
+            return None
+        document = cls.lookups.do(('find', customer_id), cls._fetch_document, customer_id)
+        if document is None:
+            cls.missing_ids.add(customer_id)
+            return None
+        return Customer().deserialize(document)
+
+    @classmethod
+    def find_encoded(cls, customer_id):
+        """
+        Query that finds a Customer by its ID already encoded as JSON
+
+        Returns an EncodedDocument with the "customer" and "address" parts
+        of the Customer, or None if there is no such Customer. Documents are
+        served from the response cache when it holds them.
+        """
+        encoded = cls.response_cache.get(customer_id)
+        if encoded is not None:
+            return encoded
+        if customer_id in cls.missing_ids:
+            return None
+        generation = cls.response_cache.generation
+        document = cls.lookups.do(('find', customer_id), cls._fetch_document, customer_id)
+        if document is None:
+            cls.missing_ids.add(customer_id)
+            return None
+        data = Customer().deserialize(document).serialize()
+        return cls.response_cache.put(customer_id, document.get('_rev'),
+                                      {'customer': data, 'address': data['address']},
+                                      generation)
+
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def _fetch_document(cls, customer_id):
+        """ Returns the document of a Customer or None if there isn't one """
+        if cls.hedger.enabled:
+            document = cls.hedger.call('find', cls._read_document, customer_id)
+        else:
+            try:
+                document = cls.database[customer_id]
+            except KeyError:
                 return None
-        except KeyError:
+        if document is None or 'firstname' not in document:
             return None
+        return document
+
+    @classmethod
+    def _read_document(cls, customer_id):
+        """
+        Reads a document with a single GET, or returns None if there is no such document
+
+        Unlike database[customer_id] it neither checks that the document
+        exists first nor goes through the client's local copies, so two
+        attempts of a hedged read don't share anything.
+        """
+        document = Document(cls.database, customer_id)
+        try:
+            document.fetch()
+        except HTTPError as error:
+            if error.response is not None and error.response.status_code == 404:
+                return None
+            raise
+        return document
+
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def find_many(cls, customer_ids):
+        """
+        Query that finds many Customers by their IDs in one round trip
+
+        Uses _all_docs with a list of keys so that the whole batch costs a
+        single request instead of one GET per Customer.
+
+        Args:
+            customer_ids (list): the ids of the Customers to fetch
+
+        Returns:
+            tuple: the list of Customers found and the list of ids that were not
+        """
+        if len(customer_ids) > MAX_LOOKUP_IDS:
+            raise DataValidationError('Too many ids: a lookup is limited to {}'
+                                      .format(MAX_LOOKUP_IDS))
+        customers = []
+        missing = [customer_id for customer_id in customer_ids
+                   if customer_id in cls.missing_ids]
+        keys = [customer_id for customer_id in customer_ids if customer_id not in missing]
+        if not keys:
+            return customers, missing
+        response = cls.hedger.call('find_many', cls.database.all_docs, keys=keys,
+                                   include_docs=True)
+        for row in response.get('rows', []):
+            document = row.get('doc')
+            if document and 'firstname' in document:
+                customers.append(Customer().deserialize(document))
+            else:
+                cls.missing_ids.add(row['key'])
+                missing.append(row['key'])
+        return customers, missing
+
+    @classmethod
+    def search(cls, query, limit=20):
+        """
+        Returns the Customers best matching a partial name, email or city
+
+        The search index is built from the database on first use.
+
+        Returns:
+            list: (Customer, score) tuples with the best match first
+        """
+        cls.search_index.build(cls.iter_documents())
+        matches = cls.search_index.search(query, limit)
+        customers, _ = cls.find_many([customer_id for customer_id, _ in matches])
+        by_id = dict((customer.id, customer) for customer in customers)
+        return [(by_id[customer_id], score) for customer_id, score in matches
+                if customer_id in by_id]
+
+    @classmethod
+    def nearby(cls, zip_code, radius, start=0, limit=MAX_LOOKUP_IDS):
+        """
+        Returns the Customers living within radius miles of a zip code
+
+        The zip code index is built from the database on first use.
+
+        Returns:
+            tuple: a page of (Customer, miles) tuples, closest first, and the
+            number of Customers within the radius
+
+        Raises DataValidationError when the zip code is not in the centroid table
+        """
+        cls.zip_index.build(cls.iter_documents())
+        matches = cls.zip_index.nearby(zip_code, radius)
+        if matches is None:
+            raise DataValidationError('Unknown zip code: {}'.format(zip_code))
+        page = matches[start:start + limit]
+        customers, _ = cls.find_many([customer_id for customer_id, _ in page])
+        by_id = dict((customer.id, customer) for customer in customers)
+        return [(by_id[customer_id], miles) for customer_id, miles in page
+                if customer_id in by_id], len(matches)
+
+    @classmethod
+    def index_customers(cls):
+        """ Builds the enabled in-memory indexes in a background thread """
+        def build():
+            for index in (cls.search_index, cls.zip_index):
+                if index.enabled:
+                    index.build(cls.iter_documents())
+        thread = threading.Thread(target=build, name='customer-indexes')
+        thread.daemon = True
+        thread.start()
 
     @classmethod
     def find_by_first_name(cls, firstname):
@@ -248,9 +1123,40 @@ class Customer(object):
 
     @classmethod
     def find_by_email(cls, email):
-        """ Returns all of the Customers with a email
+        """ Returns all of the Customers with an email, ignoring its case
         """
-        return cls.find_by(email=email)
+        if not email:
+            return []
+        key = email.lower()
+        documents = cls.lookups.do(('by_email', key), cls._email_documents, key)
+        return [Customer().deserialize(document) for document in documents]
+
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def _email_documents(cls, key):
+        """ Returns the documents indexed under a lower-cased email """
+        result = cls.database.get_view_result(DESIGN_DOC_ID, EMAIL_VIEW, raw_result=True,
+                                              key=key, include_docs=True, reduce=False)
+        return [row['doc'] for row in result['rows'] if row.get('doc')]
+
+    @classmethod
+    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def email_owners(cls, emails):
+        """
+        Returns the ids of the Customers using each of the given emails
+
+        Returns:
+            dict: lower-cased email to the list of ids of the Customers that have it
+        """
+        keys = sorted(set(email.lower() for email in emails))
+        owners = {}
+        for start in range(0, len(keys), MAX_LOOKUP_IDS):
+            result = cls.database.get_view_result(DESIGN_DOC_ID, EMAIL_VIEW, raw_result=True,
+                                                  keys=keys[start:start + MAX_LOOKUP_IDS],
+                                                  reduce=False)
+            for row in result['rows']:
+                owners.setdefault(row['key'], []).append(row['id'])
+        return owners
 
     @classmethod
     def find_by_subscribed(cls,flag):
@@ -276,12 +1182,6 @@ class Customer(object):
         }
         return cls.find_by(address=sel)
 
-    @classmethod
-    def find_by_email(cls, email):
-        """ Returns all of the Customers with a email
-        """
-        return cls.find_by(email=email)
-
     @classmethod
     def find_by_city(cls, city):
         """ Returns all of the Customers with a city
@@ -323,9 +1223,12 @@ class Customer(object):
 ############################################################
 
     @staticmethod
-    def init_db(dbname='customers'):
+    def credentials():
         """
-        Initialized Coundant database connection
+        Returns the username, password, host, port and url of the database
+
+        They are read from the Kubernetes binding in BINDING_CLOUDANT or
+        else from the CLOUDANT_* environment variables.
         """
         opts = {}
         vcap_services = {}
@@ -354,7 +1257,14 @@ class Customer(object):
                 opts['host'] = cloudant_service['credentials']['host']
                 opts['port'] = cloudant_service['credentials']['port']
                 opts['url'] = cloudant_service['credentials']['url']
+        return opts
 
+    @staticmethod
+    def init_db(dbname='customers'):
+        """
+        Initialized Coundant database connection
+        """
+        opts = Customer.credentials()
         if any(k not in opts for k in ('host', 'username', 'password', 'port', 'url')):
             Customer.logger.info('Error - Failed to retrieve options. ' \
                              'Check that app is bound to a Cloudant service.')
@@ -373,6 +1283,7 @@ class Customer(object):
                                  )
         except ConnectionError:
             raise AssertionError('Cloudant service could not be reached')
+        Customer._observe_latency()
 
         # Create database if it doesn't exist
         try:
@@ -383,3 +1294,12 @@ class Customer(object):
         # check for success
         if not Customer.database.exists():
             raise AssertionError('Database [{}] could not be obtained'.format(dbname))
+        Customer.create_views()
+        Customer.missing_ids.clear()
+        Customer.query_cache.clear()
+        Customer.response_cache.clear()
+        Customer.search_index.clear()
+        Customer.zip_index.clear()
+        if Customer.follower is not None:
+            Customer.follower.stop()
+            Customer.follower = None
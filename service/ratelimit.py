@@ -0,0 +1,168 @@
+"""
+Admission Control
+
+Token buckets that limit how many requests reach the database, one for
+the whole service and one per client. A request takes as many tokens as
+it costs, a full scan more than a lookup, and is refused with the number
+of seconds until enough tokens are back when either bucket runs short,
+before any database work is done. The buckets live in a local SQLite
+database so every gunicorn worker on the machine draws from the same ones.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+GLOBAL = 'global'       # the key of the bucket of the whole service
+CLIENT = 'client:'      # the prefix of the keys of the client buckets
+PRUNE_EVERY = 1000      # admissions between removals of idle client buckets
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+def forwarded_client(forwarded_for, remote_address, proxies):
+    """
+    Returns the address of the client that the trusted proxies saw
+
+    Every proxy appends the address it was reached from to X-Forwarded-For,
+    so only the last proxies entries can be trusted and the leftmost ones
+    are whatever the client sent. The connection's own address is used
+    when the header has fewer entries than there are proxies.
+
+    Args:
+        forwarded_for (str): the X-Forwarded-For header, '' if there is none
+        remote_address (str): the address the connection came from
+        proxies (int): the number of proxies in front of the service
+    """
+    entries = [entry.strip() for entry in (forwarded_for or '').split(',') if entry.strip()]
+    if proxies > 0 and len(entries) >= proxies:
+        return entries[-proxies]
+    return remote_address or ''
+
+
+class TokenBucket(object):
+    """ The refill rate and capacity of a bucket """
+
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate (float): tokens added per second
+            burst (float): tokens the bucket holds at most, at least rate
+        """
+        self.rate = rate
+        self.burst = max(burst, rate)
+
+    def wait(self, tokens, updated, cost, now):
+        """
+        Refills a bucket and returns its tokens and the seconds until cost can be taken
+
+        Args:
+            tokens (float): the tokens left at the time updated, None for a new bucket
+        """
+        if tokens is None:
+            tokens = self.burst
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        cost = min(cost, self.burst)    # else the request could never be admitted
+        if tokens >= cost:
+            return tokens, 0.0
+        return tokens, (cost - tokens) / self.rate
+
+
+class RateLimiter(object):
+    """ Global and per client token buckets shared by the processes of a machine """
+
+    def __init__(self, path, rate=0, burst=0, client_rate=0, client_burst=0):
+        """
+        Args:
+            path (str): the SQLite database file, the limiter is disabled without one
+            rate (float): requests per second of the whole service (0 for no limit)
+            burst (float): requests the whole service may make at once
+            client_rate (float): requests per second of a single client (0 for no limit)
+            client_burst (float): requests a single client may make at once
+        """
+        self.path = path
+        self.limit = TokenBucket(rate, burst) if rate else None
+        self.client_limit = TokenBucket(client_rate, client_burst) if client_rate else None
+        self.admitted = 0
+        self.limited = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """ The limiter is only used with a file for the buckets and a limit """
+        return bool(self.path and (self.limit or self.client_limit))
+
+    def _connect(self):
+        """ Returns the connection of this thread, a new one in a forked child """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def acquire(self, client, cost=1):
+        """
+        Takes cost tokens from the global bucket and the bucket of a client
+
+        Tokens are only taken when both buckets have enough of them.
+
+        Returns:
+            float: 0 when the request is admitted, else the seconds to wait
+        """
+        if not self.enabled:
+            return 0.0
+        now = time.time()
+        buckets = []
+        if self.limit:
+            buckets.append((GLOBAL, self.limit))
+        if self.client_limit:
+            buckets.append((CLIENT + client, self.client_limit))
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            wait = 0.0
+            for key, bucket in buckets:
+                row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?',
+                                         (key,)).fetchone()
+                tokens, seconds = bucket.wait(row[0] if row else None, row[1] if row else now,
+                                              cost, now)
+                levels.append((key, tokens - min(cost, bucket.burst)))
+                wait = max(wait, seconds)
+            if not wait:
+                connection.executemany('INSERT OR REPLACE INTO buckets (key, tokens, updated) '
+                                       'VALUES (?, ?, ?)',
+                                       [(key, tokens, now) for key, tokens in levels])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        with self._lock:
+            if wait:
+                self.limited += 1
+            else:
+                self.admitted += 1
+                if self.admitted % PRUNE_EVERY == 0:
+                    self._prune(connection, now)
+        return wait
+
+    def _prune(self, connection, now):
+        """ Removes the buckets of clients that have been idle long enough to be full """
+        limit = self.client_limit
+        if limit:
+            connection.execute('DELETE FROM buckets WHERE key LIKE ? AND updated < ?',
+                               (CLIENT + '%', now - limit.burst / limit.rate))
+
+    def stats(self):
+        """ Returns the requests this process admitted and refused """
+        return {'enabled': self.enabled, 'admitted': self.admitted, 'limited': self.limited}
@@ -8,3 +8,15 @@ from .home_page import HomePage
 from .unsubscribe_action import UnsubscribeAction
 from .reset_action import ResetAction
 from .address import Address
+from .lookup_action import LookupAction
+from .bulk_unsubscribe_action import BulkUnsubscribeAction
+from .metrics import Metrics
+from .job_resource import JobResource
+from .changes_stream import ChangesStream
+from .customer_search import CustomerSearch
+from .nearby_customers import NearbyCustomers
+from .customer_export import CustomerExport
+from .customer_summary import CustomerSummary
+from .customer_snapshot import CustomerSnapshot
+from .static_asset import StaticAsset
+from .admission import admit_request, track_request, finish_request
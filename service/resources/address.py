@@ -5,6 +5,7 @@ from flask import abort
 from flask_api import status
 from flask_restful import Resource
 from service.models import Customer
+from service.responses import encoded_response
 
 ######################################################################
 # Address
@@ -15,7 +16,7 @@ class Address(Resource):
         Retrieve a single Customer Address
         This endpoint will return a Customer based on it's id
         """
-        customer = Customer.find(customer_id)
-        if not customer:
+        encoded = Customer.find_encoded(customer_id)
+        if not encoded:
             abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
-        return customer.serialize()["address"], status.HTTP_200_OK
+        return encoded_response(encoded, 'address')
@@ -0,0 +1,105 @@
+"""
+This module contains the admission control run before every request
+"""
+import math
+from flask import g, request, current_app, jsonify
+from flask_api import status
+from service.models import Customer, RATE_LIMIT_SCAN_COST, TRUSTED_PROXIES
+from service.ratelimit import forwarded_client
+
+# parameters of GET /customers that make it a query or a page instead of a full scan
+COLLECTION_FILTERS = ('since', 'email', 'firstname', 'lastname', 'subscribed', 'address1',
+                      'address2', 'city', 'province', 'country', 'zip', 'limit')
+# requests that read or write every Customer
+SCANS = (('customerexport', 'GET'), ('customersummary', 'GET'), ('customersnapshot', 'GET'),
+         ('customersnapshot', 'PUT'), ('resetaction', 'DELETE'),
+         ('bulkunsubscribeaction', 'PUT'))
+# endpoints that don't use the database
+EXEMPT = ('homepage', 'static', 'metrics', 'jobresource')
+# seconds a client is asked to wait when the service sheds load
+SHED_RETRY_AFTER = '5'
+
+
+def is_scan(endpoint, method, args):
+    """ True for requests that read or write every Customer, the first to be shed """
+    if endpoint == 'customercollection' and method == 'GET':
+        return not any(args.get(name) is not None for name in COLLECTION_FILTERS)
+    return (endpoint, method) in SCANS
+
+
+def request_cost(endpoint, method, args):
+    """
+    Returns the tokens a request takes, 0 when it isn't limited
+
+    Args:
+        endpoint (str): the endpoint of the route, None when no route matched
+        method (str): the HTTP method
+        args (dict): the query parameters
+    """
+    if endpoint is None or endpoint in EXEMPT:
+        return 0
+    return RATE_LIMIT_SCAN_COST if is_scan(endpoint, method, args) else 1
+
+
+def client_address():
+    """ The address of the client, from X-Forwarded-For behind the router """
+    return forwarded_client(request.headers.get('X-Forwarded-For'), request.remote_addr,
+                            TRUSTED_PROXIES)
+
+
+def refusal(message, code, retry_after):
+    """ Returns the JSON response refusing a request, with when to retry it """
+    response = jsonify(message=message)
+    response.status_code = code
+    response.headers['Retry-After'] = retry_after
+    return response
+
+
+def admit_request():
+    """
+    Refuses the request before any database work when the service is overloaded
+
+    Answers 503 Service Unavailable when the load shedder refuses the
+    request, and 429 Too Many Requests when it is over the rate limits.
+    Retry-After tells the client when to try again.
+    """
+    if request.endpoint is None or request.endpoint in EXEMPT:
+        return None
+    scan = is_scan(request.endpoint, request.method, request.args)
+    if Customer.shedder.enabled:
+        reason = Customer.shedder.shed(scan)
+        if reason:
+            current_app.logger.info('Shed %s %s: %s', request.method, request.path, reason)
+            return refusal('The service is overloaded, try again later',
+                           status.HTTP_503_SERVICE_UNAVAILABLE, SHED_RETRY_AFTER)
+        Customer.shedder.begin()
+        g.in_flight = True
+    if not Customer.rate_limiter.enabled:
+        return None
+    client = client_address()
+    wait = Customer.rate_limiter.acquire(client, RATE_LIMIT_SCAN_COST if scan else 1)
+    if not wait:
+        return None
+    retry_after = str(int(math.ceil(wait)))
+    current_app.logger.warning('Rate limited %s %s from %s for %ss',
+                               request.method, request.path, client, retry_after)
+    return refusal('Too many requests, try again later', status.HTTP_429_TOO_MANY_REQUESTS,
+                   retry_after)
+
+
+def track_request(response):
+    """
+    Counts the end of a request admit_request counted as in flight
+
+    The request ends when the server closes its response, after streamed
+    bodies like exports and snapshots have been sent.
+    """
+    if g.pop('in_flight', False):
+        response.call_on_close(Customer.shedder.end)
+    return response
+
+
+def finish_request(error=None):    # pylint: disable=unused-argument
+    """ Counts the end of a request in flight that failed before it had a response """
+    if g.pop('in_flight', False):
+        Customer.shedder.end()
@@ -0,0 +1,32 @@
+"""
+This module contains routes without Resources
+"""
+from flask import request, current_app
+from flask_api import status
+from flask_restful import Resource
+from werkzeug.exceptions import BadRequest
+from service.models import Customer, DataValidationError
+
+######################################################################
+# BULK UNSUBSCRIBE
+######################################################################
+class BulkUnsubscribeAction(Resource):
+    """ Resource to Unsubscribe many Customers at once """
+    def put(self):
+        """
+        Unsubscribe many Customers
+
+        The body selects the Customers either with {"ids": [...]} or with
+        {"selector": {...}} and the counts of updated documents are returned
+        """
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            raise BadRequest('Request body must contain ids or a selector')
+        current_app.logger.info('Request to bulk unsubscribe Customers')
+        try:
+            counts = Customer.update_many({'subscribed': False},
+                                          customer_ids=payload.get('ids'),
+                                          selector=payload.get('selector'))
+        except DataValidationError as error:
+            raise BadRequest(str(error))
+        return counts, status.HTTP_200_OK
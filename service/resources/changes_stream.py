@@ -0,0 +1,88 @@
+"""
+This module contains the stream of Customer changes
+"""
+import os
+import json
+from flask import request, Response, current_app
+from flask_api import status
+from flask_restful import Resource
+from service.models import Customer, valid_sequence
+from service.changes import Subscription
+
+# seconds between keep-alive messages on an idle stream
+HEARTBEAT_SECONDS = 15
+# largest number of open streams per worker process
+CHANGES_MAX_SUBSCRIBERS = int(os.environ.get('CHANGES_MAX_SUBSCRIBERS', '100'))
+
+
+def server_sent_event(event):
+    """ Encodes an event in the text/event-stream format """
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event['seq'], event['type'],
+                                                      json.dumps(event))
+
+
+def json_line(event):
+    """ Encodes an event as one line of newline delimited JSON """
+    return json.dumps(event) + '\n'
+
+
+######################################################################
+# GET /customers/changes
+######################################################################
+class ChangesStream(Resource):
+    """
+    Streams Customer creates, updates and deletes as they happen
+
+    Every worker follows the _changes feed once and shares it between all
+    of its streams. Events are sent as Server-Sent Events, or as newline
+    delimited JSON with ?format=ndjson. Passing ?since=<seq> (or the
+    Last-Event-ID header) first replays the changes after that sequence,
+    so a client can resume where it left off; changes around the switch
+    from replay to live events may be sent twice.
+    """
+    def get(self):
+        """ Opens a stream of changes """
+        ndjson = request.args.get('format') == 'ndjson' or \
+            'application/x-ndjson' in request.headers.get('Accept', '')
+        since = request.args.get('since') or request.headers.get('Last-Event-ID')
+        if since and not valid_sequence(since):
+            return {'message': 'Invalid since token: {}'.format(since)}, \
+                status.HTTP_400_BAD_REQUEST
+        Customer.follow_changes()
+        follower = Customer.follower
+        subscription = Subscription()
+        if not follower.subscribe(subscription, CHANGES_MAX_SUBSCRIBERS):
+            return {'message': 'Too many open change streams, try again later'}, \
+                status.HTTP_503_SERVICE_UNAVAILABLE
+        current_app.logger.info('Request to stream changes since [%s]', since)
+        encode = json_line if ndjson else server_sent_event
+        heartbeat = '\n' if ndjson else ': keep-alive\n\n'
+
+        def stream():
+            """ Replays the changes after since and then sends live ones """
+            try:
+                position = since
+                while position:
+                    page = Customer.changes_since(position)
+                    for change in page['results']:
+                        event = Customer.change_event(change)
+                        if event:
+                            yield encode(event)
+                    position = page['last_seq'] if page['more'] else None
+                while not subscription.overflowed:
+                    change = subscription.get(HEARTBEAT_SECONDS)
+                    if change is None:
+                        yield heartbeat
+                        continue
+                    event = Customer.change_event(change)
+                    if event:
+                        yield encode(event)
+            finally:
+                follower.unsubscribe(subscription)
+
+        mimetype = 'application/x-ndjson' if ndjson else 'text/event-stream'
+        response = Response(stream(), mimetype=mimetype,
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # the server closes the response even when the stream was never read
+        response.call_on_close(lambda: follower.unsubscribe(subscription))
+        return response
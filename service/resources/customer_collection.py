@@ -1,21 +1,48 @@
 """
 This module contains the Customer Collection Resource
 """
-from flask import request, abort
+from flask import request, abort, current_app, url_for
 from flask_restful import Resource
 from flask_api import status    # HTTP Status Codes
 from werkzeug.exceptions import BadRequest
-from service import app, api
-from service.models import Customer, DataValidationError
-from . import CustomerResource
+from service.models import Customer, DataValidationError, DuplicateEmailError, BULK_PAGE_SIZE
+from .job_resource import prefers_async, queue_job
+
+def _number(name, default, lowest, highest=None):
+    """ Returns a whole number query parameter, raising BadRequest when it is out of range """
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise BadRequest('{} must be a number'.format(name))
+    if value < lowest or (highest is not None and value > highest):
+        if highest is None:
+            raise BadRequest('{} must be at least {}'.format(name, lowest))
+        raise BadRequest('{} must be between {} and {}'.format(name, lowest, highest))
+    return value
+
 
 class CustomerCollection(Resource):
     """ Handles all interactions with collections of Customers """
 
     def get(self):
-        """ Returns all of the Customers """
-        app.logger.info('Request to list Customers...')
+        """
+        Returns all of the Customers
+
+        With a "since" token only the Customers changed after it are returned
+        together with the ids of the deleted ones and the token to use next time.
+        With "start" or "limit" only "limit" Customers after the first "start"
+        ones are returned; X-Total-Count holds the number of Customers listed.
+        """
+        current_app.logger.info('Request to list Customers...')
+        since = request.args.get('since')
+        if since is not None:
+            return self._delta(since)
+        paged = 'start' in request.args or 'limit' in request.args
+        if paged:
+            start = _number('start', 0, 0)
+            limit = _number('limit', BULK_PAGE_SIZE, 1, BULK_PAGE_SIZE)
         customers = []
+        total = None
         email = request.args.get('email')
         firstname = request.args.get('firstname')
         lastname = request.args.get('lastname')
@@ -47,30 +74,49 @@ class CustomerCollection(Resource):
             customers = Customer.find_by_country(country)
         elif zip:
             customers = Customer.find_by_zip(zip)
+        elif paged:
+            customers = Customer.page(start, limit)
+            total = Customer.count()
         else:
             customers = Customer.all()
 
-        app.logger.info('[%s] Customers returned', len(customers))
+        if paged and total is None:     # the matches of a filter are paged here
+            total = len(customers)
+            customers = customers[start:start + limit]
+        current_app.logger.info('[%s] Customers returned', len(customers))
         results = [customer.serialize() for customer in customers]
+        if paged:
+            return results, status.HTTP_200_OK, {'X-Total-Count': str(total)}
         return results, status.HTTP_200_OK
 
+    @staticmethod
+    def _delta(since):
+        """ Returns one page of the Customers changed after a sequence token """
+        limit = _number('limit', BULK_PAGE_SIZE, 1, BULK_PAGE_SIZE)
+        try:
+            delta = Customer.delta(since or 0, limit)
+        except DataValidationError as error:
+            raise BadRequest(str(error))
+        current_app.logger.info('[%s] Customers changed and [%s] deleted since %s',
+                        len(delta['customers']), len(delta['deleted']), since)
+        return delta, status.HTTP_200_OK
+
     def post(self):
         """
         Creates a Customer
 
         This endpoint will create a Customer based the data in the body that is posted
-        or data that is sent via an html form post.
+        or data that is sent via an html form post. With a "Prefer: respond-async"
+        header the Customer is created in the background and 202 is returned.
         """
-        app.logger.info('Request to Create a Customer')
+        current_app.logger.info('Request to Create a Customer')
         content_type = request.headers.get('Content-Type')
         if not content_type:
             abort(status.HTTP_400_BAD_REQUEST, "No Content-Type set")
 
         data = {}
         if content_type == 'application/x-www-form-urlencoded':
-            app.logger.info('Processing FORM data')
-            app.logger.info(type(request.form))
-            app.logger.info(request.form)
+            current_app.logger.info('Processing FORM data')
             data = {
                 'firstname': request.form['firstname'],
                 'lastname': request.form['lastname'],
@@ -86,20 +132,47 @@ class CustomerCollection(Resource):
                 }
             }
         elif content_type == 'application/json':
-            app.logger.info('Processing JSON data')
+            current_app.logger.info('Processing JSON data')
             data = request.get_json()
 
         else:
             message = 'Unsupported Content-Type: {}'.format(content_type)
-            app.logger.info(message)
+            current_app.logger.info(message)
             abort(status.HTTP_400_BAD_REQUEST, message)
 
+        if prefers_async():
+            return queue_job('create', data)
+
         customer = Customer()
         try:
             customer.deserialize(data)
         except DataValidationError as error:
             raise BadRequest(str(error))
-        customer.save()
-        app.logger.info('Customer with new id [%s] saved!', customer.id)
-        location_url = api.url_for(CustomerResource, customer_id=customer.id, _external=True)
+        try:
+            customer.save()
+        except DuplicateEmailError as error:
+            abort(status.HTTP_409_CONFLICT, str(error))
+        current_app.logger.info('Customer with new id [%s] saved!', customer.id)
+        location_url = url_for('customerresource', customer_id=customer.id, _external=True)
         return customer.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+
+    def patch(self):
+        """
+        Updates many Customers
+
+        This endpoint applies the same "changes" to every Customer selected by
+        "ids" or "selector" in the body and returns the counts of updated documents
+        """
+        current_app.logger.info('Request to bulk update Customers')
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            raise BadRequest('Request body must contain changes and ids or a selector')
+        try:
+            counts = Customer.update_many(payload.get('changes'),
+                                          customer_ids=payload.get('ids'),
+                                          selector=payload.get('selector'))
+        except DuplicateEmailError as error:
+            abort(status.HTTP_409_CONFLICT, str(error))
+        except DataValidationError as error:
+            raise BadRequest(str(error))
+        return counts, status.HTTP_200_OK
@@ -0,0 +1,25 @@
+"""
+This module contains the Customer Export Resource
+"""
+from flask import Response, current_app
+from flask_restful import Resource
+from service.models import Customer
+from service.export import column_batches, csv_chunks
+
+######################################################################
+# GET /customers/export
+######################################################################
+class CustomerExport(Resource):
+    """
+    Streams every Customer as CSV
+
+    Customers are read from the database a page at a time and written out
+    as they are read, so the export doesn't have to fit in memory. Use
+    "python -m service.commands.export" for Parquet files.
+    """
+    def get(self):
+        """ Downloads all of the Customers as a CSV file """
+        current_app.logger.info('Request to export all customers')
+        chunks = csv_chunks(column_batches(Customer.iter_documents()))
+        return Response(chunks, mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=customers.csv'})
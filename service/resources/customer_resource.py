@@ -1,12 +1,13 @@
 """
 This module contains all of Resources for the Customer API
 """
-from flask import abort, request
+from flask import abort, request, current_app
 from flask_restful import Resource
 from flask_api import status    # HTTP Status Codes
 from werkzeug.exceptions import BadRequest
-from service import app, api
-from service.models import Customer, DataValidationError
+from service.models import Customer, DataValidationError, DuplicateEmailError
+from service.responses import encoded_response
+from .job_resource import prefers_async, queue_job
 
 ######################################################################
 #  PATH: /customers/{id}
@@ -27,19 +28,22 @@ class CustomerResource(Resource):
 
         This endpoint will return a Customer based on it's id
         """
-        app.logger.info("Request to Retrieve a customer with id [%s]", customer_id)
-        customer = Customer.find(customer_id)
-        if not customer:
+        current_app.logger.info("Request to Retrieve a customer with id [%s]", customer_id)
+        encoded = Customer.find_encoded(customer_id)
+        if not encoded:
             abort(status.HTTP_404_NOT_FOUND, "Customer WAS NOT FOUND ")
-        return customer.serialize(), status.HTTP_200_OK
+        return encoded_response(encoded, 'customer')
 
     def put(self, customer_id):
         """
         Update a Customer
 
-        This endpoint will update a Customer based the body that is posted
+        This endpoint will update a Customer based the body that is posted. With a
+        "Prefer: respond-async" header the update is applied in the background.
         """
-        app.logger.info('Request to Update a customer with id [%s]', customer_id)
+        current_app.logger.info('Request to Update a customer with id [%s]', customer_id)
+        if prefers_async():
+            return queue_job('update', request.get_json(), customer_id)
         #check_content_type('application/json')
         customer = Customer.find(customer_id)
         if not customer:
@@ -52,7 +56,10 @@ class CustomerResource(Resource):
             raise BadRequest(str(error))
 
         customer.id = customer_id
-        customer.save()
+        try:
+            customer.save()
+        except DuplicateEmailError as error:
+            abort(status.HTTP_409_CONFLICT, str(error))
         return customer.serialize(), status.HTTP_200_OK
 
     def delete(self, customer_id):
@@ -61,7 +68,7 @@ class CustomerResource(Resource):
 
         This endpoint will delete a Customer based the id specified in the path
         """
-        app.logger.info('Request to Delete a customer with id [%s]', customer_id)
+        current_app.logger.info('Request to Delete a customer with id [%s]', customer_id)
         customer = Customer.find(customer_id)
         if customer:
             customer.delete()
@@ -0,0 +1,40 @@
+"""
+This module contains the Customer Search Resource
+"""
+from flask import request, current_app
+from flask_api import status
+from flask_restful import Resource
+from werkzeug.exceptions import BadRequest
+from service.models import Customer, MAX_LOOKUP_IDS
+
+######################################################################
+# SEARCH
+######################################################################
+class CustomerSearch(Resource):
+    """ Resource to search Customers by partial names, email or city """
+    def get(self):
+        """
+        Search Customers
+
+        This endpoint returns the Customers best matching the "q" parameter,
+        best match first, each with its "_score". Misspelled names and the
+        beginning of a word are matched too.
+        """
+        if not Customer.search_index.enabled:
+            return {'message': 'Search is not enabled'}, status.HTTP_503_SERVICE_UNAVAILABLE
+        query = request.args.get('q', '').strip()
+        if not query:
+            raise BadRequest('Query parameter q is required')
+        try:
+            limit = int(request.args.get('limit', 20))
+        except ValueError:
+            raise BadRequest('limit must be a number')
+        if limit < 1 or limit > MAX_LOOKUP_IDS:
+            raise BadRequest('limit must be between 1 and {}'.format(MAX_LOOKUP_IDS))
+        current_app.logger.info('Request to search customers for [%s]', query)
+        results = []
+        for customer, score in Customer.search(query, limit):
+            result = customer.serialize()
+            result['_score'] = score
+            results.append(result)
+        return results, status.HTTP_200_OK
@@ -0,0 +1,50 @@
+"""
+This module contains the Customer Snapshot Resource
+"""
+import shutil
+import tempfile
+from flask import Response, request, abort, current_app
+from flask_api import status
+from flask_restful import Resource
+from service.models import Customer
+from service.snapshots import SnapshotError, snapshot_chunks, restore
+
+SPOOL_BYTES = 8 * 1024 * 1024     # uploads larger than this are spooled to disk
+
+######################################################################
+# GET, PUT /customers/snapshot
+######################################################################
+class CustomerSnapshot(Resource):
+    """
+    Handles snapshots of all of the Customers
+
+    GET /customers/snapshot - downloads every Customer as a snapshot
+    PUT /customers/snapshot - replaces every Customer with those of a snapshot
+
+    A snapshot is a gzip compressed file with a Customer document on every
+    line, see service/snapshots.py
+    """
+    def get(self):
+        """ Downloads all of the Customers as a snapshot """
+        current_app.logger.info('Request for a snapshot of all customers')
+        return Response(snapshot_chunks(Customer.iter_documents()), mimetype='application/gzip',
+                        headers={'Content-Disposition':
+                                 'attachment; filename=customers.ndjson.gz'})
+
+    def put(self):
+        """
+        Restores the Customers of a snapshot
+
+        Every Customer is removed first. Returns the number of customers
+        removed, imported and rejected.
+        """
+        current_app.logger.info('Request to restore a snapshot of the customers')
+        with tempfile.SpooledTemporaryFile(SPOOL_BYTES) as upload:
+            shutil.copyfileobj(request.stream, upload)
+            upload.seek(0)
+            try:
+                stats = restore(upload)
+            except SnapshotError as error:
+                abort(status.HTTP_400_BAD_REQUEST, str(error))
+        current_app.logger.info('Restored snapshot: %s', stats)
+        return stats, status.HTTP_200_OK
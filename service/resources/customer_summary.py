@@ -0,0 +1,28 @@
+"""
+This module contains the Customer Summary Resource
+"""
+from flask import current_app
+from flask_api import status
+from flask_restful import Resource
+from service.models import Customer
+from service.export import ColumnStats, column_batches
+
+######################################################################
+# GET /customers/summary
+######################################################################
+class CustomerSummary(Resource):
+    """ Resource for statistics about all of the Customers """
+    def get(self):
+        """
+        Summarize the Customers
+
+        This endpoint returns the number of Customers, how many of them are
+        subscribed and their subscription rate, and the number of Customers
+        in every country and province. Every Customer is read, a page at a
+        time.
+        """
+        current_app.logger.info('Request for a summary of all customers')
+        stats = ColumnStats()
+        for columns in column_batches(Customer.iter_documents()):
+            stats.add(columns)
+        return stats.summary(), status.HTTP_200_OK
@@ -1,19 +1,47 @@
 """
 This module contains routes without Resources
 """
-from flask import render_template, make_response
+import gzip
+import hashlib
+from io import BytesIO
+from flask import render_template, make_response, request, current_app
 from flask_restful import Resource
-from service import app
 
 ######################################################################
 # GET /
 ######################################################################
 class HomePage(Resource):
-    """ Resource fior the Home Page """
+    """
+    Resource fior the Home Page
+
+    The page is rendered once per app, unless it runs in debug mode, and
+    browsers check it again with its ETag on every visit.
+    """
     def get(self):
         """ Returns the index page """
-        headers = {'Content-Type': 'text/html'}
-        return make_response(render_template('index.html'),200,headers)
+        page = current_app.extensions.get('home_page')
+        if page is None:
+            page = self._render()
+            if not current_app.debug:
+                current_app.extensions['home_page'] = page
+        body, etag, compressed = page
+        headers = {'Content-Type': 'text/html', 'Cache-Control': 'no-cache'}
+        if request.accept_encodings['gzip']:
+            body = compressed
+            headers['Content-Encoding'] = 'gzip'
+        response = make_response(body, 200, headers)
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    @staticmethod
+    def _render():
+        """ Returns the page, its ETag and the page compressed with gzip """
+        body = render_template('index.html').encode('utf-8')
+        buffer = BytesIO()
+        with gzip.GzipFile(filename='', mode='wb', fileobj=buffer, mtime=0) as out:
+            out.write(body)
+        return body, hashlib.sha256(body).hexdigest()[:16], buffer.getvalue()
 
 # @app.route('/')
 # def index():
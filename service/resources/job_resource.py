@@ -0,0 +1,54 @@
+"""
+This module contains the Job Resource for asynchronous writes
+"""
+from flask import abort, request, current_app, url_for
+from flask_restful import Resource
+from flask_api import status    # HTTP Status Codes
+from werkzeug.exceptions import BadRequest
+from service.models import Customer, DataValidationError
+from service.jobs import QueueFullError
+
+# seconds a client is asked to wait when the job queue is full
+RETRY_AFTER = '5'
+
+
+def prefers_async():
+    """ True when the client asked for the write to be applied asynchronously """
+    return Customer.jobs.enabled and \
+        'respond-async' in request.headers.get('Prefer', '').lower()
+
+
+def queue_job(action, data, customer_id=None):
+    """
+    Queues a write and returns a 202 Accepted pointing at its job,
+    or a 503 asking the client to retry when the queue is full
+    """
+    try:
+        job = Customer.enqueue(action, data, customer_id)
+    except DataValidationError as error:
+        raise BadRequest(str(error))
+    except QueueFullError as error:
+        current_app.logger.warning('Job queue is full: %s', error)
+        return {'message': 'Too many pending writes, try again later'}, \
+            status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': RETRY_AFTER}
+    current_app.logger.info('Queued %s job [%s]', action, job['id'])
+    location_url = url_for('jobresource', job_id=job['id'], _external=True)
+    return job, status.HTTP_202_ACCEPTED, {'Location': location_url}
+
+
+######################################################################
+#  PATH: /jobs/{id}
+######################################################################
+class JobResource(Resource):
+    """
+    JobResource class
+
+    GET /jobs/{id} - Returns the status of an asynchronous write
+    """
+
+    def get(self, job_id):
+        """ Returns the status of a queued write """
+        job = Customer.jobs.get(job_id) if Customer.jobs.enabled else None
+        if not job:
+            abort(status.HTTP_404_NOT_FOUND, "Job with id '{}' was not found.".format(job_id))
+        return job, status.HTTP_200_OK
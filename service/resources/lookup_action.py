@@ -0,0 +1,42 @@
+"""
+This module contains routes without Resources
+"""
+from flask import request, current_app
+from flask_api import status
+from flask_restful import Resource
+from werkzeug.exceptions import BadRequest
+from service.models import Customer, DataValidationError
+
+try:
+    STRING_TYPES = basestring   # Python 2
+except NameError:
+    STRING_TYPES = str
+
+######################################################################
+# LOOKUP
+######################################################################
+class LookupAction(Resource):
+    """ Resource to fetch many Customers by id in one request """
+    def post(self):
+        """
+        Retrieve many Customers
+
+        This endpoint expects a body like {"ids": ["id1", "id2"]} and returns
+        the Customers that were found along with the ids that were not
+        """
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('ids'), list):
+            raise BadRequest('Request body must contain a list of ids')
+        customer_ids = payload['ids']
+        if not all(isinstance(customer_id, STRING_TYPES) for customer_id in customer_ids):
+            raise BadRequest('Customer ids must be strings')
+        current_app.logger.info('Request to lookup [%s] customers', len(customer_ids))
+        try:
+            customers, missing = Customer.find_many(customer_ids)
+        except DataValidationError as error:
+            raise BadRequest(str(error))
+        results = {
+            'customers': [customer.serialize() for customer in customers],
+            'missing': missing
+        }
+        return results, status.HTTP_200_OK
@@ -0,0 +1,19 @@
+"""
+This module contains routes without Resources
+"""
+from flask_api import status
+from flask import current_app
+from flask_restful import Resource
+from service import logs
+from service.models import Customer
+
+######################################################################
+# GET /metrics
+######################################################################
+class Metrics(Resource):
+    """ Resource for the counters of this worker process """
+    def get(self):
+        """ Returns the service counters """
+        counters = Customer.stats()
+        counters['logging'] = logs.stats(current_app.logger)
+        return counters, status.HTTP_200_OK
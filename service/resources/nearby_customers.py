@@ -0,0 +1,54 @@
+"""
+This module contains the Nearby Customers Resource
+"""
+import math
+from flask import request, current_app
+from flask_api import status
+from flask_restful import Resource
+from werkzeug.exceptions import BadRequest
+from service.models import Customer, DataValidationError, MAX_LOOKUP_IDS
+
+# largest radius in miles a proximity search may cover
+MAX_RADIUS = 500
+
+######################################################################
+# NEARBY
+######################################################################
+class NearbyCustomers(Resource):
+    """ Resource to find the Customers living close to a zip code """
+    def get(self):
+        """
+        Find Customers near a zip code
+
+        This endpoint returns the Customers within "radius" miles (25 by
+        default) of "zip", closest first, each with its "_distance" in miles.
+        Use "start" and "limit" to page; X-Total-Count holds the number of
+        Customers within the radius.
+        """
+        if not Customer.zip_index.enabled:
+            return {'message': 'Proximity search is not enabled'}, \
+                status.HTTP_503_SERVICE_UNAVAILABLE
+        zip_code = request.args.get('zip', '').strip()
+        if not zip_code:
+            raise BadRequest('Query parameter zip is required')
+        try:
+            radius = float(request.args.get('radius', 25))
+            start = int(request.args.get('start', 0))
+            limit = int(request.args.get('limit', 100))
+        except ValueError:
+            raise BadRequest('radius, start and limit must be numbers')
+        if math.isnan(radius) or math.isinf(radius) or radius <= 0 or radius > MAX_RADIUS:
+            raise BadRequest('radius must be more than 0 and at most {}'.format(MAX_RADIUS))
+        if start < 0 or limit < 1 or limit > MAX_LOOKUP_IDS:
+            raise BadRequest('limit must be between 1 and {}'.format(MAX_LOOKUP_IDS))
+        current_app.logger.info('Request for customers within %s miles of %s', radius, zip_code)
+        try:
+            matches, total = Customer.nearby(zip_code, radius, start, limit)
+        except DataValidationError as error:
+            raise BadRequest(str(error))
+        results = []
+        for customer, miles in matches:
+            result = customer.serialize()
+            result['_distance'] = miles
+            results.append(result)
+        return results, status.HTTP_200_OK, {'X-Total-Count': str(total)}
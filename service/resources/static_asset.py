@@ -0,0 +1,33 @@
+"""
+This module contains the Static Asset Resource
+"""
+import mimetypes
+from flask import request, current_app, send_file, send_from_directory
+from flask_restful import Resource
+from service.assets import MAX_AGE
+
+######################################################################
+# GET /static/<filename>
+######################################################################
+class StaticAsset(Resource):
+    """
+    Serves the stylesheets, scripts and images of the UI
+
+    Assets requested by their hashed name (see service/assets.py) are kept
+    by browsers for a year and sent precompressed when the client accepts
+    it. Any other file of the static folder is checked again on every use.
+    """
+    def get(self, filename):
+        """ Returns an asset """
+        assets = current_app.extensions['assets']
+        found = assets.find(filename, request.accept_encodings)
+        if found is None:
+            return send_from_directory(assets.static_dir, filename)
+        path, encoding = found
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0],
+                             conditional=True, cache_timeout=MAX_AGE)
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(MAX_AGE)
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
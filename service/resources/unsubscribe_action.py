@@ -4,7 +4,7 @@ This module contains routes without Resources
 from flask import abort
 from flask_api import status
 from flask_restful import Resource
-from service.models import Customer
+from service.models import Customer, DuplicateEmailError
 
 ######################################################################
 # UNSUBSCRIBE
@@ -17,5 +17,8 @@ class UnsubscribeAction(Resource):
         if not customer:
             abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
         customer.subscribed = False
-        customer.save()
+        try:
+            customer.save()
+        except DuplicateEmailError as error:
+            abort(status.HTTP_409_CONFLICT, str(error))
         return customer.serialize(), status.HTTP_200_OK
@@ -0,0 +1,26 @@
+"""
+Responses that are sent from already encoded bodies
+
+The resources that return a single Customer send the bytes kept by the
+response cache as they are, so a cache hit needs no JSON encoding.
+"""
+from flask import current_app, request
+
+
+def encoded_response(encoded, part):
+    """
+    Returns a 200 response (or 304 when the client has it) for one part
+    of an EncodedDocument, gzip compressed when it is available and accepted
+    """
+    gzipped = encoded.gzipped.get(part)
+    use_gzip = gzipped is not None and 'gzip' in request.accept_encodings
+    response = current_app.response_class(gzipped if use_gzip else encoded.bodies[part],
+                                          status=200, mimetype='application/json')
+    if gzipped is not None:
+        response.vary.add('Accept-Encoding')
+    if use_gzip:
+        response.content_encoding = 'gzip'
+    if encoded.rev:
+        response.set_etag(encoded.rev + ('-gzip' if use_gzip else ''))
+        response.make_conditional(request)
+    return response
@@ -0,0 +1,316 @@
+"""
+Customer Search Index
+
+An in-memory index over the names, email and city of every Customer for
+fuzzy and prefix search. It maps every word to the documents containing
+it. A query word is looked up as a whole word, as the beginning of longer
+words (in a sorted copy of the vocabulary) and as a misspelling of other
+words, found through the three letter sequences (trigrams) it shares with
+the words of the vocabulary or by sounding the same. The vocabulary is far
+smaller than the number of Customers, so fuzzy matching never looks at
+every document.
+
+To keep the memory small each document gets a number and the documents
+of a word are kept as an array of machine integers, or as a plain number
+for the many words (mostly from emails) that only one Customer has.
+Numbers only ever grow, so the arrays are sorted and can be probed with
+a binary search.
+A changed document is given a new number and its old one is left as a
+hole; once there are too many holes the arrays are compacted.
+
+The index is built without holding its lock, so searches and updates
+carry on meanwhile; updates made during the build are replayed on the
+new index before it replaces the old one.
+"""
+import heapq
+import math
+import zlib
+import threading
+from array import array
+from bisect import bisect_left, insort
+from .text import normalize_text, soundex, trigrams
+
+EXACT_WEIGHT = 1.0      # the query word is a whole word
+PREFIX_WEIGHT = 0.8     # the query word begins a longer word
+FUZZY_WEIGHT = 0.9      # times how alike a misspelled word is, from 0.5 to 1
+SOUND_WEIGHT = 0.6      # the query word sounds like the word (same Soundex code)
+
+# what build() moves from the index it fills over to the one in use
+INDEX_ATTRIBUTES = ('_ids', '_checksums', '_numbers', '_postings', '_vocabulary',
+                    '_grams', '_sounds', '_removed')
+
+
+def document_text(document):
+    """ Returns the normalized fields of a Customer document that are searched """
+    address = document.get('address') or {}
+    return '\t'.join(normalize_text(value) for value in (
+        document.get('firstname'), document.get('lastname'),
+        document.get('email'), address.get('city')))
+
+
+def _checksum(text):
+    """ Returns a number that changes when the searched text does """
+    return zlib.crc32(text.encode('utf-8')) & 0x7fffffff
+
+
+def _contains(postings, number):
+    """ True if a sorted array holds a number """
+    position = bisect_left(postings, number)
+    return position < len(postings) and postings[position] == number
+
+
+class SearchIndex(object):
+    """ Word index of Customers for fuzzy and prefix search """
+
+    def __init__(self, enabled=False, max_words=50, max_candidates=5000):
+        """
+        Args:
+            enabled (bool): whether the index is used at all
+            max_words (int): most words of the vocabulary a query word may match
+            max_candidates (int): most documents scored for a single search
+        """
+        self.enabled = enabled
+        self.max_words = max_words
+        self.max_candidates = max_candidates
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()     # one build at a time
+        self._generation = 0                    # bumped by clear() to drop builds under way
+        self._pending = None                    # updates made during a build
+        self.clear()
+
+    def clear(self):
+        """ Empties the index; it is built again on next use """
+        with self._lock:
+            self.built = False
+            self._generation += 1
+            self._pending = None
+            self._reset()
+
+    def _reset(self):
+        """ Starts empty postings; the lock must be held unless the index is private """
+        self._ids = []                  # document number -> id, None once removed
+        self._checksums = array('l')    # document number -> checksum of its text
+        self._numbers = {}              # id -> document number
+        self._postings = {}             # word -> sorted array of document numbers
+        self._vocabulary = []           # every word, sorted for prefix lookups
+        self._grams = {}                # trigram -> set of words containing it
+        self._sounds = {}               # Soundex code -> set of words
+        self._removed = 0
+
+    def build(self, documents):
+        """
+        Indexes every document unless the index is already built
+
+        The documents are indexed into a new index without holding the lock,
+        which then takes the place of this one.
+        """
+        with self._build_lock:
+            with self._lock:
+                if self.built:
+                    return
+                generation = self._generation
+                self._pending = []
+            try:
+                fresh = SearchIndex()
+                for document in documents:
+                    fresh._add(document['_id'], document_text(document), keep_sorted=False)
+                fresh._vocabulary.sort()
+            except Exception:
+                with self._lock:
+                    if self._generation == generation:
+                        self._pending = None
+                raise
+            with self._lock:
+                if self._generation != generation:
+                    return      # cleared meanwhile, what was read may be stale
+                pending, self._pending = self._pending, None
+                for name in INDEX_ATTRIBUTES:
+                    setattr(self, name, getattr(fresh, name))
+                self.built = True
+                for document_id, document in pending:
+                    self.update(document_id, document)
+
+    def update(self, document_id, document=None):
+        """ Indexes a new or changed document; pass document=None for deletions """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((document_id, document))
+            if not self.built:
+                return      # everything is read when the index is built
+            text = None if document is None else document_text(document)
+            number = self._numbers.get(document_id)
+            if number is not None:
+                if text is not None and self._checksums[number] == _checksum(text):
+                    return
+                self._remove(number)
+            if text is not None:
+                self._add(document_id, text)
+            self._maybe_compact()
+
+    def search(self, query, limit=20):
+        """
+        Returns up to limit (id, score) tuples of the best matches for a query
+
+        Every word of the query must match a word of the document, either
+        whole, misspelled, or, for the last word of the query, as its
+        beginning. The score is the average weight of those matches.
+        """
+        terms = normalize_text(query).split()
+        if not terms:
+            return []
+        with self._lock:
+            expansions = [self._expand(term, prefix=(position == len(terms) - 1))
+                          for position, term in enumerate(terms)]
+            if not all(expansions):
+                return []
+            # start from the query word matching the fewest documents
+            expansions.sort(key=lambda words: sum(self._count(word) for _, word in words))
+            scores = self._candidates(expansions[0])
+            for words in expansions[1:]:
+                scores = self._narrow(scores, words)
+            best = heapq.nlargest(limit, ((score, -number) for number, score in scores.items()))
+            return [(self._ids[-number], round(score / len(terms), 3)) for score, number in best]
+
+    def _expand(self, term, prefix):
+        """ Returns the (weight, word) matches of a query word, best first """
+        weights = {}
+        if len(term) >= 3 and term.isalpha():
+            for word in self._sounds.get(soundex(term), ()):
+                weights[word] = SOUND_WEIGHT
+            grams = trigrams(term)
+            sets = sorted((self._grams.get(gram, ()) for gram in grams), key=len)
+            # a word at least half alike shares this many trigrams, so it must
+            # be in one of the len - need + 1 smallest sets
+            need = int(math.ceil((len(grams) + 2) / 3.0))
+            rare = len(sets) - need + 1
+            shared = {}
+            for words in sets[:rare]:
+                for word in words:
+                    shared[word] = shared.get(word, 0) + 1
+            for word, count in shared.items():
+                count += sum(1 for words in sets[rare:] if word in words)
+                similarity = count / float(len(grams) + len(word) + 1 - count)
+                if similarity >= 0.5:
+                    weights[word] = max(weights.get(word, 0), FUZZY_WEIGHT * similarity)
+        if prefix:
+            position = bisect_left(self._vocabulary, term)
+            for word in self._vocabulary[position:position + self.max_words]:
+                if not word.startswith(term):
+                    break
+                weights[word] = max(weights.get(word, 0), PREFIX_WEIGHT)
+        if term in self._postings:
+            weights[term] = EXACT_WEIGHT
+        return heapq.nlargest(self.max_words, ((weight, word) for word, weight in weights.items()))
+
+    def _candidates(self, words):
+        """ Scores the documents of the best words until there are enough of them """
+        scores = {}
+        for weight, word in words:
+            for number in self._documents(word):
+                if number not in scores and self._ids[number] is not None:
+                    scores[number] = weight
+            if len(scores) >= self.max_candidates:
+                break
+        return scores
+
+    def _narrow(self, scores, words):
+        """ Keeps the documents that also match another query word, adding its weight """
+        narrowed = {}
+        if sum(self._count(word) for _, word in words) < len(scores) * len(words):
+            for weight, word in reversed(words):    # best weight is written last
+                for number in self._documents(word):
+                    if number in scores:
+                        narrowed[number] = scores[number] + weight
+            return narrowed
+        for number, score in scores.items():
+            for weight, word in words:
+                if _contains(self._documents(word), number):
+                    narrowed[number] = score + weight
+                    break
+        return narrowed
+
+    def _documents(self, word):
+        """ Returns the sorted document numbers of a word """
+        postings = self._postings[word]
+        return (postings,) if isinstance(postings, int) else postings
+
+    def _count(self, word):
+        """ Returns the number of documents of a word """
+        postings = self._postings[word]
+        return 1 if isinstance(postings, int) else len(postings)
+
+    def _add(self, document_id, text, keep_sorted=True):
+        """ Gives a document the next number and adds it to the postings of its words """
+        number = len(self._ids)
+        self._ids.append(document_id)
+        self._checksums.append(_checksum(text))
+        self._numbers[document_id] = number
+        for word in set(text.split()):
+            postings = self._postings.get(word)
+            if postings is None:
+                self._postings[word] = number
+                self._add_word(word, keep_sorted)
+            elif isinstance(postings, int):
+                self._postings[word] = array('I', (postings, number))
+            else:
+                postings.append(number)
+
+    def _add_word(self, word, keep_sorted=True):
+        """ Adds a new word to the vocabulary """
+        if keep_sorted:
+            insort(self._vocabulary, word)
+        else:
+            self._vocabulary.append(word)
+        if word.isalpha():  # words with digits are only matched whole or by prefix
+            for gram in trigrams(word):
+                self._grams.setdefault(gram, set()).add(word)
+            self._sounds.setdefault(soundex(word), set()).add(word)
+
+    def _remove(self, number):
+        """ Leaves a hole where a document was """
+        del self._numbers[self._ids[number]]
+        self._ids[number] = None
+        self._removed += 1
+
+    def _maybe_compact(self):
+        """ Renumbers the documents once more than a quarter of them are holes """
+        if self._removed < 1000 or self._removed * 4 < len(self._ids):
+            return
+        renumbered = array('l', [-1]) * len(self._ids)
+        ids = []
+        checksums = array('l')
+        for number, document_id in enumerate(self._ids):
+            if document_id is not None:
+                renumbered[number] = len(ids)
+                ids.append(document_id)
+                checksums.append(self._checksums[number])
+        postings = {}
+        for word in self._postings:
+            kept = array('I', (renumbered[number] for number in self._documents(word)
+                               if renumbered[number] >= 0))
+            if len(kept) > 1:
+                postings[word] = kept
+            elif kept:
+                postings[word] = int(kept[0])
+        self._ids = ids
+        self._checksums = checksums
+        self._numbers = dict((document_id, number) for number, document_id in enumerate(ids))
+        self._postings = postings
+        self._vocabulary = []
+        self._grams = {}
+        self._sounds = {}
+        for word in postings:
+            self._add_word(word, keep_sorted=False)
+        self._vocabulary.sort()
+        self._removed = 0
+
+    def stats(self):
+        """ Returns counters describing the index """
+        return {
+            'enabled': self.enabled,
+            'built': self.built,
+            'documents': len(self._numbers),
+            'removed': self._removed,
+            'words': len(self._postings),
+            'postings': sum(self._count(word) for word in self._postings)
+        }
@@ -0,0 +1,113 @@
+"""
+Load Shedding
+
+Keeps track of how long the database has recently taken to answer and of
+how many requests a worker is serving, and refuses work before it piles
+up when either grows too large. Low priority requests, the ones reading
+or writing every Customer, are refused first: as soon as the database is
+slow or the worker is busy. Every other request is only refused when the
+worker already serves as many requests as it may, so reading a Customer
+by id and writing Customers stay responsive while the database recovers.
+"""
+import time
+import threading
+from collections import deque
+
+MAX_SAMPLES = 1000      # database latencies kept to compute the percentile
+
+
+class LoadShedder(object):
+    """ Decides which requests a worker refuses from its load and the database latency """
+
+    def __init__(self, max_latency=0, low_priority_in_flight=0, max_in_flight=0, window=10,
+                 percentile=0.9):
+        """
+        Args:
+            max_latency (float): seconds of database latency above which low
+                priority requests are refused (0 to never refuse for latency)
+            low_priority_in_flight (int): requests in flight from which low
+                priority requests are refused (0 for no limit)
+            max_in_flight (int): requests in flight from which every request
+                is refused (0 for no limit)
+            window (float): seconds a latency sample counts for
+            percentile (float): the latency percentile compared with max_latency
+        """
+        self.max_latency = max_latency
+        self.low_priority_in_flight = low_priority_in_flight
+        self.max_in_flight = max_in_flight
+        self.window = window
+        self.percentile = percentile
+        self.in_flight = 0
+        self.shed_low_priority = 0
+        self.shed_all = 0
+        self._samples = deque(maxlen=MAX_SAMPLES)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """ Requests are only refused with a threshold """
+        return bool(self.max_latency or self.low_priority_in_flight or self.max_in_flight)
+
+    def observe(self, seconds):
+        """ Records how long the database took to answer a request """
+        with self._lock:
+            self._samples.append((time.time(), seconds))
+
+    def latency(self):
+        """ Returns the latency percentile over the window, None without samples """
+        cutoff = time.time() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            latencies = sorted(seconds for _, seconds in self._samples)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile))]
+
+    def shed(self, low_priority=False, count=True):
+        """
+        Returns why a request must be refused, or None when it may be served
+
+        Args:
+            low_priority (bool): True for requests that read or write every Customer
+            count (bool): False to only ask, without counting a refused request
+        """
+        reason = None
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            reason = '{} requests in flight'.format(self.in_flight)
+        elif low_priority:
+            if self.low_priority_in_flight and self.in_flight >= self.low_priority_in_flight:
+                reason = '{} requests in flight'.format(self.in_flight)
+            elif self.max_latency:
+                latency = self.latency()
+                if latency is not None and latency > self.max_latency:
+                    reason = 'database latency {:.0f}ms'.format(latency * 1000)
+        if reason and count:
+            with self._lock:
+                if low_priority:
+                    self.shed_low_priority += 1
+                else:
+                    self.shed_all += 1
+        return reason
+
+    def begin(self):
+        """ Counts a request that is being served """
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self):
+        """ Counts a request that has been served """
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        """ Returns the load, the latency and how many requests were refused """
+        latency = self.latency()
+        return {
+            'enabled': self.enabled,
+            'in_flight': self.in_flight,
+            'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+            'shedding_low_priority': bool(self.enabled and self.shed(True, count=False)),
+            'shed_low_priority': self.shed_low_priority,
+            'shed_all': self.shed_all
+        }
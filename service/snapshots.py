@@ -0,0 +1,106 @@
+"""
+Customer Snapshots
+
+A snapshot is a gzip compressed file with one Customer document per line,
+keeping its _id but not its revision. Dumping streams the documents out of
+the database a page at a time. Restoring removes every Customer and writes
+the ones of the snapshot with concurrent _bulk_docs requests through the
+Importer, so an environment goes back to a known set of customers in a
+few requests instead of a DELETE and a POST per customer.
+"""
+import io
+import json
+import zlib
+import gzip
+from service.models import Customer, BULK_PAGE_SIZE
+from service.commands.importer import Importer
+
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 64 * 1024      # bytes of compressed snapshot produced at a time
+
+
+class SnapshotError(Exception):
+    """ Used when a file or upload isn't a snapshot """
+    pass
+
+
+def snapshot_chunks(documents, level=6):
+    """ Generates the compressed snapshot of documents a chunk at a time """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)     # gzip format
+    pending = []
+    size = 0
+    for document in documents:
+        document = dict((name, value) for name, value in document.items() if name != '_rev')
+        line = (json.dumps(document, sort_keys=True) + '\n').encode('utf-8')
+        pending.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            chunk = compressor.compress(b''.join(pending))
+            pending, size = [], 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(b''.join(pending)) + compressor.flush()
+
+
+def read_snapshot(source):
+    """
+    Generates the (line number, line) of every document in a snapshot
+
+    Args:
+        source (file): the compressed snapshot opened in binary mode
+
+    Raises:
+        SnapshotError: when source isn't gzip compressed
+    """
+    if source.read(2) != GZIP_MAGIC:
+        raise SnapshotError('A snapshot must be a gzip compressed file of JSON lines')
+    source.seek(0)
+    # the BufferedReader gives TextIOWrapper the read1 the Python 2 GzipFile lacks
+    lines = io.TextIOWrapper(io.BufferedReader(gzip.GzipFile(fileobj=source, mode='rb')),
+                             encoding='utf-8')
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            yield number, line
+
+
+def dump(output):
+    """ Writes a snapshot of every Customer to a binary file and returns its size in bytes """
+    size = 0
+    for chunk in snapshot_chunks(Customer.iter_documents()):
+        output.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def restore(source, batch_size=BULK_PAGE_SIZE, workers=4, rejects=None):
+    """
+    Replaces every Customer with the ones of a snapshot
+
+    Args:
+        source (file): the compressed snapshot opened in binary mode
+        batch_size (int): documents per _bulk_docs request
+        workers (int): requests sent at the same time
+        rejects (file): where documents that aren't valid Customers are written
+
+    Returns:
+        dict: the counters of the Importer, plus the number of Customers
+        that were removed
+
+    Raises:
+        SnapshotError: when source isn't a snapshot, before anything is removed
+    """
+    records = read_snapshot(source)
+    first = next(records, None)     # checks the format before removing anything
+    removed = Customer.remove_all()
+    importer = Importer(Customer.insert_many, batch_size, workers, 'snapshot', rejects=rejects)
+    stats = importer.run(_chain(first, records))
+    stats['removed'] = removed
+    return stats
+
+
+def _chain(first, records):
+    """ Puts back the first record taken from records """
+    if first is not None:
+        yield first
+    for record in records:
+        yield record
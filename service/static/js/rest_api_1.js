@@ -6,7 +6,7 @@ $(function () {
 
     // Updates the form with data from the response
     function update_form_data(res) {
-        $("#customer_id").val(res.id);
+        $("#customer_id").val(res._id);
         $("#customer_first_name").val(res.firstname);
         $("#customer_last_name").val(res.lastname);
         $("#customer_email").val(res.email);
@@ -144,10 +144,73 @@ $(function () {
 
     });
 
+    // ****************************************
+    // Unsubscribe a Customer
+    // ****************************************
+
+    $("#unsubscribe-btn").click(function () {
+
+        var customer_id = $("#customer_id").val();
+        if (customer_id == '') {
+            flash_message("Please enter a Customer ID");
+            return 0;
+        }
+
+        var ajax = $.ajax({
+            type: "PUT",
+            url: "/customers/" + customer_id + "/unsubscribe",
+            contentType:"application/json"
+        });
+
+        ajax.done(function(res){
+            update_form_data(res);
+            flash_message("Success");
+        });
+
+        ajax.fail(function(res){
+            flash_message(res.responseJSON.message);
+        });
+
+    });
+
+
     // ****************************************
     // Retrieve a Customer
     // ****************************************
 
+    $("#address-btn").click(function () {
+        var customer_id = $("#customer_id").val();
+        if (customer_id == '') {
+            flash_message("Please enter a Customer ID");
+            return 0;
+        }
+        var ajax = $.ajax({
+            type: "GET",
+            url: "/customers/" + customer_id + "/address",
+            contentType:"application/json",
+            data: ''
+        });
+
+        ajax.done(function(res){
+            //alert(res.toSource())
+            var add = {};
+            add._id = customer_id;
+            add.address = res;
+            update_form_data(add);
+            flash_message("Success");
+        });
+
+        ajax.fail(function(res){
+            clear_form_data();
+            flash_message(res.responseJSON.message);
+        });
+
+    });
+
+    // ****************************************
+    // Get Customer Address
+    // ****************************************
+
     $("#retrieve-btn").click(function () {
         var customer_id = $("#customer_id").val();
 
@@ -188,11 +251,11 @@ $(function () {
 
         ajax.done(function(res){
             clear_form_data();
-            flash_message("Customer Deleted!");
+            flash_message("Customer with ID [" + res.id + "] has been Deleted!");
         });
 
         ajax.fail(function(res){
-            flash_message("Server error!");
+            flash_message(res.responseJSON.message);
         });
     });
 
@@ -206,122 +269,150 @@ $(function () {
     });
 
     // ****************************************
-    // Search for a Customer
+    // Search for Customers
     // ****************************************
 
-    $("#search-btn").click(function () {
+    // The results are requested a page at a time as they scroll into view,
+    // and only the rows in view are in the table
+
+    var PAGE_SIZE = 100;        // customers requested at a time
+    var ROW_HEIGHT = 30;        // pixels of a row of results
+    var OVERSCAN = 10;          // rows kept in the table above and below the view
+    var SEARCH_DELAY = 300;     // milliseconds without typing before searching
+
+    var FILTERS = [
+        ["firstname", "#customer_first_name"], ["lastname", "#customer_last_name"],
+        ["email", "#customer_email"], ["address1", "#customer_address_1"],
+        ["address2", "#customer_address_2"], ["city", "#customer_city"],
+        ["province", "#customer_province"], ["country", "#customer_country"],
+        ["zip", "#customer_zip"]
+    ];
+
+    var results = {query: "", total: 0, rows: [], pages: {}, search: 0};
+
+    // Returns a function that only calls fn once it stops being called for wait ms
+    function debounce(fn, wait) {
+        var timer = null;
+        var debounced = function () {
+            clearTimeout(timer);
+            timer = setTimeout(fn, wait);
+        };
+        debounced.cancel = function () {
+            clearTimeout(timer);
+        };
+        return debounced;
+    }
 
-        var firstname = $("#customer_first_name").val();
-        var lastname = $("#customer_last_name").val();
-        var email = $("#customer_email").val();
-        var subscribed = $("#customer_subscribed").val() == "true";
-        var address1 = $("#customer_address_1").val();
-        var address2 = $("#customer_address_2").val();
-        var city = $("#customer_city").val();
-        var province = $("#customer_province").val();
-        var country = $("#customer_country").val();
-        var zip = $("#customer_zip").val();
+    function escape_html(value) {
+        return $("<div>").text(value === undefined || value === null ? "" : value).html();
+    }
 
-        var queryString = "";
+    // Returns the query string of the filters that are filled in
+    function search_query() {
+        var params = [];
+        for (var i = 0; i < FILTERS.length; i++) {
+            var value = $(FILTERS[i][1]).val();
+            if (value) {
+                params.push(FILTERS[i][0] + "=" + encodeURIComponent(value));
+            }
+        }
+        if ($("#customer_subscribed").val() == "true") {
+            params.push("subscribed=true");
+        }
+        return params.join("&");
+    }
 
-        if (firstname) {
-            queryString += 'firstname=' + firstname;
+    function result_row(customer) {
+        var address = customer.address || {};
+        var cells = [customer._id, customer.firstname, customer.lastname, customer.email,
+                     customer.subscribed, address.address1, address.address2, address.city,
+                     address.province, address.country, address.zip];
+        var row = "<tr>";
+        for (var i = 0; i < cells.length; i++) {
+            row += "<td>" + escape_html(cells[i]) + "</td>";
         }
-        if (lastname) {
-            if (queryString.length > 0) {
-                queryString += '&lastname=' + lastname;
-            } else {
-                queryString += 'lastname=' + lastname;
-            }
-        }if (email) {
-            if (queryString.length > 0) {
-                queryString += '&email=' + email;
-            } else {
-                queryString += 'email=' + email;
-            }
-        }if (subscribed) {
-            if (queryString.length > 0) {
-                queryString += '&subscribed=' + subscribed;
-            } else {
-                queryString += 'subscribed=' + subscribed;
-            }
-        }if (address1) {
-            if (queryString.length > 0) {
-                queryString += '&address1=' + address1;
-            } else {
-                queryString += 'address1=' + address1;
-            }
-        }if (address2) {
-            if (queryString.length > 0) {
-                queryString += '&address2=' + address2;
-            } else {
-                queryString += 'address2=' + address2;
-            }
-        }if (city) {
-            if (queryString.length > 0) {
-                queryString += '&city=' + city;
-            } else {
-                queryString += 'city=' + city;
-            }
-        }if (province) {
-            if (queryString.length > 0) {
-                queryString += '&province=' + province;
-            } else {
-                queryString += 'province=' + province;
-            }
-        }if (country) {
-            if (queryString.length > 0) {
-                queryString += '&country=' + country;
-            } else {
-                queryString += 'country=' + country;
-            }
-        }if (zip) {
-            if (queryString.length > 0) {
-                queryString += '&zip=' + zip;
+        return row + "</tr>";
+    }
+
+    // Puts the rows in view in the table and requests the pages they are on
+    function render_results() {
+        var viewport = $("#results_viewport");
+        var in_view = Math.ceil(viewport.height() / ROW_HEIGHT);
+        var first = Math.max(0, Math.floor(viewport.scrollTop() / ROW_HEIGHT) - OVERSCAN);
+        var last = Math.min(results.total, first + in_view + 2 * OVERSCAN);
+        var rows = "";
+        for (var i = first; i < last; i++) {
+            if (results.rows[i]) {
+                rows += result_row(results.rows[i]);
             } else {
-                queryString += 'zip=' + zip;
+                rows += '<tr><td colspan="11">Loading...</td></tr>';
+                load_page(Math.floor(i / PAGE_SIZE));
             }
         }
+        $("#results_rows").css("top", first * ROW_HEIGHT + "px").find("tbody").html(rows);
+    }
 
+    function load_page(page) {
+        if (results.pages[page]) {
+            return;
+        }
+        results.pages[page] = true;
+        var search = results.search;
         var ajax = $.ajax({
             type: "GET",
-            url: "/customers?" + queryString,
-            contentType:"application/json",
-            data: ''
+            url: "/customers?" + results.query + (results.query ? "&" : "") +
+                 "start=" + page * PAGE_SIZE + "&limit=" + PAGE_SIZE,
+            contentType: "application/json"
         });
 
-        ajax.done(function(res){
-            //alert(res.toSource())
-            $("#search_results").empty();
-            $("#search_results").append('<table class="table-striped">');
-            var header = '<tr>';
-            header += '<th style="width:10%">ID</th>';
-            header += '<th style="width:10%">First Name</th>';
-            header += '<th style="width:10%">Last Name</th>';
-            header += '<th style="width:10%">Email</th>';
-            header += '<th style="width:10%">Subscribed</th>';
-            header += '<th style="width:10%">Address 1</th>';
-            header += '<th style="width:10%">Address 2</th>';
-            header += '<th style="width:10%">City</th>';
-            header += '<th style="width:10%">Province</th>';
-            header += '<th style="width:10%">Country</th>';
-            header += '<th style="width:10%">Zip</th></tr>';
-            $("#search_results").append(header);
-            for(var i = 0; i < res.length; i++) {
-                var customer = res[i];
-                var row = "<tr><td>"+customer.id+"</td><td>"+customer.firstname+"</td><td>"+customer.lastname+"</td><td>"+customer.email+"</td><<td>"+customer.subscribed+"</td><td>"+customer.address1+"</td><td>"+customer.address2+"</td><td>"+customer.city+"</td><td>"+customer.province+"</td><td>"+customer.country+"</td><td>"+customer.zip+"</td>/tr>";
-                $("#search_results").append(row);
+        ajax.done(function(res, text_status, xhr){
+            if (search != results.search) {
+                return;     // a newer search replaced this one
             }
-
-            $("#search_results").append('</table>');
-
-            flash_message("Success");
+            results.total = parseInt(xhr.getResponseHeader("X-Total-Count"), 10) || res.length;
+            for (var i = 0; i < res.length; i++) {
+                results.rows[page * PAGE_SIZE + i] = res[i];
+            }
+            $("#results_spacer").css("height", results.total * ROW_HEIGHT + "px");
+            render_results();
+            flash_message("Success: " + results.total + " customers");
         });
 
         ajax.fail(function(res){
-            flash_message(res.responseJSON.message);
+            delete results.pages[page];
+            flash_message(res.responseJSON ? res.responseJSON.message : "Search failed");
         });
+    }
+
+    function run_search() {
+        results = {query: search_query(), total: 0, rows: [], pages: {}, search: results.search + 1};
+        $("#results_viewport").scrollTop(0);
+        $("#results_spacer").css("height", "0px");
+        $("#results_rows tbody").empty();
+        load_page(0);
+    }
 
+    var search_soon = debounce(run_search, SEARCH_DELAY);
+
+    $("#search-btn").click(function () {
+        search_soon.cancel();
+        run_search();
+    });
+
+    for (var i = 0; i < FILTERS.length; i++) {
+        $(FILTERS[i][1]).on("input", search_soon);
+    }
+    $("#customer_subscribed").on("change", search_soon);
+
+    var render_pending = false;
+    $("#results_viewport").on("scroll", function () {
+        if (!render_pending) {
+            render_pending = true;
+            window.requestAnimationFrame(function () {
+                render_pending = false;
+                render_results();
+            });
+        }
     });
 
 });
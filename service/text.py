@@ -0,0 +1,74 @@
+"""
+Text helpers for matching Customers
+
+Normalization that makes names, emails and addresses comparable no matter
+how they were typed, plus the Soundex and trigram encodings used to find
+Customers whose names are spelled or sound alike.
+"""
+import re
+import unicodedata
+
+try:
+    TEXT_TYPE = unicode     # Python 2
+except NameError:
+    TEXT_TYPE = str         # Python 3
+
+SOUNDEX_CODES = dict((letter, str(code)) for code, letters in enumerate(
+    ('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r')) for letter in letters)
+
+
+def to_text(value):
+    """ Returns a value as text, e.g. the zip code 12310 as '12310' and None as '' """
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'ignore')
+    if not isinstance(value, TEXT_TYPE):
+        return TEXT_TYPE(value)
+    return value
+
+
+def normalize_text(value):
+    """ Lower-cases text and strips accents, punctuation and extra spaces """
+    value = to_text(value)
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', value.lower()).split())
+
+
+def normalize_email(value):
+    """ Lower-cases an email and drops any +tag of its local part """
+    value = to_text(value)
+    if '@' not in value:
+        return ''
+    local, _, domain = value.strip().lower().rpartition('@')
+    return '{}@{}'.format(local.split('+', 1)[0], domain)
+
+
+def soundex(word):
+    """ Returns the American Soundex code of a word, e.g. Robert -> R163 """
+    word = re.sub(r'[^a-z]', '', normalize_text(word))
+    if not word:
+        return ''
+    code = word[0].upper()
+    last = SOUNDEX_CODES.get(word[0])
+    for letter in word[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit != '0' and digit != last:
+            code += digit
+        if letter not in 'hw':
+            last = digit
+    return (code + '000')[:4]
+
+
+def trigrams(text):
+    """ Returns the set of three letter sequences of a text, padded at both ends """
+    padded = '  {} '.format(text)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def jaccard(first, second):
+    """ Returns how much two sets overlap, from 0 to 1 """
+    if not first or not second:
+        return 0.0
+    return len(first & second) / float(len(first | second))
@@ -0,0 +1,279 @@
+"""
+Test cases for the ASGI entry point
+
+They are coroutines, which Python 2 can't compile, so test_aio only
+imports them on Python 3.
+"""
+
+import unittest
+from mock import MagicMock, patch
+from service.models import Customer
+from service.shedding import LoadShedder
+
+try:
+    import asyncio
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from service.aio.couch import AsyncDatabase, CouchError
+    from service.aio.models import AsyncCustomer
+    from service.aio.wsgi import WsgiBridge, wsgi_environ
+    from service.aio.asgi import Request, native_handler, list_customers, get_customer, \
+        create_customer, admit
+except ImportError:     # aiohttp isn't installed
+    web = None
+
+
+def _scope(method='GET', path='/customers', query=b'', headers=None):
+    """ Returns the scope of an ASGI HTTP request """
+    return {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+            'headers': headers or [], 'server': ('testserver', 8080),
+            'client': ('10.0.0.1', 5000)}
+
+
+def _run(coroutine):
+    """ Runs a coroutine on a new event loop """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+@unittest.skipIf(web is None, 'the ASGI entry point needs aiohttp')
+class TestWsgiBridge(unittest.TestCase):
+    """ Test Cases for the WSGI bridge """
+
+    def test_wsgi_environ(self):
+        """ Translate an ASGI scope to a WSGI environ """
+        environ = wsgi_environ(_scope('POST', '/customers', b'a=1', [
+            (b'content-type', b'application/json'), (b'accept', b'text/html'),
+            (b'accept', b'application/json')]), b'{}')
+        self.assertEqual(environ['REQUEST_METHOD'], 'POST')
+        self.assertEqual(environ['PATH_INFO'], '/customers')
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,application/json')
+        self.assertEqual(environ['SERVER_PORT'], '8080')
+        self.assertEqual(environ['REMOTE_ADDR'], '10.0.0.1')
+        self.assertEqual(environ['wsgi.input'].read(), b'{}')
+
+    def test_stream_response(self):
+        """ Send the chunks of a WSGI response as they are produced """
+        def application(environ, start_response):
+            start_response('201 CREATED', [('Content-Type', 'text/plain')])
+            return [b'one', b'', b'two']
+
+        messages = []
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def send(message):
+            messages.append(message)
+
+        bridge = WsgiBridge(application, threads=2)
+        _run(bridge(_scope(), b'', receive, send))
+        self.assertEqual(messages[0]['status'], 201)
+        self.assertEqual(messages[0]['headers'], [(b'content-type', b'text/plain')])
+        self.assertEqual([message['body'] for message in messages[1:]], [b'one', b'two', b''])
+        self.assertFalse(messages[-1]['more_body'])
+
+    def test_client_disconnected(self):
+        """ Stop sending once the client has gone away """
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            while True:
+                yield b'tick'
+
+        sent = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            await asyncio.sleep(0.01)
+
+        bridge = WsgiBridge(application, threads=2)
+        _run(bridge(_scope(), b'', receive, send))
+        self.assertLess(len(sent), 10)
+
+
+@unittest.skipIf(web is None, 'the ASGI entry point needs aiohttp')
+class TestNativeHandlers(unittest.TestCase):
+    """ Test Cases for choosing between the coroutines and the Flask app """
+
+    def test_native_routes(self):
+        """ Serve the Customer routes with coroutines """
+        request = Request(_scope(query=b'lastname=Doe'), b'')
+        self.assertIs(native_handler(request, 'customercollection'), list_customers)
+        request = Request(_scope('POST', headers=[(b'content-type', b'application/json')]),
+                          b'{}')
+        self.assertIs(native_handler(request, 'customercollection'), create_customer)
+        request = Request(_scope(path='/customers/123'), b'')
+        self.assertIs(native_handler(request, 'customerresource'), get_customer)
+
+    def test_flask_routes(self):
+        """ Leave the other routes and variants to the Flask app """
+        request = Request(_scope(query=b'since=0'), b'')
+        self.assertIsNone(native_handler(request, 'customercollection'))
+        request = Request(_scope('POST', headers=[
+            (b'content-type', b'application/x-www-form-urlencoded')]), b'firstname=John')
+        self.assertIsNone(native_handler(request, 'customercollection'))
+        self.assertIsNone(native_handler(Request(_scope(), b''), 'customerexport'))
+        self.assertIsNone(native_handler(Request(_scope(), b''), None))
+
+    def test_rate_limited(self):
+        """ Refuse native requests over the rate limit """
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        limiter = MagicMock(enabled=True)
+        limiter.acquire.return_value = 2.5
+        # the leftmost entry is whatever the client sent, the router appended the last one
+        request = Request(_scope(headers=[(b'x-forwarded-for', b'10.9.9.9, 10.1.2.3')]), b'')
+        with patch.object(Customer, 'rate_limiter', limiter):
+            self.assertFalse(_run(admit(request, 'customercollection', send)))
+            limiter.acquire.assert_called_once_with('10.1.2.3', 10)
+            self.assertEqual(sent[0]['status'], 429)
+            self.assertIn((b'retry-after', b'3'), sent[0]['headers'])
+            limiter.acquire.return_value = 0
+            request = Request(_scope(path='/customers/123'), b'')
+            self.assertTrue(_run(admit(request, 'customerresource', send)))
+            self.assertEqual(limiter.acquire.call_args[0], ('10.0.0.1', 1))
+
+    def test_shed_load(self):
+        """ Refuse native full listings while the database is slow """
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        shedder = LoadShedder(max_latency=0.5)
+        shedder.observe(2)
+        with patch.object(Customer, 'shedder', shedder):
+            self.assertFalse(_run(admit(Request(_scope(), b''), 'customercollection', send)))
+            self.assertEqual(sent[0]['status'], 503)
+            request = Request(_scope(path='/customers/123'), b'')
+            self.assertTrue(_run(admit(request, 'customerresource', send)))
+
+
+@unittest.skipIf(web is None, 'the ASGI entry point needs aiohttp')
+class TestAsyncDatabase(unittest.TestCase):
+    """ Test Cases for the asynchronous CouchDB client """
+
+    def setUp(self):
+        self.requests = []
+
+    async def _serve(self, test):
+        """ Runs test against a database whose "flaky" path fails the first time """
+        async def handle(request):
+            path = request.match_info.get('path', '')
+            self.requests.append(path)
+            if path == 'flaky' and self.requests.count(path) == 1:
+                return web.json_response({'error': 'unavailable'}, status=503)
+            if path == 'busy' and self.requests.count(path) == 1:
+                return web.json_response({'error': 'too_many_requests'}, status=429)
+            if path == 'proxy':
+                return web.Response(text='<html>Bad Gateway</html>', status=502)
+            if path == 'missing':
+                return web.json_response({'error': 'not_found'}, status=404)
+            if path == 'bad':
+                return web.json_response({'error': 'bad_request'}, status=400)
+            return web.json_response({'ok': True, 'query': dict(request.query)})
+
+        app = web.Application()
+        app.router.add_route('*', '/test', handle)
+        app.router.add_route('*', '/test/{path}', handle)
+        server = TestServer(app)
+        await server.start_server()
+        database = AsyncDatabase(str(server.make_url('/')), 'test')
+        try:
+            await database.open()
+            return await test(database)
+        finally:
+            await database.close()
+            await server.close()
+
+    def test_retry_and_json_params(self):
+        """ Retry a failed request and encode the JSON parameters """
+        async def test(database):
+            return await database.request('GET', 'flaky', params={
+                'key': 'a', 'include_docs': 'true', 'limit': 5})
+        result = _run(self._serve(test))
+        self.assertEqual(self.requests, ['', 'flaky', 'flaky'])
+        self.assertEqual(result['query'], {'key': '"a"', 'include_docs': 'true', 'limit': '5'})
+
+    def test_missing_document(self):
+        """ Return None for a document that doesn't exist """
+        self.assertIsNone(_run(self._serve(lambda database: database.get('missing'))))
+
+    def test_error_status(self):
+        """ Raise CouchError for an error that isn't retried """
+        async def test(database):
+            try:
+                await database.get('bad')
+            except CouchError as error:
+                return error
+            return None
+        error = _run(self._serve(test))
+        self.assertEqual(error.status, 400)
+        self.assertEqual(error.body, {'error': 'bad_request'})
+        self.assertEqual(self.requests, ['', 'bad'])
+
+    def test_writes_not_retried(self):
+        """ Only retry a write that was refused before it was carried out """
+        async def test(database):
+            try:
+                await database.request('POST', 'flaky', body={'firstname': 'John'})
+            except CouchError as error:
+                return error, await database.request('POST', 'busy', body={})
+            return None, None
+        error, result = _run(self._serve(test))
+        self.assertEqual(error.status, 503)
+        self.assertTrue(result['ok'])
+        self.assertEqual(self.requests, ['', 'flaky', 'busy', 'busy'])
+
+    def test_error_page(self):
+        """ Raise CouchError for an answer that isn't JSON """
+        async def test(database):
+            try:
+                await database.request('POST', 'proxy', body={})
+            except CouchError as error:
+                return error
+            return None
+        error = _run(self._serve(test))
+        self.assertEqual(error.status, 502)
+        self.assertEqual(error.body['error'], 'bad_response')
+        self.assertIn('Bad Gateway', error.body['reason'])
+
+
+@unittest.skipIf(web is None, 'the ASGI entry point needs aiohttp')
+class TestAsyncCustomer(unittest.TestCase):
+    """ Test Cases for the asynchronous Customer finders """
+
+    @patch('service.aio.models.BULK_PAGE_SIZE', 2)
+    def test_all_in_pages(self):
+        """ Read all of the Customers a page at a time """
+        ids = ['1', '2', '3', '_design/customers', 'a']
+        requests = []
+
+        async def all_docs(**params):
+            requests.append(params)
+            start = ids.index(params['startkey']) if 'startkey' in params else 0
+            return [{'id': doc_id, 'doc': dict(Customer(firstname='John').serialize(), _id=doc_id)}
+                    for doc_id in ids[start:start + params['limit']]]
+
+        database = MagicMock(all_docs=all_docs)
+        with patch.object(AsyncCustomer, 'database', database):
+            customers = _run(AsyncCustomer.all())
+        self.assertEqual([customer.id for customer in customers], ['1', '2', '3', 'a'])
+        self.assertEqual([params.get('startkey') for params in requests],
+                         [None, '3', 'a'])
+        self.assertEqual(requests[0]['limit'], 3)
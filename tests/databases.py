@@ -0,0 +1,20 @@
+"""
+Test Databases
+
+Every test connects to a database of its own, named after the test
+process and the run, and drops it when it is done, so the suites can run
+in several processes at once against the same CouchDB:
+  nosetests --processes=4
+  pytest -n 4
+"""
+import os
+import uuid
+import itertools
+
+_run = uuid.uuid4().hex[:6]     # tells apart runs on machines sharing a CouchDB
+_numbers = itertools.count()
+
+
+def unique_database_name(prefix):
+    """ Returns a database name that no other test, in any process, uses """
+    return '{}-{}-{}-{}'.format(prefix, os.getpid(), _run, next(_numbers))
@@ -0,0 +1,14 @@
+"""
+Test cases for the ASGI entry point
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import sys
+
+# the test cases are coroutines, the ASGI entry point needs Python 3
+if sys.version_info[0] > 2:
+    from .aio_cases import TestWsgiBridge, TestNativeHandlers, TestAsyncDatabase, \
+        TestAsyncCustomer
@@ -0,0 +1,56 @@
+"""
+Test cases for the App Factory
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import sys
+import subprocess
+import unittest
+from mock import patch
+import service
+from service.models import Customer
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestAppFactory(unittest.TestCase):
+    """ Test Cases for create_app and init_db """
+
+    def setUp(self):
+        self.addCleanup(setattr, service, '_connected_pid', service._connected_pid)
+        service._connected_pid = None
+
+    def test_import_is_lazy(self):
+        """ Importing the package doesn't import Flask or Cloudant """
+        code = ('import sys, service, service.export; '
+                'print(sorted(name for name in ("flask", "cloudant", "pyarrow") '
+                'if name in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.decode('utf-8').strip(), '[]')
+
+    def test_create_app(self):
+        """ Every call builds an app with all of the routes """
+        first = service.create_app()
+        second = service.create_app()
+        self.assertIsNot(first, second)
+        endpoints = set(rule.endpoint for rule in first.url_map.iter_rules())
+        self.assertIn('customercollection', endpoints)
+        self.assertIn('customerresource', endpoints)
+        self.assertEqual(endpoints, set(rule.endpoint for rule in second.url_map.iter_rules()))
+
+    @patch.object(Customer, 'jobs')
+    @patch.object(Customer, 'init_db')
+    def test_init_db_once_per_process(self, init_db, jobs):
+        """ Connect once per process and again in a forked child """
+        service.init_db('apptest')
+        service.init_db('apptest')
+        self.assertEqual(init_db.call_count, 1)
+        with patch('os.getpid', return_value=-1):
+            service.init_db('apptest')
+        self.assertEqual(init_db.call_count, 2)
+        self.assertEqual(jobs.start.call_count, 2)
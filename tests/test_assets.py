@@ -0,0 +1,80 @@
+"""
+Test cases for Static Assets
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from werkzeug.datastructures import Accept
+from service import assets
+from service.assets import AssetManifest, build, hashed_name
+
+SCRIPT = b'$(function () { console.log("customers"); });\n' * 20
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestAssets(unittest.TestCase):
+    """ Test Cases for hashed and precompressed assets """
+
+    def setUp(self):
+        """ Creates a static folder with a script and an image """
+        self.static_dir = tempfile.mkdtemp(prefix='static-')
+        self.addCleanup(shutil.rmtree, self.static_dir)
+        os.makedirs(os.path.join(self.static_dir, 'js'))
+        os.makedirs(os.path.join(self.static_dir, 'images'))
+        with open(os.path.join(self.static_dir, 'js', 'app.js'), 'wb') as out:
+            out.write(SCRIPT)
+        with open(os.path.join(self.static_dir, 'images', 'icon.png'), 'wb') as out:
+            out.write(b'\x89PNG')
+        self.hashed = hashed_name('js/app.js', SCRIPT)
+
+    def test_hashed_name(self):
+        """ The hash of the content goes before the extension """
+        self.assertRegexpMatches(self.hashed, r'^js/app\.[0-9a-f]{12}\.js$')
+        self.assertNotEqual(hashed_name('js/app.js', SCRIPT + b' '), self.hashed)
+
+    def test_not_built(self):
+        """ Without a build the assets are hashed and served where they are """
+        manifest = AssetManifest(self.static_dir)
+        self.assertFalse(manifest.built)
+        self.assertEqual(manifest.url('js/app.js'), '/static/' + self.hashed)
+        self.assertEqual(manifest.url('js/other.js'), '/static/js/other.js')
+        found = manifest.find(self.hashed, Accept([('gzip', 1)]))
+        self.assertEqual(found, (os.path.join(self.static_dir, 'js', 'app.js'), None))
+        self.assertIsNone(manifest.find('js/app.js', Accept([])))
+
+    def test_build(self):
+        """ The build writes hashed copies, compressed variants and a manifest """
+        stats = build(self.static_dir)
+        self.assertEqual(stats['assets'], 2)
+        self.assertEqual(stats['bytes'], len(SCRIPT) + 4)
+        dist_dir = os.path.join(self.static_dir, assets.DIST)
+        with open(os.path.join(dist_dir, assets.MANIFEST)) as source:
+            self.assertEqual(json.load(source)['js/app.js'], self.hashed)
+        with gzip.open(os.path.join(dist_dir, self.hashed + '.gz')) as source:
+            self.assertEqual(source.read(), SCRIPT)
+        # images aren't compressed again
+        self.assertFalse([name for name in os.listdir(os.path.join(dist_dir, 'images'))
+                          if name.endswith('.gz')])
+        # a second build doesn't hash the first one's output
+        self.assertEqual(build(self.static_dir)['assets'], 2)
+
+        manifest = AssetManifest(self.static_dir)
+        self.assertTrue(manifest.built)
+        path, encoding = manifest.find(self.hashed, Accept([('gzip', 1), ('deflate', 1)]))
+        self.assertEqual((path, encoding), (os.path.join(dist_dir, self.hashed + '.gz'), 'gzip'))
+        path, encoding = manifest.find(self.hashed, Accept([]))
+        self.assertEqual((path, encoding), (os.path.join(dist_dir, self.hashed), None))
+        if assets.brotli is not None:
+            self.assertEqual(manifest.find(self.hashed, Accept([('gzip', 1), ('br', 1)]))[1],
+                             'br')
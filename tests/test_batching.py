@@ -0,0 +1,98 @@
+"""
+Test cases for the Write Coalescer
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import threading
+import unittest
+from requests import HTTPError
+from service.batching import WriteCoalescer
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestWriteCoalescer(unittest.TestCase):
+    """ Test Cases for WriteCoalescer """
+
+    def setUp(self):
+        self.batches = []
+
+    def _bulk_docs(self, documents):
+        """ Pretends to be _bulk_docs, rejecting documents named Conflict """
+        self.batches.append(len(documents))
+        results = []
+        for document in documents:
+            if document['firstname'] == 'Conflict':
+                results.append({'id': document['_id'], 'error': 'conflict',
+                                'reason': 'Document update conflict.'})
+            else:
+                results.append({'id': document['firstname'], 'rev': '1-a'})
+        return results
+
+    def _save_concurrently(self, coalescer, names):
+        """ Saves one document per name from its own thread """
+        results = {}
+        errors = {}
+
+        def save(name):
+            try:
+                results[name] = coalescer.save({'_id': name, 'firstname': name})
+            except HTTPError as error:
+                errors[name] = error
+
+        threads = [threading.Thread(target=save, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_writes_are_coalesced(self):
+        """ Concurrent writes share _bulk_docs requests """
+        coalescer = WriteCoalescer(self._bulk_docs, window=0.05, max_batch=100)
+        names = ['customer{}'.format(i) for i in range(20)]
+        results, errors = self._save_concurrently(coalescer, names)
+        self.assertEqual(errors, {})
+        for name in names:
+            self.assertEqual(results[name]['id'], name)
+        self.assertEqual(sum(self.batches), 20)
+        self.assertLess(len(self.batches), 20)
+        self.assertEqual(coalescer.stats()['writes'], 20)
+
+    def test_batch_size_is_bounded(self):
+        """ Batches never exceed max_batch """
+        coalescer = WriteCoalescer(self._bulk_docs, window=0.05, max_batch=3)
+        self._save_concurrently(coalescer, ['customer{}'.format(i) for i in range(10)])
+        self.assertEqual(sum(self.batches), 10)
+        self.assertLessEqual(max(self.batches), 3)
+
+    def test_errors_go_to_their_writer(self):
+        """ A rejected document raises only for its own writer """
+        coalescer = WriteCoalescer(self._bulk_docs, window=0.05)
+        results, errors = self._save_concurrently(coalescer, ['John', 'Conflict'])
+        self.assertIn('John', results)
+        self.assertIn('Conflict', errors)
+        self.assertIn('conflict', str(errors['Conflict']))
+
+    def test_failed_request(self):
+        """ A failed request raises for every writer in the batch """
+        def broken(documents):
+            raise HTTPError('429 Too Many Requests')
+        coalescer = WriteCoalescer(broken, window=0.01)
+        self.assertRaises(HTTPError, coalescer.save, {'firstname': 'John'})
+
+    def test_disabled(self):
+        """ A window of zero disables coalescing """
+        self.assertFalse(WriteCoalescer(self._bulk_docs, window=0).enabled)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
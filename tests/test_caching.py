@@ -0,0 +1,232 @@
+"""
+Test cases for the Caching helpers
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import time
+import zlib
+import threading
+import unittest
+from service.caching import SingleFlight, NegativeCache, QueryCache, ResponseCache, \
+     selector_may_match
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestSingleFlight(unittest.TestCase):
+    """ Test Cases for SingleFlight """
+
+    def test_calls_function(self):
+        """ Call a function through SingleFlight """
+        flight = SingleFlight()
+        self.assertEqual(flight.do('key', lambda x: x * 2, 21), 42)
+        self.assertEqual(flight.calls, 1)
+        self.assertEqual(flight.shared, 0)
+
+    def test_concurrent_calls_are_shared(self):
+        """ Concurrent calls for the same key share one backend call """
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def slow_lookup():
+            started.set()
+            release.wait()
+            return 'customer'
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('id', slow_lookup)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flight.do('id', slow_lookup)))
+                     for _ in range(5)]
+        for follower in followers:
+            follower.start()
+        while flight.shared < 5:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(results, ['customer'] * 6)
+        self.assertEqual(flight.calls, 1)
+        self.assertEqual(flight.shared, 5)
+
+    def test_errors_are_raised(self):
+        """ Errors are raised to the caller and the key is released """
+        flight = SingleFlight()
+
+        def broken():
+            raise KeyError('boom')
+
+        self.assertRaises(KeyError, flight.do, 'key', broken)
+        self.assertEqual(flight.do('key', lambda: 'ok'), 'ok')
+        self.assertEqual(flight.calls, 2)
+
+
+class TestNegativeCache(unittest.TestCase):
+    """ Test Cases for NegativeCache """
+
+    def test_remembers_missing_keys(self):
+        """ Remember a missing key """
+        cache = NegativeCache(ttl=60)
+        self.assertNotIn('nobody', cache)
+        cache.add('nobody')
+        self.assertIn('nobody', cache)
+        self.assertEqual(cache.hits, 1)
+
+    def test_keys_expire(self):
+        """ Missing keys expire after the ttl """
+        cache = NegativeCache(ttl=0.01)
+        cache.add('nobody')
+        time.sleep(0.02)
+        self.assertNotIn('nobody', cache)
+
+    def test_discard_and_clear(self):
+        """ Discard and clear missing keys """
+        cache = NegativeCache(ttl=60)
+        cache.add('one')
+        cache.add('two')
+        cache.discard('one')
+        self.assertNotIn('one', cache)
+        self.assertIn('two', cache)
+        cache.clear()
+        self.assertNotIn('two', cache)
+
+    def test_size_is_bounded(self):
+        """ The oldest keys are dropped when the cache is full """
+        cache = NegativeCache(ttl=60, max_size=2)
+        for key in ('one', 'two', 'three'):
+            cache.add(key)
+        self.assertNotIn('one', cache)
+        self.assertIn('three', cache)
+
+    def test_disabled(self):
+        """ A ttl of zero disables the cache """
+        cache = NegativeCache(ttl=0)
+        cache.add('nobody')
+        self.assertNotIn('nobody', cache)
+
+
+class TestQueryCache(unittest.TestCase):
+    """ Test Cases for QueryCache """
+
+    def setUp(self):
+        self.cache = QueryCache(max_bytes=1024, max_age=60)
+        self.john = {'_id': '1', 'firstname': 'John', 'address': {'country': 'USA'}}
+        self.sarah = {'_id': '2', 'firstname': 'Sarah', 'address': {'country': 'Italy'}}
+
+    def _put(self, key, selector, documents):
+        self.cache.put(key, selector, documents, self.cache.generation)
+
+    def test_get_and_put(self):
+        """ Cache a query result """
+        self.assertIsNone(self.cache.get('usa'))
+        self._put('usa', {'address': {'country': 'USA'}}, [self.john])
+        self.assertEqual(self.cache.get('usa'), [self.john])
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_invalidate_member(self):
+        """ A change to a cached document drops the entry """
+        self._put('usa', {'address': {'country': 'USA'}}, [self.john])
+        self.cache.invalidate('1')
+        self.assertIsNone(self.cache.get('usa'))
+
+    def test_invalidate_new_match(self):
+        """ A changed document that now matches drops the entry """
+        self._put('usa', {'address': {'country': 'USA'}}, [self.john])
+        self._put('italy', {'address': {'country': 'Italy'}}, [self.sarah])
+        self.cache.invalidate('3', {'_id': '3', 'address': {'country': 'Italy'}})
+        self.assertIsNotNone(self.cache.get('usa'))
+        self.assertIsNone(self.cache.get('italy'))
+
+    def test_stale_generation_is_not_cached(self):
+        """ Results read before an invalidation are not cached """
+        generation = self.cache.generation
+        self.cache.invalidate('1')
+        self.cache.put('usa', {'address': {'country': 'USA'}}, [self.john], generation)
+        self.assertIsNone(self.cache.get('usa'))
+
+    def test_max_age(self):
+        """ Entries are not served once they are too old """
+        cache = QueryCache(max_bytes=1024, max_age=0.01)
+        cache.put('usa', {}, [self.john], cache.generation)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('usa'))
+
+    def test_lru_eviction(self):
+        """ The least recently used entries are evicted to stay in bounds """
+        cache = QueryCache(max_bytes=200, max_age=60)
+        cache.put('john', {}, [self.john], cache.generation)
+        cache.put('sarah', {}, [self.sarah], cache.generation)
+        cache.get('john')
+        cache.put('again', {}, [self.sarah], cache.generation)
+        self.assertIsNone(cache.get('sarah'))
+        self.assertIsNotNone(cache.get('john'))
+        self.assertLessEqual(cache.size, 200)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_disabled(self):
+        """ A max age of zero disables the cache """
+        cache = QueryCache(max_bytes=1024, max_age=0)
+        cache.put('usa', {}, [self.john], cache.generation)
+        self.assertIsNone(cache.get('usa'))
+
+    def test_selector_may_match(self):
+        """ Match documents against selectors """
+        self.assertTrue(selector_may_match({'firstname': 'John'}, self.john))
+        self.assertFalse(selector_may_match({'firstname': 'Sarah'}, self.john))
+        self.assertTrue(selector_may_match({'address': {'country': 'USA'}}, self.john))
+        self.assertFalse(selector_may_match({'address': {'country': 'USA'}}, self.sarah))
+        self.assertTrue(selector_may_match({'firstname': {'$gt': 'A'}}, self.sarah))
+
+
+class TestResponseCache(unittest.TestCase):
+    """ Test Cases for ResponseCache """
+
+    def setUp(self):
+        self.cache = ResponseCache(max_bytes=4096, max_age=60)
+        self.parts = {'customer': {'_id': '1', 'address': {'city': 'Miami'}},
+                      'address': {'city': 'Miami'}}
+
+    def test_get_and_put(self):
+        """ Cache an encoded document """
+        self.assertIsNone(self.cache.get('1'))
+        encoded = self.cache.put('1', '1-a', self.parts, self.cache.generation)
+        self.assertEqual(encoded.bodies['address'], b'{"city": "Miami"}\n')
+        self.assertIs(self.cache.get('1'), encoded)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_invalidate_by_revision(self):
+        """ Only a different revision invalidates a document """
+        self.cache.put('1', '1-a', self.parts, self.cache.generation)
+        self.cache.invalidate('1', '1-a')
+        self.assertIsNotNone(self.cache.get('1'))
+        self.cache.invalidate('1', '2-b')
+        self.assertIsNone(self.cache.get('1'))
+
+    def test_compress(self):
+        """ Keep gzip compressed bodies """
+        cache = ResponseCache(max_bytes=4096, max_age=60, compress=True)
+        encoded = cache.put('1', '1-a', self.parts, cache.generation)
+        self.assertEqual(zlib.decompress(encoded.gzipped['address'], 31),
+                         encoded.bodies['address'])
+
+    def test_disabled(self):
+        """ A disabled cache still encodes documents """
+        cache = ResponseCache(max_bytes=0, max_age=0)
+        encoded = cache.put('1', '1-a', self.parts, cache.generation)
+        self.assertIn(b'Miami', encoded.bodies['customer'])
+        self.assertIsNone(cache.get('1'))
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
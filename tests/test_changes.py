@@ -0,0 +1,79 @@
+"""
+Test cases for the Changes Feed Follower
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import unittest
+from service.changes import ChangeFollower, Subscription
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestChangeFollower(unittest.TestCase):
+    """ Test Cases for ChangeFollower and Subscription """
+
+    def setUp(self):
+        self.follower = ChangeFollower(database=None)
+        self.change = {'seq': '1-abc', 'id': '42', 'changes': [{'rev': '1-a'}]}
+
+    def test_publish_to_listeners(self):
+        """ Every listener is given every change """
+        first = []
+        second = []
+        self.follower.subscribe(first.append)
+        self.follower.subscribe(second.append)
+        self.follower._publish(self.change)
+        self.assertEqual(first, [self.change])
+        self.assertEqual(second, [self.change])
+        self.follower.unsubscribe(first.append)
+        self.assertEqual(self.follower.stats()['listeners'], 1)
+
+    def test_broken_listener(self):
+        """ A broken listener does not keep others from the change """
+        received = []
+
+        def broken(change):
+            raise ValueError('boom')
+
+        self.follower.subscribe(broken)
+        self.follower.subscribe(received.append)
+        self.follower._publish(self.change)
+        self.assertEqual(received, [self.change])
+
+    def test_subscription(self):
+        """ A subscription queues changes for its consumer """
+        subscription = Subscription()
+        self.follower.subscribe(subscription)
+        self.follower._publish(self.change)
+        self.assertEqual(subscription.get(timeout=0.01), self.change)
+        self.assertIsNone(subscription.get(timeout=0.01))
+
+    def test_max_subscriptions(self):
+        """ Only Subscriptions count toward their limit """
+        self.follower.subscribe(list().append)
+        first = Subscription()
+        self.assertTrue(self.follower.subscribe(first, max_subscriptions=1))
+        self.assertFalse(self.follower.subscribe(Subscription(), max_subscriptions=1))
+        self.assertTrue(self.follower.subscribe(first, max_subscriptions=1))
+        self.assertEqual(self.follower.stats()['listeners'], 2)
+        self.assertEqual(self.follower.stats()['subscriptions'], 1)
+
+    def test_subscription_overflow(self):
+        """ A subscription that falls behind is marked as overflowed """
+        subscription = Subscription(max_pending=1)
+        subscription(self.change)
+        self.assertFalse(subscription.overflowed)
+        subscription(self.change)
+        self.assertTrue(subscription.overflowed)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -6,10 +6,16 @@ Test cases can be run with:
   coverage report -m
 """
 
+import time
 import unittest
 from mock import MagicMock, patch
 from requests import HTTPError, ConnectionError
-from service.models import Customer, DataValidationError
+from service.models import Customer, DataValidationError, DuplicateEmailError, MAX_LOOKUP_IDS
+from service.caching import QueryCache
+from service.batching import WriteCoalescer
+from service.hedging import Hedger, MIN_SAMPLES
+from service.geo import ZipIndex
+from .databases import unique_database_name
 
 VCAP_SERVICES = {
     'cloudantNoSQLDB': [
@@ -33,16 +39,12 @@ class TestCustomers(unittest.TestCase):
     """ Test Cases for Customer Model """
 
     def setUp(self):
-        """ Initialize the Cloudant database """
-        Customer.init_db("customertest")
-        Customer.remove_all()
+        """ Initialize a Cloudant database of this test's own """
+        Customer.init_db(unique_database_name('customertest'))
 
     def tearDown(self):
-        """ Initialize the Cloudant database """
-        try:
-            Customer.remove_all()
-        except:
-            pass
+        """ Drop the database of the test """
+        Customer.drop_db()
 
     def test_create_a_customer(self):
         """ Create a customer and assert that it exists """
@@ -107,6 +109,7 @@ class TestCustomers(unittest.TestCase):
                             city="New York", country="USA", province="NY", zip="12310"
                            )
         self.assertRaises(AttributeError, customer.save)
+        Customer.connect()
 
     def test_add_a_customer(self):
         """ Create a customer and add it to the database """
@@ -300,6 +303,23 @@ class TestCustomers(unittest.TestCase):
         self.assertEqual(customer.country, "USA")
         self.assertEqual(customer.zip, "12310")
 
+    def test_find_hedged(self):
+        """ Find Customers by ID with hedged reads """
+        self.addCleanup(setattr, Customer, 'hedger', Customer.hedger)
+        Customer.hedger = Hedger(enabled=True, min_delay=0.001, max_ratio=1)
+        john = Customer(firstname="John", lastname="Doe", email="fake1@email.com")
+        john.save()
+        for _ in range(MIN_SAMPLES + 5):
+            Customer.missing_ids.clear()
+            self.assertEqual(Customer.find(john.id).firstname, "John")
+            self.assertIsNone(Customer.find('missing'))
+        customers, missing = Customer.find_many([john.id, 'missing'])
+        self.assertEqual([customer.id for customer in customers], [john.id])
+        self.assertEqual(missing, ['missing'])
+        stats = Customer.stats()['hedging']
+        self.assertEqual(stats['calls'], 2 * (MIN_SAMPLES + 5) + 1)
+        self.assertIsNotNone(stats['delay_ms']['find'])
+
     def test_find_by_email(self):
         """ Find Customers by Email """
         Customer(firstname="John", lastname="Doe", email="fake1@email.com",
@@ -320,6 +340,105 @@ class TestCustomers(unittest.TestCase):
         self.assertEqual(customers[0].country, "USA")
         self.assertEqual(customers[0].zip, "12310")
 
+    def test_find_by_email_ignores_case(self):
+        """ Find Customers by Email whatever its case """
+        Customer(firstname="John", lastname="Doe", email="Fake1@Email.com",
+                 subscribed=False, address1="123 Main St", address2="1B",
+                 city="New York", country="USA", province="NY", zip="12310").save()
+        customers = Customer.find_by_email("fake1@EMAIL.com")
+        self.assertEqual(len(customers), 1)
+        self.assertEqual(customers[0].firstname, "John")
+        self.assertEqual(Customer.find_by_email(""), [])
+
+    @patch('service.models.UNIQUE_EMAILS', True)
+    def test_create_duplicate_email(self):
+        """ Create a Customer with the email of another one """
+        john = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                        subscribed=False, address1="123 Main St", address2="1B",
+                        city="New York", country="USA", province="NY", zip="12310")
+        john.save()
+        copy = Customer(firstname="Johnny", lastname="Doe", email="FAKE1@email.com",
+                        subscribed=False, address1="123 Main St", address2="1B",
+                        city="New York", country="USA", province="NY", zip="12310")
+        self.assertRaises(DuplicateEmailError, copy.save)
+        # saving the owner of the email again is fine
+        john.lastname = "Dough"
+        john.save()
+        self.assertEqual(len(Customer.all()), 1)
+
+    @patch('service.models.UNIQUE_EMAILS', True)
+    def test_update_keeping_email_skips_check(self):
+        """ Updating a Customer without changing its email doesn't look the email up """
+        john = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                        subscribed=False, address1="123 Main St", address2="1B",
+                        city="New York", country="USA", province="NY", zip="12310")
+        john.save()
+        john.email = "Fake1@email.com"
+        with patch.object(Customer, 'email_owners') as email_owners:
+            john.save()
+            self.assertFalse(email_owners.called)
+            john.email = "fake2@email.com"
+            email_owners.return_value = {}
+            john.save()
+            self.assertTrue(email_owners.called)
+
+    @patch('service.models.UNIQUE_EMAILS', True)
+    def test_update_many_duplicate_email(self):
+        """ Bulk changes don't give the email of a Customer to others """
+        for name, email in (("John", "fake1@email.com"), ("Sarah", "fake2@email.com"),
+                            ("Isabel", "fake3@email.com")):
+            Customer(firstname=name, lastname="Doe", email=email,
+                     subscribed=False, address1="123 Main St", address2="1B",
+                     city="New York", country="USA", province="NY", zip="12310").save()
+        counts = Customer.update_many({'email': 'FAKE1@email.com'},
+                                      selector={'lastname': 'Doe'})
+        self.assertEqual(counts['matched'], 3)
+        self.assertEqual(counts['failed'], 2)
+        self.assertEqual(len(Customer.find_by_email('fake1@email.com')), 1)
+
+    @patch('service.models.UNIQUE_EMAILS', True)
+    def test_save_many_duplicate_emails(self):
+        """ Save many Customers sharing an email """
+        customers = [Customer(firstname=name, lastname="Doe", email="fake1@email.com",
+                              subscribed=False, address1="123 Main St", address2="1B",
+                              city="New York", country="USA", province="NY", zip="12310")
+                     for name in ("John", "Johnny")]
+        errors = Customer.save_many(customers)
+        self.assertIsNone(errors[0])
+        self.assertIn('already exists', errors[1])
+
+    def test_apply_jobs_in_order(self):
+        """ Apply queued updates of the same Customer in order """
+        customer = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                            subscribed=False, address1="123 Main St", address2="1B",
+                            city="New York", country="USA", province="NY", zip="12310")
+        customer.save()
+        jobs = []
+        for number, name in enumerate(("Johnny", "Jon")):
+            payload = customer.serialize()
+            payload['firstname'] = name
+            jobs.append({'id': str(number), 'action': 'update',
+                         'customer_id': customer.id, 'payload': payload})
+        jobs.append({'id': '2', 'action': 'create', 'customer_id': None,
+                     'payload': Customer(firstname="Sarah").serialize()})
+        outcomes = Customer.apply_jobs(jobs)
+        self.assertEqual([outcome[0] for outcome in outcomes], ['0', '1', '2'])
+        self.assertEqual([outcome[2] for outcome in outcomes], [None, None, None])
+        self.assertEqual(Customer.find(customer.id).firstname, "Jon")
+
+    def test_index_failure_keeps_write(self):
+        """ A write succeeds even when an in-memory index can't take it """
+        self.addCleanup(setattr, Customer, 'zip_index', Customer.zip_index)
+        Customer.zip_index = ZipIndex(enabled=True)
+        Customer.zip_index.build([])
+        customer = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                            subscribed=False, address1="123 Main St", address2="1B",
+                            city="New York", country="USA", province="NY", zip="12310")
+        with patch('service.geo.normalize_zip', side_effect=ValueError('bad zip')):
+            customer.save()
+        self.assertIsNotNone(customer.id)
+        self.assertFalse(Customer.zip_index.built)
+
     def test_find_by_first_name(self):
         """ Find a Customer by First Name """
         Customer(firstname="John", lastname="Doe", email="fake1@email.com",
@@ -501,6 +620,221 @@ class TestCustomers(unittest.TestCase):
         self.assertEqual(customers[0].country, "USA")
         self.assertEqual(customers[0].zip, "12310")
 
+    def test_find_many_customers(self):
+        """ Find many Customers by ID in one request """
+        john = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                        subscribed=False, address1="123 Main St", address2="1B",
+                        city="New York", country="USA", province="NY", zip="12310")
+        john.save()
+        sarah = Customer(firstname="Sarah", lastname="Sally", email="fake2@email.com",
+                         subscribed=False, address1="124 Main St", address2="1E",
+                         city="New York", country="USA", province="NY", zip="12310")
+        sarah.save()
+        customers, missing = Customer.find_many([john.id, 'nobody', sarah.id])
+        self.assertEqual(len(customers), 2)
+        self.assertEqual(sorted(customer.id for customer in customers),
+                         sorted([john.id, sarah.id]))
+        self.assertEqual(missing, ['nobody'])
+
+    def test_find_many_deleted_customer(self):
+        """ Find many reports deleted Customers as missing """
+        customer = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                            subscribed=False, address1="123 Main St", address2="1B",
+                            city="New York", country="USA", province="NY", zip="12310")
+        customer.save()
+        customer.delete()
+        customers, missing = Customer.find_many([customer.id])
+        self.assertEqual(customers, [])
+        self.assertEqual(missing, [customer.id])
+
+    def test_find_many_too_many_ids(self):
+        """ Find many with more ids than allowed """
+        ids = [str(i) for i in range(MAX_LOOKUP_IDS + 1)]
+        self.assertRaises(DataValidationError, Customer.find_many, ids)
+
+    def test_page_customers(self):
+        """ List the Customers a page at a time """
+        documents = []
+        for number in range(5):
+            document = Customer(firstname="John", lastname="Doe",
+                                email="fake{}@email.com".format(number), subscribed=True,
+                                address1="123 Main St", address2="1B", city="New York",
+                                country="USA", province="NY", zip="12310").serialize()
+            document['_id'] = 'c{}'.format(number)
+            documents.append(document)
+        Customer.insert_many(documents)
+        self.assertEqual(Customer.count(), 5)
+        pages = [[customer.id for customer in Customer.page(start, 2)] for start in (0, 2, 4)]
+        self.assertEqual(pages, [['c0', 'c1'], ['c2', 'c3'], ['c4']])
+        self.assertEqual(Customer.page(5, 2), [])
+
+    def test_update_many_by_ids(self):
+        """ Update many Customers by ID """
+        john = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                        subscribed=True, address1="123 Main St", address2="1B",
+                        city="New York", country="USA", province="NY", zip="12310")
+        john.save()
+        sarah = Customer(firstname="Sarah", lastname="Sally", email="fake2@email.com",
+                         subscribed=False, address1="124 Main St", address2="1E",
+                         city="New York", country="USA", province="NY", zip="12310")
+        sarah.save()
+        counts = Customer.update_many({'subscribed': False},
+                                      customer_ids=[john.id, sarah.id, 'nobody'])
+        self.assertEqual(counts['matched'], 2)
+        self.assertEqual(counts['updated'], 1)
+        self.assertEqual(counts['unchanged'], 1)
+        self.assertEqual(Customer.find(john.id).subscribed, False)
+
+    def test_update_many_by_selector(self):
+        """ Update many Customers by selector """
+        Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                 subscribed=True, address1="123 Main St", address2="1B",
+                 city="New York", country="USA", province="NY", zip="12310").save()
+        Customer(firstname="Sarah", lastname="Sally", email="fake2@email.com",
+                 subscribed=True, address1="124 Main St", address2="1E",
+                 city="Miami", country="USA", province="FL", zip="33101").save()
+        counts = Customer.update_many({'address': {'country': 'United States'}},
+                                      selector={'address': {'country': 'USA'}})
+        self.assertEqual(counts['updated'], 2)
+        customers = Customer.find_by_country('United States')
+        self.assertEqual(len(customers), 2)
+        self.assertEqual(customers[0].city in ('New York', 'Miami'), True)
+
+    def test_update_many_bad_changes(self):
+        """ Update many Customers with unknown fields or values of the wrong type """
+        self.assertRaises(DataValidationError, Customer.update_many,
+                          {'password': 'secret'}, customer_ids=['1'])
+        self.assertRaises(DataValidationError, Customer.update_many,
+                          {'address': {'planet': 'Mars'}}, customer_ids=['1'])
+        self.assertRaises(DataValidationError, Customer.update_many,
+                          {'firstname': None}, customer_ids=['1'])
+        self.assertRaises(DataValidationError, Customer.update_many,
+                          {'subscribed': 'yes'}, customer_ids=['1'])
+        self.assertRaises(DataValidationError, Customer.update_many,
+                          {'address': {'zip': 10001}}, customer_ids=['1'])
+
+    def test_update_many_needs_ids_or_selector(self):
+        """ Update many Customers needs exactly one of ids or selector """
+        self.assertRaises(DataValidationError, Customer.update_many,
+                          {'subscribed': False})
+        self.assertRaises(DataValidationError, Customer.update_many,
+                          {'subscribed': False}, customer_ids=['1'],
+                          selector={'email': 'fake1@email.com'})
+        self.assertRaises(DataValidationError, Customer.update_many,
+                          {'subscribed': False}, selector={})
+
+    def test_find_missing_customer_is_cached(self):
+        """ Find a missing Customer twice hits the negative cache """
+        hits = Customer.stats()['lookups']['negative_hits']
+        self.assertIsNone(Customer.find('nobody'))
+        self.assertIsNone(Customer.find('nobody'))
+        stats = Customer.stats()['lookups']
+        self.assertEqual(stats['negative_hits'], hits + 1)
+
+    def test_find_many_uses_negative_cache(self):
+        """ Find many does not ask again for known missing ids """
+        Customer.find('nobody')
+        hits = Customer.stats()['lookups']['negative_hits']
+        customers, missing = Customer.find_many(['nobody'])
+        self.assertEqual(customers, [])
+        self.assertEqual(missing, ['nobody'])
+        self.assertEqual(Customer.stats()['lookups']['negative_hits'], hits + 1)
+
+    def test_find_by_uses_query_cache(self):
+        """ Repeated queries are served from the query cache """
+        self.addCleanup(setattr, Customer, 'query_cache', Customer.query_cache)
+        Customer.query_cache = QueryCache(max_bytes=1024 * 1024, max_age=60)
+        Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                 subscribed=False, address1="123 Main St", address2="1B",
+                 city="New York", country="USA", province="NY", zip="12310").save()
+        self.assertEqual(len(Customer.find_by_country("USA")), 1)
+        self.assertEqual(len(Customer.find_by_country("USA")), 1)
+        self.assertEqual(Customer.query_cache.hits, 1)
+        # a local write that matches the query invalidates it
+        Customer(firstname="Sarah", lastname="Sally", email="fake2@email.com",
+                 subscribed=False, address1="124 Main St", address2="1E",
+                 city="Miami", country="USA", province="FL", zip="33101").save()
+        self.assertEqual(len(Customer.find_by_country("USA")), 2)
+
+    def test_changes_feed_invalidates_query_cache(self):
+        """ Writes made by other workers invalidate the query cache """
+        self.addCleanup(setattr, Customer, 'query_cache', Customer.query_cache)
+        Customer.query_cache = QueryCache(max_bytes=1024 * 1024, max_age=60)
+        Customer.follow_changes()
+        self.addCleanup(Customer.follower.stop)
+        while not Customer.follower.connected:
+            time.sleep(0.01)
+        self.assertEqual(Customer.find_by_country("USA"), [])
+        # write behind the back of the model like another worker would
+        Customer.database.create_document(Customer(
+            firstname="John", lastname="Doe", email="fake1@email.com",
+            subscribed=False, address1="123 Main St", address2="1B",
+            city="New York", country="USA", province="NY", zip="12310").serialize())
+        for _ in range(500):
+            if Customer.query_cache.invalidations:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(Customer.find_by_country("USA")), 1)
+
+    def test_changes_feed_forgets_missing_ids(self):
+        """ A customer created by another worker is no longer reported missing """
+        customer = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                            subscribed=False, address1="123 Main St", address2="1B",
+                            city="New York", country="USA", province="NY", zip="12310")
+        self.assertIsNone(Customer.find('imported-1'))
+        self.assertIn('imported-1', Customer.missing_ids)
+        document = customer.serialize()
+        document['_id'] = 'imported-1'
+        Customer.database.create_document(document)
+        Customer._on_change({'id': 'imported-1', 'seq': '1', 'doc': document})
+        self.assertNotIn('imported-1', Customer.missing_ids)
+        self.assertEqual(Customer.find('imported-1').firstname, 'John')
+
+    def test_delta_since(self):
+        """ Find the Customers changed since a sequence token """
+        since = Customer.delta('now')['since']
+        john = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                        subscribed=False, address1="123 Main St", address2="1B",
+                        city="New York", country="USA", province="NY", zip="12310")
+        john.save()
+        sarah = Customer(firstname="Sarah", lastname="Sally", email="fake2@email.com",
+                         subscribed=False, address1="124 Main St", address2="1E",
+                         city="New York", country="USA", province="NY", zip="12310")
+        sarah.save()
+        sarah.delete()
+        delta = Customer.delta(since)
+        self.assertEqual([customer['_id'] for customer in delta['customers']], [john.id])
+        self.assertEqual(delta['deleted'], [sarah.id])
+        self.assertFalse(delta['more'])
+        # nothing changed since the new token
+        delta = Customer.delta(delta['since'])
+        self.assertEqual(delta['customers'], [])
+        self.assertEqual(delta['deleted'], [])
+
+    def test_delta_invalid_since(self):
+        """ An invalid sequence token is refused without retrying """
+        self.assertRaises(DataValidationError, Customer.delta, 'garbage')
+        refused = MagicMock(status_code=500)
+        refused.json.return_value = {'error': 'unknown_error', 'reason': 'badarg'}
+        with patch.object(Customer.database.r_session, 'get', return_value=refused) as get:
+            self.assertRaises(DataValidationError, Customer.delta, '42-unknown')
+        self.assertEqual(get.call_count, 1)
+
+    def test_batched_writes(self):
+        """ Create and update Customers through the write coalescer """
+        self.addCleanup(setattr, Customer, 'writer', Customer.writer)
+        Customer.writer = WriteCoalescer(lambda documents: Customer.database.bulk_docs(documents),
+                                         window=0.005)
+        customer = Customer(firstname="John", lastname="Doe", email="fake1@email.com",
+                            subscribed=False, address1="123 Main St", address2="1B",
+                            city="New York", country="USA", province="NY", zip="12310")
+        customer.save()
+        self.assertIsNotNone(customer.id)
+        customer.firstname = "Isabel"
+        customer.save()
+        self.assertEqual(Customer.find(customer.id).firstname, "Isabel")
+        self.assertEqual(Customer.writer.stats()['writes'], 2)
+
     @patch('cloudant.database.CloudantDatabase.create_document')
     def test_http_error(self, bad_mock):
         """ Test a Bad Create with HTTP error """
@@ -0,0 +1,110 @@
+"""
+Test cases for the Duplicate Customer Detection job
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import io
+import json
+import unittest
+from service.commands.dedup import DuplicateFinder, UnionFind, blocking_keys, \
+    compact_record, normalize_email, normalize_text, similarity, soundex
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+def make_document(customer_id, firstname, lastname, email, address1, city, zip):
+    """ Creates a Customer document as it is stored in the database """
+    return {'_id': customer_id, 'firstname': firstname, 'lastname': lastname,
+            'email': email, 'subscribed': True,
+            'address': {'address1': address1, 'address2': '', 'city': city,
+                        'province': 'NY', 'country': 'USA', 'zip': zip}}
+
+
+class TestDedup(unittest.TestCase):
+    """ Test Cases for finding duplicate Customers """
+
+    def test_normalize(self):
+        """ Normalize names and emails """
+        self.assertEqual(normalize_text(u'  Jöhn-Paul  O\'Neil '), 'john paul o neil')
+        self.assertEqual(normalize_text(None), '')
+        self.assertEqual(normalize_text(12310), '12310')
+        self.assertEqual(normalize_text(0), '0')
+        self.assertEqual(normalize_email(12310), '')
+        self.assertEqual(normalize_email('John.Doe+news@Email.com'), 'john.doe@email.com')
+        self.assertEqual(normalize_email('not an email'), '')
+
+    def test_soundex(self):
+        """ Encode names by how they sound """
+        self.assertEqual(soundex('Robert'), 'R163')
+        self.assertEqual(soundex('Rupert'), 'R163')
+        self.assertEqual(soundex('Ashcraft'), 'A261')
+        self.assertEqual(soundex('Tymczak'), 'T522')
+        self.assertEqual(soundex('Pfister'), 'P236')
+        self.assertEqual(soundex(''), '')
+
+    def test_blocking_keys(self):
+        """ Put a customer in the blocks of its email, zip and names """
+        record = compact_record(make_document('1', 'John', 'Doe', 'jd@email.com',
+                                              '123 Main St', 'New York', '12310'))
+        self.assertEqual(blocking_keys(record),
+                         ['email:jd@email.com', 'zip:12310|doe', 'sound:J500D000|new york'])
+
+    def test_similarity(self):
+        """ Score likely duplicates higher than different customers """
+        john = compact_record(make_document('1', 'John', 'Doe', 'jd@email.com',
+                                            '123 Main St', 'New York', '12310'))
+        jon = compact_record(make_document('2', 'Jon', 'Doe', 'jon@email.com',
+                                           '123 Main Street', 'New York', '12310'))
+        jane = compact_record(make_document('3', 'Jane', 'Dow', 'jane@email.com',
+                                            '9 Elm St', 'New York', '12310'))
+        self.assertGreater(similarity(john, jon), 0.75)
+        self.assertLess(similarity(john, jane), 0.75)
+        jon['email'] = john['email']
+        self.assertEqual(similarity(john, jon), 1.0)
+
+    def test_union_find(self):
+        """ Merge matching pairs into clusters """
+        clusters = UnionFind()
+        clusters.union('a', 'b')
+        clusters.union('c', 'd')
+        clusters.union('b', 'd')
+        self.assertEqual(len(set(clusters.find(item) for item in 'abcd')), 1)
+        self.assertNotEqual(clusters.find('e'), clusters.find('a'))
+
+    def test_find_duplicates(self):
+        """ Report clusters of duplicate customers """
+        documents = [
+            make_document('1', 'John', 'Doe', 'jd@email.com', '123 Main St', 'New York', '12310'),
+            make_document('2', 'Jon', 'Doe', 'jon@email.com', '123 Main Street', 'New York', '12310'),
+            make_document('3', 'Johnny', 'Doe', 'JD+shop@email.com', '5 Oak Ave', 'Boston', '02101'),
+            make_document('4', 'Sarah', 'Sally', 'ss@email.com', '124 Main St', 'New York', '12310'),
+        ]
+        report = io.StringIO()
+        stats = DuplicateFinder(partitions=4).run(iter(documents), report)
+        clusters = [json.loads(line) for line in report.getvalue().splitlines()]
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0]['ids'], ['1', '2', '3'])
+        self.assertEqual(stats['customers'], 4)
+        self.assertEqual(stats['duplicates'], 2)
+
+    def test_skip_large_blocks(self):
+        """ Skip blocks with more customers than allowed """
+        documents = [make_document(str(i), 'Name{}'.format(i), 'Last{}'.format(i),
+                                   'same@email.com', '{} Road'.format(i), 'City{}'.format(i), str(i))
+                     for i in range(5)]
+        report = io.StringIO()
+        stats = DuplicateFinder(partitions=2, max_block=3).run(documents, report)
+        self.assertEqual(report.getvalue(), '')
+        self.assertEqual(stats['skipped_blocks'], 1)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Test cases for the Columnar Customer Exports
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import io
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+from service import export
+from service.export import EXPORT_COLUMNS, ColumnStats, column_batches, counted, csv_chunks, \
+    write_parquet
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+def make_document(customer_id, country, subscribed=True):
+    """ Creates a Customer document as it is stored in the database """
+    return {'_id': customer_id, 'firstname': u'Jos\xe9', 'lastname': 'Doe',
+            'email': 'jd@email.com', 'subscribed': subscribed,
+            'address': {'address1': '1 Main St, Apt 2', 'address2': '', 'city': 'City',
+                        'province': 'NY', 'country': country, 'zip': '10001'}}
+
+
+class TestExport(unittest.TestCase):
+    """ Test Cases for the columnar exports """
+
+    def setUp(self):
+        self.documents = [make_document('1', 'USA'), make_document('2', 'USA', False),
+                          make_document('3', 'Canada'), {'_id': '4'}]
+        self.documents[2]['address']['zip'] = 10001     # as some clients send it
+
+    def test_column_batches(self):
+        """ Group documents into batches of columns """
+        batches = list(column_batches(iter(self.documents), batch_size=3))
+        self.assertEqual([len(columns['_id']) for columns in batches], [3, 1])
+        self.assertEqual(sorted(batches[0]), sorted(EXPORT_COLUMNS))
+        self.assertEqual(batches[0]['country'], ['USA', 'USA', 'Canada'])
+        self.assertEqual(batches[1]['subscribed'], [False])
+        self.assertEqual(batches[1]['city'], [''])
+
+    def test_stats(self):
+        """ Summarize the columns of every batch """
+        stats = ColumnStats()
+        list(counted(column_batches(iter(self.documents), batch_size=2), stats))
+        summary = stats.summary()
+        self.assertEqual(summary['customers'], 4)
+        self.assertEqual(summary['subscribed'], 2)
+        self.assertEqual(summary['subscription_rate'], 0.5)
+        self.assertEqual(summary['by_country'], {'USA': 2, 'Canada': 1, '': 1})
+        self.assertEqual(ColumnStats().summary()['subscription_rate'], 0.0)
+
+    def test_stats_without_pyarrow(self):
+        """ Summarize the columns in Python when pyarrow isn't installed """
+        expected = ColumnStats()
+        list(counted(column_batches(iter(self.documents), batch_size=2), expected))
+        self.addCleanup(setattr, export, '_pyarrow', export._pyarrow)
+        export._pyarrow = [None]
+        stats = ColumnStats()
+        list(counted(column_batches(iter(self.documents), batch_size=2), stats))
+        self.assertEqual(stats.summary(), expected.summary())
+
+    def test_csv(self):
+        """ Write the batches as CSV with a header line """
+        text = ''.join(csv_chunks(column_batches(iter(self.documents), batch_size=2)))
+        rows = list(csv.reader(io.StringIO(text if isinstance(text, type(u'')) else
+                                           text.decode('utf-8'))))
+        self.assertEqual(rows[0], list(EXPORT_COLUMNS))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[1][EXPORT_COLUMNS.index('address1')], '1 Main St, Apt 2')
+        self.assertEqual(rows[1][EXPORT_COLUMNS.index('firstname')], u'Jos\xe9')
+
+    @unittest.skipIf(export.load_pyarrow() is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        """ Write the batches as Parquet row groups with dictionary columns """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'customers.parquet')
+        stats = ColumnStats()
+        write_parquet(column_batches(iter(self.documents), batch_size=2), path, stats)
+        pyarrow = export.load_pyarrow()
+        parquet = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        table = parquet.read()
+        self.assertEqual(table.num_rows, 4)
+        self.assertTrue(pyarrow.types.is_dictionary(table.schema.field('country').type))
+        self.assertEqual(table.column('_id').to_pylist(), ['1', '2', '3', '4'])
+        self.assertEqual(table.column('subscribed').to_pylist(), [True, False, True, False])
+        self.assertEqual(table.column('zip').to_pylist(), ['10001', '10001', '10001', ''])
+        expected = ColumnStats()
+        list(counted(column_batches(iter(self.documents)), expected))
+        self.assertEqual(stats.summary(), expected.summary())
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
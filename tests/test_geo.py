@@ -0,0 +1,108 @@
+"""
+Test cases for the Zip Code Proximity Index
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from service.geo import ZipIndex, haversine_miles, load_centroids, normalize_zip
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+def make_document(customer_id, zip_code):
+    """ Creates a Customer document as it is stored in the database """
+    return {'_id': customer_id, 'firstname': 'John', 'lastname': 'Doe',
+            'email': 'jd@email.com', 'subscribed': True,
+            'address': {'address1': '1 Main St', 'address2': '', 'city': 'City',
+                        'province': 'NY', 'country': 'USA', 'zip': zip_code}}
+
+
+class TestZipIndex(unittest.TestCase):
+    """ Test Cases for the ZipIndex """
+
+    def setUp(self):
+        self.index = ZipIndex(enabled=True)
+        self.index.build([
+            make_document('manhattan', '10001'),
+            make_document('brooklyn', '11201-1234'),
+            make_document('hoboken', '07030'),
+            make_document('boston', '02108'),
+            make_document('nowhere', 'ABC'),
+            make_document('numeric', 2108),
+        ])
+
+    def test_normalize_zip(self):
+        """ Keep the five digits of a zip code """
+        self.assertEqual(normalize_zip('12345-6789'), '12345')
+        self.assertEqual(normalize_zip(' 02108 '), '02108')
+        self.assertEqual(normalize_zip('123'), '')
+        self.assertEqual(normalize_zip(None), '')
+        self.assertEqual(normalize_zip(10001), '10001')
+
+    def test_haversine(self):
+        """ Measure the distance between New York and Boston """
+        miles = haversine_miles(self.index.locate('10001'), self.index.locate('02108'))
+        self.assertAlmostEqual(miles, 190, delta=5)
+
+    def test_nearby(self):
+        """ Find the Customers within a radius, closest first """
+        matches = self.index.nearby('10001', 10)
+        self.assertEqual([customer_id for customer_id, _ in matches],
+                         ['manhattan', 'hoboken', 'brooklyn'])
+        self.assertEqual(matches[0][1], 0)
+        self.assertEqual(len(self.index.nearby('10001', 250)), 4)
+        self.assertIsNone(self.index.nearby('00000', 10))
+
+    def test_update(self):
+        """ Follow Customers that move or are deleted """
+        self.index.update('boston', make_document('boston', '10003'))
+        self.assertIn('boston', [customer_id for customer_id, _ in self.index.nearby('10001', 5)])
+        self.index.update('boston')
+        self.index.update('manhattan')
+        self.assertEqual(self.index.nearby('10001', 1), [])
+        self.assertEqual(self.index.stats()['customers'], 2)
+
+    def test_updates_during_build(self):
+        """ Update and search while the index is built, then replay the updates """
+        index = ZipIndex(enabled=True)
+
+        def change_meanwhile():
+            index.update('manhattan', make_document('manhattan', '02108'))
+            index.nearby('10001', 5)
+
+        def documents():
+            yield make_document('manhattan', '10001')
+            thread = threading.Thread(target=change_meanwhile)
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+        index.build(documents())
+        self.assertEqual(index.nearby('10001', 5), [])
+        self.assertEqual(index.nearby('02108', 5), [('manhattan', 0)])
+
+    def test_gazetteer_file(self):
+        """ Read the centroids from a Census Gazetteer file """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'zcta.txt')
+        with open(path, 'w') as table:
+            table.write('GEOID\tALAND\tAWATER\tINTPTLAT\tINTPTLONG        \n')
+            table.write('00601\t166836392\t798613\t18.180555\t-66.749961\n')
+        self.assertEqual(load_centroids(path), {'00601': (18.180555, -66.749961)})
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
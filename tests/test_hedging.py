@@ -0,0 +1,95 @@
+"""
+Test cases for Hedged Reads
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import time
+import threading
+import unittest
+from service.hedging import Hedger, MIN_SAMPLES
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestHedger(unittest.TestCase):
+    """ Test Cases for hedging slow reads """
+
+    def _warm_up(self, hedger, kind='find'):
+        """ Makes enough quick reads for the reads of a kind to be hedged """
+        for _ in range(MIN_SAMPLES):
+            hedger.call(kind, lambda: None)
+
+    def test_disabled(self):
+        """ Reads are made once in the calling thread when hedging is off """
+        hedger = Hedger(enabled=False)
+        self.assertEqual(hedger.call('find', threading.current_thread), threading.current_thread())
+        self.assertEqual(hedger.stats()['calls'], 0)
+
+    def test_no_delay_without_samples(self):
+        """ Reads aren't hedged before their usual latency is known """
+        hedger = Hedger(enabled=True, max_ratio=1)
+        self.assertIsNone(hedger.delay('find'))
+        self._warm_up(hedger)
+        self.assertEqual(hedger.delay('find'), hedger.min_delay)
+        self.assertIsNone(hedger.delay('find_many'))
+        self.assertEqual(hedger.hedged, 0)
+
+    def test_hedge_wins(self):
+        """ A slow read is sent again and the quicker answer is returned """
+        hedger = Hedger(enabled=True, min_delay=0.01, max_ratio=1)
+        self._warm_up(hedger)
+        attempts = []
+
+        def read(customer_id):
+            attempts.append(customer_id)
+            if len(attempts) == 1:
+                time.sleep(0.5)
+                return 'slow'
+            return 'quick'
+
+        start = time.time()
+        self.assertEqual(hedger.call('find', read, 'c1'), 'quick')
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(attempts, ['c1', 'c1'])
+        stats = hedger.stats()
+        self.assertEqual((stats['hedged'], stats['won']), (1, 1))
+
+    def test_first_error_hedge_succeeds(self):
+        """ A hedge answering makes up for a first attempt that failed """
+        hedger = Hedger(enabled=True, min_delay=0.01, max_ratio=1)
+        self._warm_up(hedger)
+        attempts = []
+
+        def read():
+            attempts.append(1)
+            if len(attempts) == 1:
+                time.sleep(0.05)
+                raise IOError('connection reset')
+            time.sleep(0.1)
+            return 'answer'
+
+        self.assertEqual(hedger.call('find', read), 'answer')
+
+    def test_every_attempt_fails(self):
+        """ The error is raised when no attempt succeeds """
+        hedger = Hedger(enabled=True)
+
+        def read():
+            raise KeyError('c1')
+
+        self.assertRaises(KeyError, hedger.call, 'find', read)
+
+    def test_ratio_cap(self):
+        """ Only a share of the reads are hedged """
+        hedger = Hedger(enabled=True, percentile=0.5, min_delay=0.001, max_ratio=0.1)
+        for _ in range(100):
+            hedger.call('find', lambda: None)
+        for _ in range(20):
+            hedger.call('find', time.sleep, 0.02)
+        self.assertEqual(hedger.calls, 120)
+        self.assertEqual(hedger.hedged, 12)
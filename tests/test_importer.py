@@ -0,0 +1,134 @@
+"""
+Test cases for the Customer Import
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import io
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from service.models import DataValidationError
+from service.commands.importer import Importer, read_records, to_document
+
+CSV_HEADER = 'firstname,lastname,email,subscribed,address1,address2,city,province,country,zip\n'
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+def make_row(number):
+    """ Returns a CSV row of a Customer """
+    return 'First{0},Last{0},c{0}@email.com,true,{0} Main St,,City,NY,USA,10001\n'.format(number)
+
+
+class FakeDatabase(object):
+    """ Stores the documents written by an import, failing on request """
+
+    def __init__(self, fail_on_batch=None):
+        self.documents = {}
+        self.batches = 0
+        self.fail_on_batch = fail_on_batch
+        self.lock = threading.Lock()
+
+    def write(self, documents):
+        """ Stores documents as _bulk_docs would, with conflicts for known ids """
+        with self.lock:
+            self.batches += 1
+            if self.batches == self.fail_on_batch:
+                raise IOError('database went away')
+            errors = []
+            for document in documents:
+                if document['_id'] in self.documents:
+                    errors.append('conflict')
+                else:
+                    self.documents[document['_id']] = document
+                    errors.append(None)
+            return errors
+
+
+class TestImporter(unittest.TestCase):
+    """ Test Cases for importing Customers """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.checkpoint = os.path.join(self.directory, 'checkpoint')
+
+    def _records(self, count):
+        """ Returns the records of a CSV file with count rows """
+        text = CSV_HEADER + ''.join(make_row(number) for number in range(count))
+        return read_records(io.StringIO(text), 'csv')
+
+    def test_to_document(self):
+        """ Validate a CSV row and nest its address """
+        row = next(self._records(1))[1]
+        document = to_document(row, lambda: 'new-id')
+        self.assertEqual(document['_id'], 'new-id')
+        self.assertEqual(document['address']['city'], 'City')
+        self.assertEqual(document['subscribed'], True)
+        line = json.dumps({'_id': 'mine', 'firstname': 'Jo', 'lastname': 'Doe', 'email': 'jo@x.com',
+                           'subscribed': False, 'address': document['address']})
+        self.assertEqual(to_document(line, lambda: 'new-id')['_id'], 'mine')
+
+    def test_invalid_rows(self):
+        """ Reject rows that aren't valid Customers """
+        row = next(self._records(1))[1]
+        for bad in ('{not json', '[1, 2]', json.dumps({'firstname': 'Jo'}),
+                    dict(row, subscribed='maybe'), dict(row, firstname='')):
+            self.assertRaises(DataValidationError, to_document, bad, lambda: 'id')
+
+    def test_ndjson_records(self):
+        """ Read the lines of an NDJSON file, skipping blank ones """
+        records = list(read_records(io.StringIO(u'{"a": 1}\n\n{"b": 2}\n'), 'ndjson'))
+        self.assertEqual([number for number, _ in records], [1, 3])
+
+    def test_import(self):
+        """ Import rows in batches, rejecting the invalid ones """
+        database = FakeDatabase()
+        rejects = io.StringIO()
+        text = CSV_HEADER + make_row(0) + 'Bad,Row\n' + make_row(2)
+        stats = Importer(database.write, batch_size=1, workers=2, rejects=rejects) \
+            .run(read_records(io.StringIO(text), 'csv'))
+        self.assertEqual(stats['rows'], 3)
+        self.assertEqual(stats['imported'], 2)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(len(database.documents), 2)
+        self.assertEqual(json.loads(rejects.getvalue())['row'], 2)
+
+    def test_resume(self):
+        """ Continue an interrupted import from its checkpoint """
+        database = FakeDatabase(fail_on_batch=4)
+        importer = Importer(database.write, batch_size=10, workers=2, checkpoint=self.checkpoint)
+        self.assertRaises(IOError, importer.run, self._records(100))
+        with open(self.checkpoint) as saved:
+            done = json.load(saved)['row']
+        self.assertEqual(done, 30)
+
+        database.fail_on_batch = None
+        stats = Importer(database.write, batch_size=10, workers=2, checkpoint=self.checkpoint) \
+            .run(self._records(100))
+        self.assertEqual(stats['skipped'], done)
+        self.assertEqual(stats['imported'] + stats['existing'], 100 - done)
+        self.assertEqual(len(database.documents), 100)
+
+    def test_import_twice(self):
+        """ Rows imported again are found to exist instead of being stored twice """
+        database = FakeDatabase()
+        Importer(database.write, batch_size=7).run(self._records(20))
+        stats = Importer(database.write, batch_size=7).run(self._records(20))
+        self.assertEqual(stats['existing'], 20)
+        self.assertEqual(len(database.documents), 20)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
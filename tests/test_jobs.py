@@ -0,0 +1,125 @@
+"""
+Test cases for the Write-behind Job Queue
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from service.jobs import JobQueue, QueueFullError
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestJobQueue(unittest.TestCase):
+    """ Test Cases for JobQueue """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.queue = JobQueue(os.path.join(self.folder, 'jobs.db'), max_pending=3,
+                              batch_size=2, poll_interval=0.01)
+
+    def tearDown(self):
+        self.queue.stop()
+        shutil.rmtree(self.folder)
+
+    def test_enqueue_and_get(self):
+        """ Queue a job and read it back """
+        job = self.queue.enqueue('create', {'firstname': 'John'})
+        self.assertEqual(job['status'], 'queued')
+        stored = self.queue.get(job['id'])
+        self.assertEqual(stored['action'], 'create')
+        self.assertEqual(stored['status'], 'queued')
+        self.assertIsNone(self.queue.get('nobody'))
+
+    def test_queue_is_bounded(self):
+        """ Jobs are refused when the queue is full """
+        for _ in range(3):
+            self.queue.enqueue('create', {'firstname': 'John'})
+        self.assertRaises(QueueFullError, self.queue.enqueue, 'create', {'firstname': 'John'})
+        self.assertEqual(self.queue.stats(), {'queued': 3})
+
+    def test_claim_and_finish(self):
+        """ Claim jobs in batches and record their outcome """
+        first = self.queue.enqueue('create', {'firstname': 'John'})
+        second = self.queue.enqueue('update', {'firstname': 'Sarah'}, '42')
+        self.queue.enqueue('create', {'firstname': 'Isabel'})
+        jobs = self.queue.claim()
+        self.assertEqual([job['id'] for job in jobs], [first['id'], second['id']])
+        self.assertEqual(jobs[1]['payload'], {'firstname': 'Sarah'})
+        self.assertEqual(self.queue.get(first['id'])['status'], 'running')
+        self.queue.finish([(first['id'], '1', None), (second['id'], '42', 'not found')])
+        self.assertEqual(self.queue.get(first['id'])['customer_id'], '1')
+        self.assertEqual(self.queue.get(second['id'])['status'], 'failed')
+        self.assertEqual(len(self.queue.claim()), 1)
+
+    def test_expired_leases_are_claimed_again(self):
+        """ Jobs left running are handed out again after their lease """
+        self.queue.lease = 0
+        job = self.queue.enqueue('create', {'firstname': 'John'})
+        self.queue.claim()
+        time.sleep(0.01)
+        self.assertEqual([claimed['id'] for claimed in self.queue.claim()], [job['id']])
+
+    def test_background_worker(self):
+        """ The background thread applies queued jobs """
+        applied = []
+
+        def apply_jobs(jobs):
+            applied.extend(jobs)
+            return [(job['id'], 'new', None) for job in jobs]
+
+        job = self.queue.enqueue('create', {'firstname': 'John'})
+        self.queue.start(apply_jobs)
+        for _ in range(200):
+            if self.queue.get(job['id'])['status'] == 'done':
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.queue.get(job['id'])['status'], 'done')
+        self.assertEqual(len(applied), 1)
+
+    def test_crashed_batch_fails(self):
+        """ The jobs of a batch that crashes are failed instead of left running """
+
+        def apply_jobs(jobs):
+            raise IOError('connection reset')
+
+        job = self.queue.enqueue('create', {'firstname': 'John'})
+        self.queue.start(apply_jobs)
+        for _ in range(200):
+            if self.queue.get(job['id'])['status'] == 'failed':
+                break
+            time.sleep(0.01)
+        stored = self.queue.get(job['id'])
+        self.assertEqual(stored['status'], 'failed')
+        self.assertIn('connection reset', stored['error'])
+
+    def test_purge_finished_jobs(self):
+        """ Finished jobs are purged after the retention period """
+        self.queue.retention = 0
+        done = self.queue.enqueue('create', {'firstname': 'John'})
+        queued = self.queue.enqueue('create', {'firstname': 'Sarah'})
+        self.queue.claim()
+        self.queue.finish([(done['id'], '1', None)])
+        time.sleep(0.01)
+        self.assertEqual(self.queue.purge(), 1)
+        self.assertIsNone(self.queue.get(done['id']))
+        self.assertEqual(self.queue.get(queued['id'])['status'], 'running')
+
+    def test_disabled(self):
+        """ A queue without a file is disabled """
+        self.assertFalse(JobQueue('').enabled)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Test cases for Queued Logging
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import io
+import json
+import logging
+import threading
+import unittest
+from mock import patch
+from service import logs
+from service.logs import JsonFormatter, SamplingFilter, QueuedHandler, queued_handlers
+
+
+class BlockingHandler(logging.Handler):
+    """ A handler that collects records once it is released """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.released = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.released.wait()
+        self.records.append(record)
+
+
+def _logger(name, handler):
+    """ Returns a logger writing only to handler """
+    logger = logging.getLogger('tests.logs.' + name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestQueuedLogging(unittest.TestCase):
+    """ Test Cases for logging from a background thread """
+
+    def test_json_format(self):
+        """ Records are formatted as one JSON object """
+        record = logging.LogRecord('service', logging.INFO, __file__, 1,
+                                   'Customer [%s] saved', ('c1',), None)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry['message'], 'Customer [c1] saved')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'service')
+        self.assertTrue(entry['time'].endswith('Z'))
+
+    def test_sampling(self):
+        """ A share of the sampled levels is kept, every record of the others """
+        sampler = SamplingFilter({logging.INFO: 0.25, logging.DEBUG: 1})
+        self.assertEqual(list(sampler.shares), [logging.INFO])
+        info = logging.LogRecord('service', logging.INFO, __file__, 1, 'info', None, None)
+        error = logging.LogRecord('service', logging.ERROR, __file__, 1, 'error', None, None)
+        self.assertEqual(sum(sampler.filter(info) for _ in range(100)), 25)
+        self.assertTrue(all(sampler.filter(error) for _ in range(10)))
+
+    def test_written_in_background(self):
+        """ Records are written by another thread with the arguments they were logged with """
+        output = io.StringIO()
+        target = logging.StreamHandler(output)
+        target.setFormatter(JsonFormatter())
+        handler = QueuedHandler([target])
+        logger = _logger('background', handler)
+        customer = {'id': 'c1'}
+        logger.info('Saved %s', customer)
+        customer['id'] = 'c2'
+        try:
+            raise ValueError('bad zip')
+        except ValueError:
+            logger.exception('Failed')
+        handler.close()
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(lines[0]['message'], "Saved {'id': 'c1'}")
+        self.assertIn('ValueError: bad zip', lines[1]['exception'])
+
+    def test_full_queue_drops(self):
+        """ Records are dropped instead of waiting when the writer falls behind """
+        target = BlockingHandler()
+        handler = QueuedHandler([target], size=2)
+        logger = _logger('full', handler)
+        for number in range(10):
+            logger.info('record %s', number)
+        self.assertGreaterEqual(handler.dropped, 7)
+        self.assertEqual(logs.stats(logger)['dropped'], handler.dropped)
+        target.released.set()
+        handler.close()
+        self.assertEqual(len(target.records) + handler.dropped, 10)
+        self.assertEqual(handler.waiting(), 0)
+
+    def test_queued_handlers(self):
+        """ The gunicorn handlers are wrapped in a queue """
+        target = logging.StreamHandler(io.StringIO())
+        handlers = queued_handlers([target])
+        self.assertIsInstance(handlers[0], QueuedHandler)
+        self.assertEqual(handlers[0].handlers, [target])
+        self.assertEqual(queued_handlers([]), [])
+        with patch.object(logs, 'LOG_QUEUE_SIZE', 0), patch.object(logs, 'LOG_FORMAT', 'json'):
+            self.assertEqual(queued_handlers([target]), [target])
+            self.assertIsInstance(target.formatter, JsonFormatter)
@@ -0,0 +1,132 @@
+"""
+Test cases for the Rate Limiter
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from service.ratelimit import RateLimiter, TokenBucket, forwarded_client
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestTokenBucket(unittest.TestCase):
+    """ Test Cases for the bucket arithmetic """
+
+    def test_refill(self):
+        """ Buckets refill at their rate up to their burst """
+        bucket = TokenBucket(2, 10)
+        self.assertEqual(bucket.wait(None, 0, 1, 0), (10, 0.0))
+        self.assertEqual(bucket.wait(0, 0, 1, 1), (2, 0.0))
+        self.assertEqual(bucket.wait(0, 0, 1, 100), (10, 0.0))
+
+    def test_wait(self):
+        """ Short buckets return the seconds until the cost is back """
+        bucket = TokenBucket(2, 10)
+        self.assertEqual(bucket.wait(0, 0, 4, 0), (0, 2.0))
+        # a cost over the burst waits for a full bucket, not forever
+        self.assertEqual(bucket.wait(0, 0, 50, 0), (0, 5.0))
+
+    def test_burst_at_least_rate(self):
+        """ A bucket holds at least a second of tokens """
+        self.assertEqual(TokenBucket(5, 0).burst, 5)
+
+
+class TestForwardedClient(unittest.TestCase):
+    """ Test Cases for finding the client behind the proxies """
+
+    def test_trusted_entry(self):
+        """ Take the entry appended by the farthest trusted proxy """
+        self.assertEqual(forwarded_client('6.6.6.6, 10.1.2.3', '10.0.0.1', 1), '10.1.2.3')
+        self.assertEqual(forwarded_client('6.6.6.6, 10.1.2.3, 10.0.0.2', '10.0.0.1', 2),
+                         '10.1.2.3')
+
+    def test_connection_address(self):
+        """ Use the address of the connection without enough trusted entries """
+        self.assertEqual(forwarded_client('', '10.0.0.1', 1), '10.0.0.1')
+        self.assertEqual(forwarded_client(None, None, 1), '')
+        self.assertEqual(forwarded_client('10.1.2.3', '10.0.0.1', 2), '10.0.0.1')
+        self.assertEqual(forwarded_client('10.1.2.3', '10.0.0.1', 0), '10.0.0.1')
+
+
+class TestRateLimiter(unittest.TestCase):
+    """ Test Cases for the buckets shared through SQLite """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'buckets.db')
+        self.now = 1000.0
+        clock = patch('service.ratelimit.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_disabled(self):
+        """ Without a file or a limit every request is admitted """
+        self.assertFalse(RateLimiter('').enabled)
+        self.assertFalse(RateLimiter(self.path).enabled)
+        self.assertEqual(RateLimiter('', rate=1).acquire('a', 100), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_global_limit(self):
+        """ Every client draws from the global bucket """
+        limiter = RateLimiter(self.path, rate=1, burst=3)
+        for client in ('a', 'b', 'c'):
+            self.assertEqual(limiter.acquire(client), 0)
+        self.assertEqual(limiter.acquire('d'), 1.0)
+        self.now += 1
+        self.assertEqual(limiter.acquire('d'), 0)
+        self.assertEqual(limiter.stats(), {'enabled': True, 'admitted': 4, 'limited': 1})
+
+    def test_client_limit(self):
+        """ A client that used up its bucket doesn't hold back the others """
+        limiter = RateLimiter(self.path, client_rate=1, client_burst=2)
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.acquire('a'), 1.0)
+        self.assertEqual(limiter.acquire('b'), 0)
+
+    def test_cost(self):
+        """ Expensive requests take more tokens """
+        limiter = RateLimiter(self.path, rate=1, burst=10)
+        self.assertEqual(limiter.acquire('a', 10), 0)
+        self.now += 2
+        self.assertEqual(limiter.acquire('a', 10), 8.0)
+        self.assertEqual(limiter.acquire('a', 1), 0)
+
+    def test_refused_takes_nothing(self):
+        """ Tokens aren't taken from one bucket when the other one is short """
+        limiter = RateLimiter(self.path, rate=1, burst=5, client_rate=1, client_burst=1)
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.acquire('a'), 1.0)
+        for client in ('b', 'c', 'd', 'e'):
+            self.assertEqual(limiter.acquire(client), 0)
+
+    def test_shared_by_processes(self):
+        """ Limiters using the same file share their buckets """
+        worker1 = RateLimiter(self.path, rate=1, burst=2)
+        worker2 = RateLimiter(self.path, rate=1, burst=2)
+        self.assertEqual(worker1.acquire('a'), 0)
+        self.assertEqual(worker2.acquire('a'), 0)
+        self.assertEqual(worker1.acquire('a'), 1.0)
+        self.assertEqual(worker2.acquire('a'), 1.0)
+
+    @patch('service.ratelimit.PRUNE_EVERY', 2)
+    def test_prune_idle_clients(self):
+        """ The buckets of clients that have been idle are removed """
+        limiter = RateLimiter(self.path, client_rate=1, client_burst=2)
+        limiter.acquire('a')
+        self.now += 10
+        limiter.acquire('b')
+        keys = [row[0] for row in limiter._connect().execute('SELECT key FROM buckets')]
+        self.assertEqual(keys, ['client:b'])
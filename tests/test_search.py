@@ -0,0 +1,136 @@
+"""
+Test cases for the Customer Search Index
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import threading
+import unittest
+from service.search import SearchIndex, document_text
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+def make_document(customer_id, firstname, lastname, email, city):
+    """ Creates a Customer document as it is stored in the database """
+    return {'_id': customer_id, 'firstname': firstname, 'lastname': lastname,
+            'email': email, 'subscribed': True,
+            'address': {'address1': '1 Main St', 'address2': '', 'city': city,
+                        'province': 'NY', 'country': 'USA', 'zip': '12310'}}
+
+
+class TestSearchIndex(unittest.TestCase):
+    """ Test Cases for the SearchIndex """
+
+    def setUp(self):
+        self.index = SearchIndex(enabled=True)
+        self.index.build([
+            make_document('1', 'John', 'Doe', 'jdoe@email.com', 'New York'),
+            make_document('2', 'Johnny', 'Smith', 'js@email.com', 'Boston'),
+            make_document('3', 'Sarah', 'Sally', 'sally@email.com', 'New York'),
+            make_document('4', 'Jonathan', 'Doering', 'jd@email.com', 'Miami'),
+        ])
+
+    def test_document_text(self):
+        """ Normalize the searched fields of a document """
+        document = make_document('1', u'Zoë', 'Doe', 'Z.Doe@Email.com', 'New York')
+        self.assertEqual(document_text(document), 'zoe\tdoe\tz doe email com\tnew york')
+
+    def test_exact_match_first(self):
+        """ Rank the Customer whose field equals the query first """
+        results = self.index.search('john')
+        self.assertEqual(results[0][0], '1')
+        self.assertEqual(set(customer_id for customer_id, _ in results[:2]), set(['1', '2']))
+
+    def test_prefix(self):
+        """ Find Customers by the beginning of a word """
+        ids = [customer_id for customer_id, _ in self.index.search('doer')]
+        self.assertEqual(ids[0], '4')
+
+    def test_misspelled(self):
+        """ Find Customers by a misspelled name """
+        ids = [customer_id for customer_id, _ in self.index.search('Sarha Sally')]
+        self.assertEqual(ids[0], '3')
+
+    def test_several_fields(self):
+        """ Match words of different fields """
+        ids = [customer_id for customer_id, _ in self.index.search('doe new york')]
+        self.assertEqual(ids[0], '1')
+
+    def test_no_match(self):
+        """ Return nothing for an unknown or empty query """
+        self.assertEqual(self.index.search('xyzzy'), [])
+        self.assertEqual(self.index.search(' '), [])
+
+    def test_update_and_delete(self):
+        """ Keep the index current with changes """
+        self.index.update('3', make_document('3', 'Sarah', 'Connor', 'sc@email.com', 'LA'))
+        self.assertEqual(self.index.search('sally'), [])
+        self.assertEqual(self.index.search('connor')[0][0], '3')
+        self.index.update('5', make_document('5', 'Kyle', 'Reese', 'kr@email.com', 'LA'))
+        self.assertEqual(self.index.search('reese')[0][0], '5')
+        self.index.update('5')
+        self.assertEqual(self.index.search('reese'), [])
+        self.assertEqual(self.index.stats()['documents'], 4)
+
+    def test_not_built(self):
+        """ Ignore changes until the index is built """
+        index = SearchIndex(enabled=True)
+        index.update('1', make_document('1', 'John', 'Doe', 'jd@email.com', 'Miami'))
+        self.assertEqual(index.stats()['documents'], 0)
+
+    def test_updates_during_build(self):
+        """ Update and search while the index is built, then replay the updates """
+        index = SearchIndex(enabled=True)
+
+        def change_meanwhile():
+            index.update('1', make_document('1', 'John', 'Connor', 'jc@email.com', 'LA'))
+            index.update('2')
+            index.search('john')
+
+        def documents():
+            yield make_document('1', 'John', 'Doe', 'jdoe@email.com', 'New York')
+            yield make_document('2', 'Sarah', 'Sally', 'sally@email.com', 'New York')
+            thread = threading.Thread(target=change_meanwhile)
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+        index.build(documents())
+        self.assertEqual(index.search('connor')[0][0], '1')
+        self.assertEqual(index.search('doe'), [])
+        self.assertEqual(index.search('sally'), [])
+        self.assertEqual(index.stats()['documents'], 1)
+
+    def test_clear_during_build(self):
+        """ A build that was cleared meanwhile is thrown away """
+        index = SearchIndex(enabled=True)
+
+        def documents():
+            yield make_document('1', 'John', 'Doe', 'jdoe@email.com', 'New York')
+            index.clear()
+
+        index.build(documents())
+        self.assertFalse(index.built)
+        self.assertEqual(index.stats()['documents'], 0)
+
+    def test_compaction(self):
+        """ Rebuild the index once it is full of holes """
+        for number in range(1500):
+            self.index.update('1', make_document('1', 'John{}'.format(number), 'Doe',
+                                                 'jdoe@email.com', 'New York'))
+        stats = self.index.stats()
+        self.assertEqual(stats['documents'], 4)
+        self.assertLess(stats['removed'], 1000)
+        self.assertEqual(self.index.search('john1499 doe')[0][0], '1')
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
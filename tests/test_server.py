@@ -5,21 +5,44 @@ Test cases can be run with the following:
 nosetests -v --with-spec --spec-color
 """
 
+import io
+import os
+import gzip
+import time
+import shutil
+import tempfile
 import unittest
 import json
+from mock import MagicMock, patch
+from flask import Response
 from werkzeug.datastructures import MultiDict, ImmutableMultiDict
-from service import app
+from service import create_app
 from .customer_factory import CustomerFactory
-from service.models import Customer
+from .databases import unique_database_name
+from service.models import Customer, RATE_LIMIT_SCAN_COST
+from service.caching import ResponseCache
+from service.jobs import JobQueue
+from service.search import SearchIndex
+from service.geo import ZipIndex
+from service.ratelimit import RateLimiter
+from service.shedding import LoadShedder
+from service.resources.admission import request_cost, admit_request
+from service.resources.changes_stream import ChangesStream
 
 # Status Codes
 HTTP_200_OK = 200
 HTTP_201_CREATED = 201
+HTTP_202_ACCEPTED = 202
 HTTP_204_NO_CONTENT = 204
+HTTP_304_NOT_MODIFIED = 304
 HTTP_400_BAD_REQUEST = 400
 HTTP_404_NOT_FOUND = 404
 HTTP_405_METHOD_NOT_ALLOWED = 405
 HTTP_409_CONFLICT = 409
+HTTP_429_TOO_MANY_REQUESTS = 429
+HTTP_503_SERVICE_UNAVAILABLE = 503
+
+app = create_app({'TESTING': True})
 
 ######################################################################
 #  T E S T   C A S E S
@@ -30,24 +53,21 @@ class TestCustomerServer(unittest.TestCase):
     """ Test Cases for Customer Server """
 
     def setUp(self):
-        """ Initialize the Cloudant database """
+        """ Initialize a Cloudant database of this test's own """
         self.app = app.test_client()
-        Customer.init_db("servertest")
-        Customer.remove_all()
+        Customer.init_db(unique_database_name('servertest'))
+
+    def tearDown(self):
+        """ Drop the database of the test """
+        Customer.drop_db()
 
     def _create_customers(self, count):
         """ Factory method to create customers in bulk """
-        customers = []
-        for _ in range(count):
-            test_customer = CustomerFactory()
-            resp = self.app.post('/customers',
-                                 json=test_customer.serialize(),
-                                 content_type='application/json')
-            self.assertEqual(resp.status_code, HTTP_201_CREATED,
-                             'Could not create test customer')
-            new_customer = resp.get_json()
-            test_customer._id = new_customer['_id']
-            customers.append(test_customer)
+        customers = [CustomerFactory() for _ in range(count)]
+        self.assertEqual(Customer.save_many(customers), [None] * count,
+                         'Could not create test customers')
+        for test_customer in customers:
+            test_customer._id = test_customer.id
         return customers
 
     def test_index(self):
@@ -57,6 +77,38 @@ class TestCustomerServer(unittest.TestCase):
         data = resp.get_json()
         self.assertIn('Customer Demo REST API Service', resp.data)
 
+    def test_home_page_cached(self):
+        """ The Home Page is rendered once and links its assets by hash """
+        resp = self.app.get('/')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+        page = resp.get_data(as_text=True)
+        self.assertIn(app.extensions['assets'].url('js/rest_api_1.js'), page)
+        self.assertNotIn('src="/static/js/rest_api_1.js"', page)
+        resp = self.app.get('/', headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, HTTP_304_NOT_MODIFIED)
+        resp = self.app.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(resp.data)).read().decode('utf-8'),
+                         page)
+
+    def test_static_assets(self):
+        """ Hashed assets are kept for a year, other files checked again """
+        url = app.extensions['assets'].url('js/rest_api_1.js')
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertTrue(resp.mimetype.endswith('javascript'))
+        resp.close()
+        resp = self.app.get('/static/js/rest_api_1.js')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertNotIn('immutable', resp.headers.get('Cache-Control', ''))
+        resp.close()
+        resp = self.app.get('/static/js/missing.js')
+        self.assertEqual(resp.status_code, HTTP_404_NOT_FOUND)
+
     def test_get_customer_list(self):
         """ Get a list of Customers """
         self._create_customers(5)
@@ -65,6 +117,238 @@ class TestCustomerServer(unittest.TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_get_customer_pages(self):
+        """ Get a list of Customers a page at a time """
+        customers = self._create_customers(5)
+        ids = []
+        for start in (0, 2, 4):
+            resp = self.app.get('/customers', query_string={'start': start, 'limit': 2})
+            self.assertEqual(resp.status_code, HTTP_200_OK)
+            self.assertEqual(resp.headers['X-Total-Count'], '5')
+            ids.extend(customer['_id'] for customer in resp.get_json())
+        self.assertEqual(ids, sorted(customer._id for customer in customers))
+        # the matches of a filter are paged too
+        resp = self.app.get('/customers', query_string={'firstname': customers[0].firstname,
+                                                        'limit': 1})
+        self.assertEqual(len(resp.get_json()), 1)
+        self.assertGreaterEqual(int(resp.headers['X-Total-Count']), 1)
+        resp = self.app.get('/customers', query_string='start=-1')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/customers', query_string='limit=0')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_get_customer_delta(self):
+        """ Get the Customers changed since a token page by page """
+        since = self.app.get('/customers', query_string='since=now').get_json()['since']
+        customers = self._create_customers(3)
+        resp = self.app.delete('/customers/{}'.format(customers[0]._id))
+        self.assertEqual(resp.status_code, HTTP_204_NO_CONTENT)
+        resp = self.app.get('/customers', query_string={'since': since, 'limit': 2})
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data['customers']), 2)
+        self.assertTrue(data['more'])
+        resp = self.app.get('/customers', query_string={'since': data['since'], 'limit': 2})
+        data = resp.get_json()
+        self.assertEqual(data['customers'], [])
+        self.assertEqual(data['deleted'], [customers[0]._id])
+
+    def test_get_customer_delta_bad_limit(self):
+        """ Get the Customers changed since a token with a bad limit """
+        resp = self.app.get('/customers', query_string='since=0&limit=zero')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_get_customer_delta_bad_since(self):
+        """ Get the Customers changed since an invalid token """
+        resp = self.app.get('/customers', query_string='since=garbage')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        self.assertIn('garbage', resp.get_json()['message'])
+        resp = self.app.get('/customers/changes', query_string='since=garbage')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    @patch('service.models.UNIQUE_EMAILS', True)
+    def test_create_customer_duplicate_email(self):
+        """ Create a Customer with an email that is taken """
+        test_customer = self._create_customers(1)[0]
+        copy = CustomerFactory()
+        copy.email = test_customer.email.upper()
+        resp = self.app.post('/customers', json=copy.serialize(),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_409_CONFLICT)
+
+    def test_search_customers(self):
+        """ Search Customers by a partial last name """
+        self.addCleanup(setattr, Customer, 'search_index', Customer.search_index)
+        Customer.search_index = SearchIndex(enabled=True)
+        test_customer = self._create_customers(3)[0]
+        resp = self.app.get('/customers/search',
+                            query_string={'q': test_customer.lastname[:4]})
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertIn(test_customer._id, [customer['_id'] for customer in data])
+        self.assertIn('_score', data[0])
+        resp = self.app.get('/customers/search')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_search_disabled(self):
+        """ Search Customers without a search index """
+        resp = self.app.get('/customers/search', query_string='q=john')
+        self.assertEqual(resp.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_export_customers(self):
+        """ Export the Customers as CSV """
+        customers = self._create_customers(3)
+        resp = self.app.get('/customers/export')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.mimetype, 'text/csv')
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertTrue(lines[0].startswith('_id,firstname,lastname,email,subscribed'))
+        self.assertEqual(len(lines), len(customers) + 1)
+
+    def test_customer_summary(self):
+        """ Summarize the Customers """
+        customers = self._create_customers(3)
+        resp = self.app.get('/customers/summary')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data['customers'], len(customers))
+        self.assertEqual(sum(data['by_country'].values()), len(customers))
+
+    def test_customer_snapshot(self):
+        """ Download a snapshot of the Customers and restore it """
+        customers = self._create_customers(3)
+        resp = self.app.get('/customers/snapshot')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.mimetype, 'application/gzip')
+        snapshot = resp.get_data()
+        Customer.remove_all()
+        resp = self.app.put('/customers/snapshot', data=snapshot,
+                            content_type='application/gzip')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.get_json()['imported'], len(customers))
+        resp = self.app.get('/customers/{}'.format(customers[0].id))
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.get_json()['email'], customers[0].email)
+
+    def test_restore_bad_snapshot(self):
+        """ Restore something that isn't a snapshot """
+        customers = self._create_customers(1)
+        resp = self.app.put('/customers/snapshot', data=b'{"firstname": "fido"}',
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(Customer.all()), len(customers))
+
+    def test_rate_limited(self):
+        """ Refuse requests over the rate limit before reading the database """
+        self.addCleanup(setattr, Customer, 'rate_limiter', Customer.rate_limiter)
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, True)
+        Customer.rate_limiter = RateLimiter(os.path.join(workdir, 'buckets.db'),
+                                            client_rate=0.1, client_burst=10)
+        with patch.object(Customer, 'all', wraps=Customer.all) as scan:
+            resp = self.app.get('/customers')
+            self.assertEqual(resp.status_code, HTTP_200_OK)
+            resp = self.app.get('/customers')
+            self.assertEqual(resp.status_code, HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(resp.headers['Retry-After'], '100')
+            self.assertEqual(resp.get_json()['message'], 'Too many requests, try again later')
+            self.assertEqual(scan.call_count, 1)
+        # the metrics aren't limited
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.get_json()['rate_limit']['limited'], 1)
+        # every client has a bucket of its own
+        resp = self.app.get('/customers', headers={'X-Forwarded-For': '10.1.2.3'})
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+
+    def test_rate_limited_response(self):
+        """ The rate limit is answered with a Response that Flask 1.0 accepts from a hook """
+        limiter = MagicMock(enabled=True)
+        limiter.acquire.return_value = 2.5
+        with patch.object(Customer, 'rate_limiter', limiter), \
+                app.test_request_context('/customers/123'):
+            resp = admit_request()
+        self.assertIsInstance(resp, Response)
+        self.assertEqual(resp.status_code, HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(resp.headers['Retry-After'], '3')
+
+    def test_shed_load(self):
+        """ Refuse full listings first while the database is slow """
+        self.addCleanup(setattr, Customer, 'shedder', Customer.shedder)
+        Customer.shedder = LoadShedder(max_latency=0.5, max_in_flight=1)
+        customer = self._create_customers(1)[0]
+        Customer.shedder.observe(2)
+        resp = self.app.get('/customers', buffered=True)
+        self.assertEqual(resp.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', resp.headers)
+        self.assertEqual(resp.get_json()['message'], 'The service is overloaded, try again later')
+        # buffered requests close their response like a server does
+        resp = self.app.get('/customers/{}'.format(customer.id), buffered=True)
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        resp = self.app.get('/customers', query_string={'lastname': customer.lastname},
+                            buffered=True)
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        resp = self.app.get('/metrics')
+        self.assertTrue(resp.get_json()['shedding']['shedding_low_priority'])
+        self.assertEqual(resp.get_json()['shedding']['in_flight'], 0)
+        # a worker serving as many requests as it may refuses any other
+        Customer.shedder.begin()
+        resp = self.app.get('/customers/{}'.format(customer.id))
+        self.assertEqual(resp.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_streamed_request_in_flight(self):
+        """ A streamed export is in flight until its response is closed """
+        self.addCleanup(setattr, Customer, 'shedder', Customer.shedder)
+        Customer.shedder = LoadShedder(max_in_flight=10)
+        self._create_customers(1)
+        resp = self.app.get('/customers/export')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(Customer.shedder.stats()['in_flight'], 1)
+        resp.close()
+        self.assertEqual(Customer.shedder.stats()['in_flight'], 0)
+
+    def test_observe_database_latency(self):
+        """ The latency of every database request is measured """
+        self.addCleanup(setattr, Customer, 'shedder', Customer.shedder)
+        Customer.shedder = LoadShedder()
+        Customer.connect()
+        resp = self.app.get('/customers')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertIsNotNone(Customer.shedder.latency())
+
+    def test_request_cost(self):
+        """ Full scans cost more than lookups """
+        self.assertEqual(request_cost('customercollection', 'GET', {}), RATE_LIMIT_SCAN_COST)
+        self.assertEqual(request_cost('customercollection', 'GET', {'email': 'a@b.com'}), 1)
+        self.assertEqual(request_cost('customercollection', 'GET', {'limit': '100'}), 1)
+        self.assertEqual(request_cost('customercollection', 'POST', {}), 1)
+        self.assertEqual(request_cost('customerresource', 'GET', {}), 1)
+        self.assertEqual(request_cost('customerexport', 'GET', {}), RATE_LIMIT_SCAN_COST)
+        self.assertEqual(request_cost('metrics', 'GET', {}), 0)
+        self.assertEqual(request_cost(None, 'GET', {}), 0)
+
+    def test_nearby_customers(self):
+        """ Find the Customers near a zip code """
+        self.addCleanup(setattr, Customer, 'zip_index', Customer.zip_index)
+        Customer.zip_index = ZipIndex(enabled=True)
+        customers = self._create_customers(2)
+        for customer, zip_code in zip(customers, ['10001', '02108']):
+            customer.zip = zip_code
+            resp = self.app.put('/customers/{}'.format(customer._id),
+                                json=customer.serialize(), content_type='application/json')
+            self.assertEqual(resp.status_code, HTTP_200_OK)
+        resp = self.app.get('/customers/nearby', query_string='zip=07030&radius=25')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([customer['_id'] for customer in data], [customers[0]._id])
+        self.assertGreater(data[0]['_distance'], 0)
+        self.assertEqual(resp.headers['X-Total-Count'], '1')
+        resp = self.app.get('/customers/nearby', query_string='zip=00000')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        for radius in ['nan', 'inf', '-inf', '0', '501']:
+            resp = self.app.get('/customers/nearby', query_string={'zip': '07030', 'radius': radius})
+            self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
     def test_get_customer(self):
         """ Get a single Customer """
         # get the _id of a customer
@@ -386,6 +670,183 @@ class TestCustomerServer(unittest.TestCase):
         for customer in data:
             self.assertEqual(customer['address']['zip'], test_zi)
 
+    def test_lookup_customers(self):
+        """ Lookup many Customers by id """
+        customers = self._create_customers(3)
+        ids = [customer._id for customer in customers]
+        resp = self.app.post('/customers/lookup',
+                             json={'ids': ids + ['nobody']},
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(sorted(customer['_id'] for customer in data['customers']),
+                         sorted(ids))
+        self.assertEqual(data['missing'], ['nobody'])
+
+    def test_lookup_customers_bad_request(self):
+        """ Lookup Customers without a list of ids """
+        resp = self.app.post('/customers/lookup',
+                             json={'ids': 'not a list'},
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_bulk_unsubscribe_customers(self):
+        """ Unsubscribe many Customers by id """
+        customers = self._create_customers(3)
+        ids = [customer._id for customer in customers]
+        resp = self.app.put('/customers/unsubscribe',
+                            json={'ids': ids},
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data['matched'], 3)
+        for customer_id in ids:
+            resp = self.app.get('/customers/{}'.format(customer_id))
+            self.assertEqual(resp.get_json()['subscribed'], False)
+
+    def test_bulk_unsubscribe_bad_request(self):
+        """ Unsubscribe many Customers without ids or selector """
+        resp = self.app.put('/customers/unsubscribe',
+                            json={},
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_customers(self):
+        """ Update many Customers by selector """
+        customers = self._create_customers(5)
+        test_country = customers[0].country
+        country_customers = [customer for customer in customers if customer.country == test_country]
+        resp = self.app.patch('/customers',
+                              json={'selector': {'address': {'country': test_country}},
+                                    'changes': {'address': {'country': 'Atlantis'}}},
+                              content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.get_json()['updated'], len(country_customers))
+        resp = self.app.get('/customers', query_string='country=Atlantis')
+        self.assertEqual(len(resp.get_json()), len(country_customers))
+
+    def test_bulk_update_bad_changes(self):
+        """ Update many Customers with unknown fields """
+        resp = self.app.patch('/customers',
+                              json={'ids': ['1'], 'changes': {'password': 'secret'}},
+                              content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_get_metrics(self):
+        """ Get the service counters """
+        self.app.get('/customers/0')
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertIn('lookups', data)
+        self.assertIn('saved_calls', data['lookups'])
+        self.assertEqual(data['logging']['dropped'], 0)
+
+    def test_get_customer_from_response_cache(self):
+        """ Get a Customer from the response cache """
+        self.addCleanup(setattr, Customer, 'response_cache', Customer.response_cache)
+        Customer.response_cache = ResponseCache(1024 * 1024, 60, compress=True)
+        test_customer = self._create_customers(1)[0]
+        url = '/customers/{}'.format(test_customer._id)
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        etag = resp.headers['ETag']
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json()['firstname'], test_customer.firstname)
+        self.assertEqual(Customer.response_cache.hits, 1)
+        resp = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_304_NOT_MODIFIED)
+        resp = self.app.get(url + '/address', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        # an update must not be hidden by the cache
+        new_customer = test_customer.serialize()
+        new_customer['firstname'] = 'Isabel'
+        self.app.put(url, json=new_customer, content_type='application/json')
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json()['firstname'], 'Isabel')
+
+    def _use_job_queue(self, max_pending=100):
+        """ Turns on asynchronous writes with a temporary job queue """
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.addCleanup(setattr, Customer, 'jobs', Customer.jobs)
+        Customer.jobs = JobQueue(os.path.join(folder, 'jobs.db'), max_pending,
+                                 poll_interval=0.01)
+        self.addCleanup(Customer.jobs.stop)
+
+    def test_create_customer_async(self):
+        """ Create a Customer asynchronously """
+        self._use_job_queue()
+        test_customer = CustomerFactory()
+        resp = self.app.post('/customers',
+                             json=test_customer.serialize(),
+                             content_type='application/json',
+                             headers={'Prefer': 'respond-async'})
+        self.assertEqual(resp.status_code, HTTP_202_ACCEPTED)
+        location = resp.headers['Location']
+        for _ in range(500):
+            job = self.app.get(location).get_json()
+            if job['status'] == 'done':
+                break
+            time.sleep(0.01)
+        self.assertEqual(job['status'], 'done')
+        resp = self.app.get('/customers/{}'.format(job['customer_id']))
+        self.assertEqual(resp.get_json()['firstname'], test_customer.firstname)
+
+    def test_create_customer_async_queue_full(self):
+        """ Asynchronous writes are refused when the queue is full """
+        self._use_job_queue(max_pending=0)
+        resp = self.app.post('/customers',
+                             json=CustomerFactory().serialize(),
+                             content_type='application/json',
+                             headers={'Prefer': 'respond-async'})
+        self.assertEqual(resp.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', resp.headers)
+
+    def test_get_job_not_found(self):
+        """ Get a Job thats not found """
+        self._use_job_queue()
+        resp = self.app.get('/jobs/0')
+        self.assertEqual(resp.status_code, HTTP_404_NOT_FOUND)
+
+    def test_stream_changes_since(self):
+        """ Stream the changes since the start as NDJSON """
+        test_customer = self._create_customers(1)[0]
+        resp = self.app.get('/customers/changes',
+                            query_string='since=0&format=ndjson',
+                            buffered=False)
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        # skip the design documents written when the database was created
+        for line in resp.response:
+            event = json.loads(line.decode('utf-8'))
+            if event['id'] == test_customer._id:
+                break
+        resp.close()
+        self.assertEqual(event['type'], 'created')
+        self.assertEqual(event['id'], test_customer._id)
+        self.assertEqual(event['customer']['firstname'], test_customer.firstname)
+
+    def test_stream_changes_never_read(self):
+        """ A stream of changes that is never read doesn't keep a listener """
+        with app.test_request_context('/customers/changes'):
+            Customer.follow_changes()
+            listeners = Customer.follower.stats()['listeners']
+            resp = ChangesStream().get()
+            resp.close()
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(Customer.follower.stats()['listeners'], listeners)
+
+    @patch('service.resources.changes_stream.CHANGES_MAX_SUBSCRIBERS', 1)
+    def test_stream_changes_full(self):
+        """ Refuse streams beyond the limit, not counting the cache's listener """
+        with app.test_request_context('/customers/changes'):
+            first = ChangesStream().get()
+            self.addCleanup(first.close)
+            self.assertEqual(first.status_code, HTTP_200_OK)
+            _, code = ChangesStream().get()
+        self.assertEqual(code, HTTP_503_SERVICE_UNAVAILABLE)
+
     def test_method_not_allowed(self):
         """ Test Error Method Not Allowed """
         resp = self.app.get('/customers/1/unsubscribe')
@@ -0,0 +1,74 @@
+"""
+Test cases for the Load Shedder
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import unittest
+from mock import patch
+from service.shedding import LoadShedder
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestLoadShedder(unittest.TestCase):
+    """ Test Cases for shedding load """
+
+    def setUp(self):
+        self.now = 1000.0
+        clock = patch('service.shedding.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_disabled(self):
+        """ Without thresholds nothing is refused """
+        shedder = LoadShedder()
+        self.assertFalse(shedder.enabled)
+        shedder.observe(60)
+        shedder.begin()
+        self.assertIsNone(shedder.shed(True))
+        self.assertFalse(shedder.stats()['shedding_low_priority'])
+
+    def test_latency_percentile(self):
+        """ The latency is a percentile of the recent samples """
+        shedder = LoadShedder(max_latency=0.5)
+        self.assertIsNone(shedder.latency())
+        for milliseconds in range(1, 11):
+            shedder.observe(milliseconds / 1000.0)
+        self.assertEqual(shedder.latency(), 0.01)
+        self.assertEqual(shedder.stats()['latency_ms'], 10.0)
+
+    def test_slow_database(self):
+        """ Low priority requests are refused while the database is slow """
+        shedder = LoadShedder(max_latency=0.5, window=10)
+        for _ in range(10):
+            shedder.observe(2)
+        self.assertIn('latency', shedder.shed(True))
+        self.assertIsNone(shedder.shed(False))
+        self.assertTrue(shedder.stats()['shedding_low_priority'])
+        # old samples don't count
+        self.now += 11
+        self.assertIsNone(shedder.shed(True))
+        self.assertEqual(shedder.stats()['shed_low_priority'], 1)
+
+    def test_in_flight(self):
+        """ Busy workers refuse low priority requests first, then every request """
+        shedder = LoadShedder(low_priority_in_flight=2, max_in_flight=4)
+        shedder.begin()
+        self.assertIsNone(shedder.shed(True))
+        shedder.begin()
+        self.assertIsNotNone(shedder.shed(True))
+        self.assertIsNone(shedder.shed(False))
+        shedder.begin()
+        shedder.begin()
+        self.assertIsNotNone(shedder.shed(False))
+        shedder.end()
+        self.assertIsNone(shedder.shed(False))
+        stats = shedder.stats()
+        self.assertEqual(stats['in_flight'], 3)
+        self.assertEqual(stats['shed_low_priority'], 1)
+        self.assertEqual(stats['shed_all'], 1)
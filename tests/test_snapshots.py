@@ -0,0 +1,115 @@
+"""
+Test cases for Customer Snapshots
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import io
+import gzip
+import json
+import unittest
+from mock import patch
+from service.models import Customer
+from service.snapshots import SnapshotError, snapshot_chunks, read_snapshot, dump, restore
+from .databases import unique_database_name
+
+DOCUMENTS = [
+    {'_id': 'a1', '_rev': '1-x', 'firstname': 'Ann', 'lastname': 'Lee', 'email': 'ann@lee.com',
+     'subscribed': True, 'address': {'address1': '1 Main St', 'address2': '', 'city': 'Boston',
+                                     'province': 'MA', 'country': 'USA', 'zip': '02108'}},
+    {'_id': 'b2', '_rev': '3-y', 'firstname': 'Bob', 'lastname': 'Ray', 'email': 'bob@ray.com',
+     'subscribed': False, 'address': {'address1': '2 Elm St', 'address2': '4C', 'city': 'Austin',
+                                      'province': 'TX', 'country': 'USA', 'zip': '73301'}},
+]
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestSnapshotFormat(unittest.TestCase):
+    """ Test Cases for writing and reading snapshots """
+
+    def test_round_trip(self):
+        """ Documents come back from a snapshot without their revisions """
+        snapshot = b''.join(snapshot_chunks(iter(DOCUMENTS)))
+        lines = gzip.GzipFile(fileobj=io.BytesIO(snapshot)).read().decode('utf-8').splitlines()
+        self.assertEqual(len(lines), len(DOCUMENTS))
+        records = list(read_snapshot(io.BytesIO(snapshot)))
+        self.assertEqual([number for number, _ in records], [1, 2])
+        documents = [json.loads(line) for _, line in records]
+        self.assertEqual(documents[0]['_id'], 'a1')
+        self.assertNotIn('_rev', documents[1])
+
+    @patch('service.snapshots.CHUNK_SIZE', 100)
+    def test_chunks(self):
+        """ Large snapshots are produced a chunk at a time """
+        chunks = list(snapshot_chunks(iter(DOCUMENTS * 20)))
+        self.assertGreater(len(chunks), 1)
+        records = list(read_snapshot(io.BytesIO(b''.join(chunks))))
+        self.assertEqual(len(records), 40)
+
+    def test_empty_snapshot(self):
+        """ A snapshot of no documents has no records """
+        snapshot = b''.join(snapshot_chunks(iter([])))
+        self.assertEqual(list(read_snapshot(io.BytesIO(snapshot))), [])
+
+    def test_not_a_snapshot(self):
+        """ Files that aren't compressed are refused """
+        records = read_snapshot(io.BytesIO(b'{"firstname": "Ann"}\n'))
+        self.assertRaises(SnapshotError, list, records)
+
+
+class TestSnapshotDatabase(unittest.TestCase):
+    """ Test Cases for dumping and restoring a database """
+
+    def setUp(self):
+        """ Initialize a Cloudant database of this test's own """
+        Customer.init_db(unique_database_name('snapshottest'))
+
+    def tearDown(self):
+        """ Drop the database of the test """
+        Customer.drop_db()
+
+    def test_dump_and_restore(self):
+        """ Restoring a dump replaces the Customers with those dumped """
+        Customer.insert_many([dict((name, value) for name, value in document.items()
+                                   if name != '_rev') for document in DOCUMENTS])
+        output = io.BytesIO()
+        self.assertGreater(dump(output), 0)
+        Customer(firstname='Carl', lastname='Cox', email='carl@cox.com').create()
+        output.seek(0)
+        stats = restore(output, batch_size=1, workers=2)
+        self.assertEqual(stats['removed'], 3)
+        self.assertEqual(stats['imported'], 2)
+        self.assertEqual(stats['rejected'], 0)
+        self.assertEqual(sorted(customer.id for customer in Customer.all()), ['a1', 'b2'])
+        self.assertEqual(Customer.find('b2').address2, '4C')
+
+    def test_restore_rejects(self):
+        """ Invalid documents of a snapshot are rejected """
+        snapshot = b''.join(snapshot_chunks(iter([DOCUMENTS[0], {'_id': 'c3', 'firstname': ''}])))
+        rejects = io.StringIO()
+        stats = restore(io.BytesIO(snapshot), rejects=rejects)
+        self.assertEqual(stats['imported'], 1)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertIn('firstname', rejects.getvalue())
+
+    def test_restore_bad_file_keeps_customers(self):
+        """ Nothing is removed when the file isn't a snapshot """
+        Customer(firstname='Carl', lastname='Cox', email='carl@cox.com').create()
+        self.assertRaises(SnapshotError, restore, io.BytesIO(b'not a snapshot'))
+        self.assertEqual(len(Customer.all()), 1)
+
+    @patch('service.models.BULK_PAGE_SIZE', 2)
+    def test_remove_all_pages(self):
+        """ Remove all of the Customers a page at a time """
+        for number in range(5):
+            Customer(firstname='Fido{}'.format(number), lastname='Dog',
+                     email='fido{}@dog.com'.format(number)).create()
+        with patch.object(Customer, '_bulk_save', wraps=Customer._bulk_save) as bulk_save:
+            self.assertEqual(Customer.remove_all(), 5)
+        self.assertEqual(bulk_save.call_count, 3)
+        self.assertEqual(Customer.all(), [])